@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# TmLibrary - TissueMAPS library for distibuted image analysis routines.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Benchmark of polygon extraction from label images.
+
+Compares :meth:`SegmentationImage.extract_polygons <tmlib.image.SegmentationImage.extract_polygons>`,
+which traces the contours of all objects in a single pass, with the previous
+implementation, which traced the contour of each object separately, on
+synthetic label images with densely packed objects.
+
+Examples
+--------
+$ python benchmarks/bench_extract_polygons.py --size 2048 --objects 5000 10000
+'''
+from __future__ import print_function
+import time
+import logging
+import argparse
+import numpy as np
+import scipy.ndimage as ndi
+import mahotas as mh
+import cv2
+import shapely.geometry
+
+from tmlib.image import SegmentationImage
+
+logger = logging.getLogger(__name__)
+
+
+def create_label_image(size, n_objects, seed=0):
+    '''Creates a label image with densely packed, partially touching objects.
+
+    Parameters
+    ----------
+    size: int
+        number of pixels along each image axis
+    n_objects: int
+        number of objects
+    seed: int, optional
+        seed for the random number generator (default: ``0``)
+
+    Returns
+    -------
+    numpy.ndarray[numpy.int32]
+        label image
+    '''
+    rng = np.random.RandomState(seed)
+    markers = np.zeros((size, size), dtype=np.int32)
+    points = rng.randint(0, size, (n_objects, 2))
+    markers[points[:, 0], points[:, 1]] = np.arange(1, n_objects + 1)
+    distance, (i, j) = ndi.distance_transform_edt(
+        markers == 0, return_indices=True
+    )
+    labels = markers[i, j]
+    # Separate some of the objects by background and punch holes into others
+    labels[distance > rng.randint(6, 12)] = 0
+    for y, x in points[::20]:
+        labels[y:y+2, x:x+2] = 0
+    return labels
+
+
+def extract_polygons_per_label(array, y_offset, x_offset):
+    '''Reference implementation that traces the contour of each object
+    separately within its bounding box.'''
+    bboxes = mh.labeled.bbox(array)
+    # We set border pixels to zero to get closed contours for
+    # border objects. This may cause problems for very small objects
+    # at the border, because they may get lost.
+    # We recreate them later on (see below).
+    plane = array.copy()
+    plane[0, :] = 0
+    plane[-1, :] = 0
+    plane[:, 0] = 0
+    plane[:, -1] = 0
+
+    for label in np.unique(plane[plane > 0]):
+        bbox = bboxes[label]
+        obj_im = np.pad(
+            plane[bbox[0]:bbox[1], bbox[2]:bbox[3]],
+            (1, 1), 'constant', constant_values=(0)
+        )
+        logger.debug('find contour for object #%d', label)
+        # We could do this for all objects at once, but doing it on the
+        # bounding box for each object individually ensures that we get the
+        # correct number of objects and that polygons are in the
+        # correct order, i.e. sorted according to their corresponding label.
+        mask = obj_im == label
+        if np.sum(mask > 0) > 1:
+            # We need to remove single pixel extensions on the border of
+            # objects because they can lead to polygon self-intersections.
+            # However, this should only be done if the object is larger
+            # than 1 pixel.
+            mask = mh.open(mask)
+        # NOTE: OpenCV returns x, y coordinates. This means one would need
+        # to flip the axis for numpy-based indexing (y,x coordinates).
+        contours, hierarchy = cv2.findContours(
+            (mask).astype(np.uint8) * 255,
+            cv2.RETR_CCOMP,  # two-level hierarchy (holes)
+            cv2.CHAIN_APPROX_NONE
+        )[-2:]
+        if len(contours) == 0:
+            logger.warn('no contours identified for object #%d', label)
+            # This is most likely an object that does not extend
+            # beyond the line of border pixels.
+            # To ensure a correct number of objects we represent
+            # it by the smallest possible valid polygon.
+            coords = np.array(np.where(plane == label)).T
+            y, x = np.mean(coords, axis=0).astype(int)
+            shell = np.array([
+                [x-1, x+1, x+1, x-1, x-1],
+                [y-1, y-1, y+1, y+1, y-1]
+            ]).T
+            holes = None
+        elif len(contours) > 1:
+            # It may happens that more than one contour is
+            # identified per object, for example if the object
+            # has holes, i.e. enclosed background pixels.
+            logger.debug(
+                '%d contours identified for object #%d',
+                len(contours), label
+            )
+            holes = list()
+            for i in range(len(contours)):
+                child_idx = hierarchy[0][i][2]
+                parent_idx = hierarchy[0][i][3]
+                # There should only be two levels with one
+                # contour each.
+                if parent_idx >= 0:
+                    shell = np.squeeze(contours[parent_idx])
+                elif child_idx >= 0:
+                    holes.append(np.squeeze(contours[child_idx]))
+                else:
+                    # Same hierarchy level. This shouldn't happen.
+                    # Take only the largest one.
+                    lengths = [len(c) for c in contours]
+                    idx = lengths.index(np.max(lengths))
+                    shell = np.squeeze(contours[idx])
+                    break
+        else:
+            shell = np.squeeze(contours[0])
+            holes = None
+
+        if shell.ndim < 2 or shell.shape[0] < 3:
+            logger.warn('polygon doesn\'t have enough coordinates')
+            # In case the contour cannot be represented as a
+            # valid polygon we create a little square to not loose
+            # the object.
+            y, x = np.array(mask.shape) // 2
+            # Create a closed ring with coordinates sorted
+            # counter-clockwise
+            shell = np.array([
+                [x-1, x+1, x+1, x-1, x-1],
+                [y-1, y-1, y+1, y+1, y-1]
+            ]).T
+
+        # Add offset required due to alignment and cropping and
+        # invert the y-axis as required by Openlayers.
+        add_y = y_offset + bbox[0] - 1
+        add_x = x_offset + bbox[2] - 1
+        shell[:, 0] = shell[:, 0] + add_x
+        shell[:, 1] = -1 * (shell[:, 1] + add_y)
+        if holes is not None:
+            for i in range(len(holes)):
+                holes[i][:, 0] = holes[i][:, 0] + add_x
+                holes[i][:, 1] = -1 * (holes[i][:, 1] + add_y)
+        poly = shapely.geometry.Polygon(shell, holes)
+        if not poly.is_valid:
+            logger.warn(
+                'invalid polygon for object #%d - trying to fix it',
+                label
+            )
+            # In some cases there may be invalid intersections
+            # that can be fixed with the buffer trick.
+            poly = poly.buffer(0)
+            if not poly.is_valid:
+                raise ValueError(
+                    'Polygon of object #%d is invalid.' % label
+                )
+            if isinstance(poly, shapely.geometry.MultiPolygon):
+                logger.warn(
+                    'object #%d has multiple polygons - '
+                    'take largest', label
+                )
+                # Repair may create multiple polygons.
+                # We take the largest and discard the smaller ones.
+                areas = [g.area for g in poly.geoms]
+                index = areas.index(np.max(areas))
+                poly = poly.geoms[index]
+        yield (int(label), poly)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--size', type=int, default=2048,
+        help='number of pixels along each image axis'
+    )
+    parser.add_argument(
+        '--objects', type=int, nargs='+', default=[1000, 5000, 10000],
+        help='number of objects per image'
+    )
+    parser.add_argument(
+        '--repeats', type=int, default=3,
+        help='number of repetitions per measurement'
+    )
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print('%10s %10s %14s %14s %8s' % (
+        'objects', 'extracted', 'per-label [s]', 'single-pass [s]', 'speedup'
+    ))
+    for n in args.objects:
+        array = create_label_image(args.size, n)
+        image = SegmentationImage(array)
+        old_times = list()
+        new_times = list()
+        for _ in range(args.repeats):
+            start = time.time()
+            list(extract_polygons_per_label(array, 0, 0))
+            old_times.append(time.time() - start)
+            start = time.time()
+            polygons = list(image.extract_polygons(0, 0))
+            new_times.append(time.time() - start)
+        print('%10d %10d %14.3f %14.3f %8.1f' % (
+            n, len(polygons), min(old_times), min(new_times),
+            min(old_times) / min(new_times)
+        ))
+
+
+if __name__ == '__main__':
+    main()
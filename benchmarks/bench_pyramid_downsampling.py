@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# TmLibrary - TissueMAPS library for distibuted image analysis routines.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Benchmark of the creation of pyramid tiles at lower zoom levels.
+
+Compares three ways of downsampling the 2 x 2 tiles of the next higher zoom
+level into a single tile:
+
+    * "join": joining the tiles via :meth:`Image.join <tmlib.image.Image.join>`
+      and shrinking the mosaic via :meth:`Image.shrink <tmlib.image.Image.shrink>`
+      (previous implementation)
+    * "buffer": writing the tiles into a preallocated buffer and shrinking it
+      via :meth:`PyramidTile.create_from_mosaic <tmlib.image.PyramidTile.create_from_mosaic>`
+      (current implementation)
+    * "reshape": writing the tiles into a preallocated buffer and reducing it
+      by reshape + mean in NumPy
+
+All methods produce identical tiles.
+
+Examples
+--------
+$ python benchmarks/bench_pyramid_downsampling.py --tiles 2000
+'''
+from __future__ import print_function
+import time
+import argparse
+import numpy as np
+
+from tmlib.image import Image
+from tmlib.image import PyramidTile
+
+TILE_SIZE = PyramidTile.TILE_SIZE
+
+FACTOR = 2
+
+
+def downsample_join(tiles):
+    row_imgs = list()
+    for i in range(FACTOR):
+        row_img = Image(tiles[i * FACTOR])
+        for j in range(1, FACTOR):
+            row_img = row_img.join(Image(tiles[i * FACTOR + j]), 'x')
+        row_imgs.append(row_img)
+    mosaic_img = row_imgs[0]
+    for row_img in row_imgs[1:]:
+        mosaic_img = mosaic_img.join(row_img, 'y')
+    return PyramidTile(mosaic_img.shrink(FACTOR).array)
+
+
+def _fill(mosaic, tiles):
+    for i in range(FACTOR):
+        for j in range(FACTOR):
+            mosaic[
+                i * TILE_SIZE:(i + 1) * TILE_SIZE,
+                j * TILE_SIZE:(j + 1) * TILE_SIZE
+            ] = tiles[i * FACTOR + j]
+
+
+def downsample_buffer(tiles, mosaic):
+    _fill(mosaic, tiles)
+    return PyramidTile.create_from_mosaic(mosaic, FACTOR)
+
+
+def downsample_reshape(tiles, mosaic):
+    _fill(mosaic, tiles)
+    blocks = mosaic.reshape(TILE_SIZE, FACTOR, TILE_SIZE, FACTOR)
+    sums = blocks.sum(axis=(1, 3), dtype=np.uint16)
+    # Round half up
+    sums += FACTOR**2 // 2
+    sums //= FACTOR**2
+    return PyramidTile(sums.astype(np.uint8))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--tiles', type=int, default=2000,
+        help='number of tiles that should be created'
+    )
+    parser.add_argument(
+        '--repeats', type=int, default=3,
+        help='number of repetitions per measurement'
+    )
+    args = parser.parse_args()
+
+    rs = np.random.RandomState(0)
+    tiles = [
+        rs.randint(0, 256, (TILE_SIZE, TILE_SIZE)).astype(np.uint8)
+        for _ in range(FACTOR**2)
+    ]
+    mosaic = np.zeros((FACTOR * TILE_SIZE, FACTOR * TILE_SIZE), np.uint8)
+
+    expected = downsample_join(tiles).array
+    methods = [
+        ('join', lambda: downsample_join(tiles)),
+        ('buffer', lambda: downsample_buffer(tiles, mosaic)),
+        ('reshape', lambda: downsample_reshape(tiles, mosaic)),
+    ]
+    print('%10s %16s %10s %10s' % ('method', 'per tile [us]', 'speedup', 'equal'))
+    reference = None
+    for name, func in methods:
+        equal = np.array_equal(func().array, expected)
+        times = list()
+        for _ in range(args.repeats):
+            start = time.time()
+            for _ in range(args.tiles):
+                func()
+            times.append((time.time() - start) / args.tiles * 10**6)
+        if reference is None:
+            reference = min(times)
+        print('%10s %16.1f %10.2f %10s' % (
+            name, min(times), reference / min(times), equal
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# TmLibrary - TissueMAPS library for distibuted image analysis routines.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Benchmark of the codecs for encoding pixels of pyramid tiles.
+
+Encodes and decodes synthetic fluorescence tiles, i.e. blurred spots
+of varying brightness on a noisy background, with each codec
+(see :class:`TileCodec <tmlib.image.TileCodec>`) and reports
+
+    * time for encoding and decoding a tile
+    * mean size of an encoded tile and compression ratio relative to the
+      raw pixels
+    * mean and maximal absolute difference between original and decoded
+      pixels
+
+Codecs that are not available, e.g. "zstd" when the "zstandard" package
+is not installed, are skipped.
+
+Examples
+--------
+$ python benchmarks/bench_tile_codecs.py --tiles 200
+$ python benchmarks/bench_tile_codecs.py --bit-depth 16 --codecs png:1 zstd:3
+'''
+from __future__ import print_function
+import time
+import argparse
+import numpy as np
+import cv2
+
+from tmlib.image import PyramidTile
+from tmlib.image import TileCodec
+
+TILE_SIZE = PyramidTile.TILE_SIZE
+
+CODECS = [
+    'jpeg:95', 'jpeg:85', 'jpeg:75', 'webp:95', 'webp:80', 'webp:101',
+    'png:1', 'png:3', 'png:9', 'zstd:1', 'zstd:3', 'zstd:9'
+]
+
+
+def create_tiles(n, bit_depth, seed=0):
+    rs = np.random.RandomState(seed)
+    max_value = 2**bit_depth - 1
+    dtype = np.uint8 if bit_depth == 8 else np.uint16
+    tiles = list()
+    for i in range(n):
+        spots = np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.float32)
+        n_spots = rs.randint(0, 30)
+        y = rs.randint(0, TILE_SIZE, n_spots)
+        x = rs.randint(0, TILE_SIZE, n_spots)
+        spots[y, x] = rs.uniform(0.2, 1.0, n_spots)
+        spots = cv2.GaussianBlur(spots, (0, 0), rs.uniform(4, 10))
+        if spots.max() > 0:
+            spots /= spots.max()
+        background = rs.normal(0.05, 0.01, spots.shape)
+        array = np.clip(spots + background, 0, 1) * max_value
+        tiles.append(PyramidTile(array.astype(dtype)))
+    return tiles
+
+
+def measure(func, items, repeats):
+    times = list()
+    for _ in range(repeats):
+        start = time.time()
+        results = [func(item) for item in items]
+        times.append((time.time() - start) / len(items) * 10**6)
+    return min(times), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--tiles', type=int, default=200,
+        help='number of tiles that should be encoded'
+    )
+    parser.add_argument(
+        '--bit-depth', type=int, default=8, choices={8, 16},
+        help='bit depth of the tiles'
+    )
+    parser.add_argument(
+        '--codecs', nargs='+', default=CODECS,
+        help='tags of the codecs that should be compared'
+    )
+    parser.add_argument(
+        '--repeats', type=int, default=3,
+        help='number of repetitions per measurement'
+    )
+    args = parser.parse_args()
+
+    tiles = create_tiles(args.tiles, args.bit_depth)
+    raw_size = float(tiles[0].array.nbytes)
+
+    print('%10s %14s %14s %12s %8s %10s %10s' % (
+        'codec', 'encode [us]', 'decode [us]', 'size [B]', 'ratio',
+        'mean err', 'max err'
+    ))
+    for tag in args.codecs:
+        codec = TileCodec.create_from_tag(tag)
+        try:
+            encode_time, buffers = measure(
+                lambda t: t.encode(codec), tiles, args.repeats
+            )
+            decode_time, decoded = measure(
+                PyramidTile.create_from_buffer, buffers, args.repeats
+            )
+        except ImportError as error:
+            print('%10s %s' % (tag, str(error)))
+            continue
+        size = np.mean([b.size for b in buffers])
+        errors = [
+            np.abs(t.array.astype(int) - d.array.astype(int))
+            for t, d in zip(tiles, decoded)
+        ]
+        print('%10s %14.1f %14.1f %12.0f %8.2f %10.3f %10d' % (
+            codec.tag, encode_time, decode_time, size, raw_size / size,
+            np.mean([e.mean() for e in errors]),
+            np.max([e.max() for e in errors])
+        ))
+
+
+if __name__ == '__main__':
+    main()
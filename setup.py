@@ -196,6 +196,9 @@ setuptools.setup(
         ],
        'jterator_matlab_modules': [
            'matlab-wrapper>=0.9.6', # Requires Matlab
+        ],
+       'zstd_tile_codec': [
+           'zstandard>=0.8.0'
         ]
     },
     dependency_links=[
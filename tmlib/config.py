@@ -235,6 +235,7 @@ class LibraryConfig(TmapsConfig):
         self.modules_home = '~/jtmodules'
         self.formats_home = '~/tmformats'
         self.storage_home = '/storage/filesystem'
+        self.tile_storage = 'database'
         self._resource = None
         self.read()
 
@@ -301,6 +302,28 @@ class LibraryConfig(TmapsConfig):
             )
         self._config.set(self._section, 'storage_home', str(value))
 
+    @property
+    def tile_storage(self):
+        '''str: backend for storage of pyramid tiles of channel layers;
+        either ``"database"`` for the distributed database table or
+        ``"archive"`` for packed archives in the channel directories on the
+        file system (default: ``"database"``)
+        '''
+        return self._config.get(self._section, 'tile_storage')
+
+    @tile_storage.setter
+    def tile_storage(self, value):
+        if not isinstance(value, basestring):
+            raise TypeError(
+                'Configuration parameter "tile_storage" must have type str.'
+            )
+        if value not in {'database', 'archive'}:
+            raise ValueError(
+                'Configuration parameter "tile_storage" must be either '
+                '"database" or "archive".'
+            )
+        self._config.set(self._section, 'tile_storage', str(value))
+
     @property
     def formats_home(self):
         '''str: absolute path to the root directory of local copy of
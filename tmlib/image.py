@@ -14,13 +14,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
+import struct
+import collections
 import numpy as np
 import scipy.ndimage as ndi
 import cv2
 import mahotas as mh
 import skimage.measure
 import skimage.color
-import skimage.draw
 import shapely.geometry
 from geoalchemy2.shape import to_shape
 from abc import ABCMeta
@@ -148,6 +149,11 @@ class Image(object):
         -------
         tmlib.image.Image
             extracted image with dimensions `height` x `width`
+
+        Note
+        ----
+        The pixels array of the extracted image is a view of the pixels array
+        of the image, i.e. pixels are not copied.
         '''
         array = self.array[y_offset:(y_offset+height), x_offset:(x_offset+width)]
         return self.__class__(array, self.metadata)
@@ -269,19 +275,21 @@ class Image(object):
         '''
         height, width = self.dimensions
         if side == 'top':
-            array = np.zeros((n, width), dtype=self.dtype)
-            array = np.vstack([array, self.array])
+            shape = (height + n, width)
+            dst = (slice(n, None), slice(None))
         elif side == 'bottom':
-            array = np.zeros((n, width), dtype=self.dtype)
-            array = np.vstack([self.array, array])
+            shape = (height + n, width)
+            dst = (slice(None, height), slice(None))
         elif side == 'left':
-            array = np.zeros((height, n), dtype=self.dtype)
-            array = np.hstack([array, self.array])
+            shape = (height, width + n)
+            dst = (slice(None), slice(n, None))
         elif side == 'right':
-            array = np.zeros((height, n), dtype=self.dtype)
-            array = np.hstack([self.array, array])
+            shape = (height, width + n)
+            dst = (slice(None), slice(None, width))
         else:
             raise ValueError('Unknown side.')
+        array = np.zeros(shape, dtype=self.dtype)
+        array[dst] = self.array
         return self.__class__(array, self.metadata)
 
     def smooth(self, sigma, inplace=True):
@@ -333,7 +341,7 @@ class Image(object):
         height, width = self.dimensions
         # NOTE: OpenCV uses (x, y) instead of (y, x)
         array = cv2.resize(
-            self.array, (width/factor, height/factor),
+            self.array, (width // factor, height // factor),
             interpolation=cv2.INTER_AREA
         )
         if inplace:
@@ -370,7 +378,8 @@ class Image(object):
         Returns
         -------
         numpy.array
-            potentially shifted and cropped image
+            potentially shifted and cropped image; a view of `img` when the
+            image gets cropped or doesn't need to be shifted
 
         Raises
         ------
@@ -378,26 +387,17 @@ class Image(object):
             when shift or overhang values are too extreme
         '''
         try:
-            row_start = top - y
-            row_end = bottom + y
-            if row_end == 0:
-                row_end = img.shape[0]
-            else:
-                row_end = -row_end
-            col_start = left - x
-            col_end = right + x
-            if col_end == 0:
-                col_end = img.shape[1]
-            else:
-                col_end = -col_end
+            src, dst = Image._get_shift_and_crop_slices(
+                img.shape, y, x, bottom, top, right, left, crop
+            )
             if crop:
-                aligned_im = img[row_start:row_end, col_start:col_end]
+                aligned_im = img[src]
+            elif not any([y, x, bottom, top, right, left]):
+                # Nothing to shift or to pad
+                aligned_im = img
             else:
                 aligned_im = np.zeros(img.shape, dtype=img.dtype)
-                extracted_im = img[row_start:row_end, col_start:col_end]
-                row_end = top + extracted_im.shape[0]
-                col_end = left + extracted_im.shape[1]
-                aligned_im[top:row_end, left:col_end] = extracted_im
+                aligned_im[dst] = img[src]
             return aligned_im
         except IndexError as e:
             raise IndexError(
@@ -410,6 +410,65 @@ class Image(object):
                 'Reason: %s' % str(e)
             )
 
+    @staticmethod
+    def _get_shift_and_crop_slices(shape, y, x, bottom, top, right, left,
+            crop=True):
+        '''Determines the part of an image that remains after shifting and
+        cropping and the position where it has to be placed in the aligned
+        image.
+
+        Parameters
+        ----------
+        shape: Tuple[int]
+            dimensions of the image
+        y: int
+            shift in y direction
+        x: int
+            shift in x direction
+        bottom: int
+            pixels to crop at the bottom
+        top: int
+            pixels to crop at the top
+        right: int
+            pixels to crop at the right
+        left: int
+            pixels to crop at the left
+        crop: bool, optional
+            whether image should cropped or rather padded with zero valued pixels
+            (default: ``True``)
+
+        Returns
+        -------
+        Tuple[Tuple[slice]]
+            slices of the original image and of the aligned image
+
+        See also
+        --------
+        :meth:`tmlib.image.Image._shift_and_crop`
+        '''
+        row_start = top - y
+        row_end = bottom + y
+        if row_end == 0:
+            row_end = shape[0]
+        else:
+            row_end = -row_end
+        col_start = left - x
+        col_end = right + x
+        if col_end == 0:
+            col_end = shape[1]
+        else:
+            col_end = -col_end
+        src = (slice(row_start, row_end), slice(col_start, col_end))
+        if crop:
+            dst = (slice(None), slice(None))
+        else:
+            start, stop, _ = src[0].indices(shape[0])
+            height = max(stop - start, 0)
+            start, stop, _ = src[1].indices(shape[1])
+            width = max(stop - start, 0)
+            dst = (slice(top, top + height), slice(left, left + width))
+        return (src, dst)
+
     def align(self, crop=True, inplace=True):
         '''Aligns, i.e. shifts and optionally crops, an image based on
         pre-calculated shift and residue values.
@@ -522,14 +581,35 @@ class ChannelImage(Image):
             lower_bound = np.min(img)
         if upper_bound is None:
             upper_bound = np.max(img)
+        lut = ChannelImage._create_uint8_lut(lower_bound, upper_bound)
+        return lut[img]
+
+    @staticmethod
+    def _create_uint8_lut(lower_bound, upper_bound):
+        '''Creates a lookup table for the conversion of 16-bit pixel values to
+        8-bit, where values in the range [`lower_bound`, `upper_bound`] are
+        linearly mapped to the range [0, 255] and values outside of the range
+        are clipped.
+
+        Parameters
+        ----------
+        lower_bound: int
+            lower bound of the range that should be mapped to ``[0, 255]``
+        upper_bound: int
+            upper bound of the range that should be mapped to ``[0, 255]``
+
+        Returns
+        -------
+        numpy.ndarray[uint8]
+            lookup table with 65536 elements
+        '''
         if lower_bound >= upper_bound:
             raise ValueError('"lower_bound" must be smaller than "upper_bound"')
-        lut = np.concatenate([
-            np.zeros(lower_bound, dtype=np.uint16),
-            np.linspace(0, 255, upper_bound - lower_bound).astype(np.uint16),
-            np.ones(2**16 - upper_bound, dtype=np.uint16) * 255
+        return np.concatenate([
+            np.zeros(lower_bound, dtype=np.uint8),
+            np.linspace(0, 255, upper_bound - lower_bound).astype(np.uint8),
+            np.ones(2**16 - upper_bound, dtype=np.uint8) * 255
         ])
-        return lut[img].astype(np.uint8)
 
     def scale(self, lower, upper, inplace=True):
         '''Scales values to 8-bit such that the range [`lower`, `upper`]
@@ -693,6 +773,188 @@ class ChannelImage(Image):
         return cv2.imencode('.tif', self.array)[1]
 
 
+class ChannelImageProcessor(object):
+
+    '''Class for processing a series of channel images in a single pass.
+
+    Illumination correction, alignment, clipping and rescaling of
+    a :class:`ChannelImage <tmlib.image.ChannelImage>` are fused into one
+    processing chain that doesn't create any full-size temporary arrays:
+    the correction is performed in single precision on scratch buffers that
+    are allocated once and reused for all subsequent images of the same size
+    and clipping and rescaling are combined into one precomputed lookup table.
+
+    Note
+    ----
+    Results may differ from those obtained with
+    :meth:`ChannelImage.correct <tmlib.image.ChannelImage.correct>` by one
+    intensity value because of the reduced floating point precision.
+    Corrected values are clipped to the range of the image data type.
+    '''
+
+    def __init__(self, stats=None, clip_min=None, clip_max=None, align=False,
+            crop=True):
+        '''
+        Parameters
+        ----------
+        stats: tmlib.image.IllumstatsContainer, optional
+            illumination statistics that should be used to correct images;
+            images won't be corrected if not provided
+        clip_min: int, optional
+            value below which pixel values of 16-bit images should be clipped
+            before rescaling them to 8-bit
+        clip_max: int, optional
+            value above which pixel values of 16-bit images should be clipped
+            before rescaling them to 8-bit; images won't be clipped and
+            rescaled if neither `clip_min` nor `clip_max` is provided
+        align: bool, optional
+            whether images should be aligned (default: ``False``)
+        crop: bool, optional
+            whether aligned images should be cropped or rather padded with
+            zero values (default: ``True``)
+        '''
+        if stats is not None:
+            if not isinstance(stats, IllumstatsContainer):
+                raise TypeError(
+                    'Argument "stats" must have type '
+                    'tmlib.image.IllumstatsContainer.'
+                )
+            mean = stats.mean.array
+            std = stats.std.array
+            # (log(img) - mean) / std * mean(std) + mean(mean) is expressed
+            # as log(img) * factor + summand.
+            factor = np.mean(std) / std
+            self._factor = factor.astype(np.float32)
+            self._summand = (np.mean(mean) - mean * factor).astype(np.float32)
+            with np.errstate(divide='ignore'):
+                self._log_lut = np.log10(
+                    np.arange(2**16, dtype=np.float64)
+                ).astype(np.float32)
+            self._log_lut[0] = -10
+        if clip_min is None and clip_max is None:
+            self._scale_lut = None
+        else:
+            if clip_min is None:
+                clip_min = 0
+            if clip_max is None:
+                clip_max = 2**16 - 1
+            if not(0 <= clip_min < 2**16 and 0 <= clip_max < 2**16):
+                raise ValueError(
+                    'Arguments "clip_min" and "clip_max" must be in the '
+                    'range [0, 65535].'
+                )
+            self._scale_lut = ChannelImage._create_uint8_lut(
+                clip_min, clip_max
+            )
+        self.stats = stats
+        self.align = align
+        self.crop = crop
+        self._buffers = dict()
+
+    def _get_buffer(self, shape, dtype):
+        key = (shape, np.dtype(dtype).str)
+        if key not in self._buffers:
+            self._buffers[key] = np.empty(shape, dtype)
+        return self._buffers[key]
+
+    def _correct_illumination(self, img):
+        if img.shape != self._factor.shape:
+            raise ValueError(
+                'Image and illumination statistics must have the same '
+                'dimensions.'
+            )
+        buf = self._get_buffer(img.shape, np.float32)
+        np.take(self._log_lut, img, out=buf)
+        buf *= self._factor
+        buf += self._summand
+        np.power(10, buf, out=buf)
+        np.clip(buf, 0, np.iinfo(img.dtype).max, out=buf)
+        corrected = self._get_buffer(img.shape, img.dtype)
+        np.copyto(corrected, buf, casting='unsafe')
+        return corrected
+
+    def process(self, image, out=None):
+        '''Processes an image.
+
+        Parameters
+        ----------
+        image: tmlib.image.ChannelImage
+            image that should be processed
+        out: numpy.ndarray, optional
+            array into which the processed pixels should be written; must have
+            the dimensions of the processed image and type ``numpy.uint8`` in
+            case the image gets rescaled or the type of `image` otherwise
+            (by default a new array is allocated)
+
+        Returns
+        -------
+        tmlib.image.ChannelImage
+            processed image
+
+        Raises
+        ------
+        ValueError
+            when channel doesn't match between illumination statistics and
+            image or when `out` doesn't have the correct dimensions or type
+        '''
+        if not isinstance(image, ChannelImage):
+            raise TypeError(
+                'Argument "image" must have type tmlib.image.ChannelImage.'
+            )
+        array = image.array
+        md = image.metadata
+        if self.stats is not None:
+            if (self.stats.mean.metadata.channel_id != md.channel_id or
+                    self.stats.std.metadata.channel_id != md.channel_id):
+                raise ValueError('Channels don\'t match!')
+            array = self._correct_illumination(array)
+        if self.align:
+            if md is None:
+                raise AttributeError(
+                    'Image requires attribute "metadata" for alignment.'
+                )
+            src, dst = Image._get_shift_and_crop_slices(
+                array.shape, y=md.y_shift, x=md.x_shift,
+                bottom=md.bottom_residue, top=md.top_residue,
+                right=md.right_residue, left=md.left_residue, crop=self.crop
+            )
+            if self.crop:
+                shape = array[src].shape
+            else:
+                shape = array.shape
+        else:
+            src = dst = (slice(None), slice(None))
+            shape = array.shape
+        rescale = self._scale_lut is not None and array.dtype == np.uint16
+        if rescale:
+            dtype = np.uint8
+        else:
+            dtype = array.dtype
+        if out is None:
+            out = np.zeros(shape, dtype)
+        else:
+            if out.shape != shape or out.dtype != dtype:
+                raise ValueError(
+                    'Argument "out" must have dimensions %s and type %s.'
+                    % (str(shape), np.dtype(dtype).name)
+                )
+            if self.align and not self.crop:
+                out[...] = 0
+        if rescale:
+            np.take(self._scale_lut, array[src], out=out[dst])
+        else:
+            out[dst] = array[src]
+        if md is not None:
+            if self.stats is not None:
+                md.is_corrected = True
+            if self.align:
+                md.is_aligned = True
+            if rescale:
+                md.is_clipped = True
+                md.is_rescaled = True
+        return ChannelImage(out, md)
+
+
 class SegmentationImage(Image):
 
     '''Class for a segmentation image: a labeled image where each segmented
@@ -764,17 +1026,94 @@ class SegmentationImage(Image):
             created image
         '''
         array = np.zeros(dimensions, dtype=np.int32)
+        labels = list()
+        contours = list()
         for label, geometry in polygons:
             poly = to_shape(geometry)
-            coordinates = np.array(poly.exterior.coords).astype(int)
-            x, y = np.split(coordinates, 2, axis=1)
-            y *= -1
-            x -= x_offset
-            y -= y_offset
-            y, x = skimage.draw.polygon(y, x, dimensions)
-            array[y, x] = label
+            labels.append(label)
+            contours.append(np.array(poly.exterior.coords).astype(int))
+        if contours:
+            coordinates = np.concatenate(contours)
+            y = -coordinates[:, 1] - y_offset
+            x = coordinates[:, 0] - x_offset
+            n_vertices = np.array([len(c) for c in contours])
+            cls._fill_polygons(array, y, x, n_vertices, np.array(labels))
         return cls(array, metadata)
 
+    @staticmethod
+    def _fill_polygons(array, y, x, n_vertices, labels):
+        '''Fills the interior of polygons with their labels.
+
+        All polygons are rasterized at once using a scanline algorithm,
+        which determines the same pixels as :func:`skimage.draw.polygon`:
+        a pixel lies within a polygon if a ray cast from its center in
+        positive *x* direction crosses the contour an odd number of times.
+        Where polygons overlap, pixels get assigned the label of the polygon
+        that comes last.
+
+        Parameters
+        ----------
+        array: numpy.ndarray[numpy.int32]
+            label image that should be filled in place
+        y: numpy.ndarray[int]
+            y-coordinates of the contour vertices of all polygons
+        x: numpy.ndarray[int]
+            x-coordinates of the contour vertices of all polygons
+        n_vertices: numpy.ndarray[int]
+            number of vertices of each polygon
+        labels: numpy.ndarray[int]
+            label of each polygon
+        '''
+        height, width = array.shape
+        n = np.sum(n_vertices)
+        polygon_index = np.repeat(np.arange(len(n_vertices)), n_vertices)
+        # Each vertex forms an edge with the preceding vertex of the same
+        # polygon and the first vertex with the last one.
+        ends = np.cumsum(n_vertices)
+        previous = np.arange(n) - 1
+        previous[ends - n_vertices] = ends - 1
+        # An edge crosses the rows in the half-open interval between the
+        # y-coordinates of its vertices, restricted to rows of the image.
+        lower = np.maximum(np.minimum(y, y[previous]), 0)
+        upper = np.minimum(np.maximum(y, y[previous]), height)
+        n_rows = np.maximum(upper - lower, 0)
+        edges = np.repeat(np.arange(n), n_rows)
+        rows = (
+            np.arange(np.sum(n_rows)) +
+            np.repeat(lower - (np.cumsum(n_rows) - n_rows), n_rows)
+        )
+        yi = y[edges]
+        xi = x[edges]
+        yj = y[previous][edges]
+        xj = x[previous][edges]
+        crossings = (
+            ((xj - xi) * (rows - yi)).astype(np.float64) / (yj - yi) + xi
+        )
+        # Crossings of each row of a polygon come in pairs delimiting
+        # the pixels that lie inside the polygon.
+        order = np.lexsort((crossings, rows, polygon_index[edges]))
+        edges = edges[order]
+        rows = rows[order]
+        crossings = crossings[order]
+        starts = np.clip(np.ceil(crossings[0::2]), 0, width).astype(np.int64)
+        stops = np.clip(np.ceil(crossings[1::2]), 0, width).astype(np.int64)
+        rows = rows[0::2]
+        span_labels = labels[polygon_index[edges[0::2]]]
+        lengths = np.maximum(stops - starts, 0)
+        offsets = rows * width + starts - (np.cumsum(lengths) - lengths)
+        index = np.arange(np.sum(lengths)) + np.repeat(offsets, lengths)
+        values = np.repeat(span_labels, lengths)
+        counts = np.bincount(index, minlength=array.size)
+        is_overlapping = counts[index] > 1
+        if np.any(is_overlapping):
+            # Only the last occurrence of a pixel must be assigned.
+            positions = np.nonzero(is_overlapping)[0][::-1]
+            _, first = np.unique(index[positions], return_index=True)
+            is_overlapping[positions[first]] = False
+            index = index[~is_overlapping]
+            values = values[~is_overlapping]
+        array.ravel()[index] = values
+
     def extract_polygons(self, y_offset, x_offset):
         '''Creates a polygon representation for each segmented object.
         The coordinates of the polygon contours are relative to the global map,
@@ -792,8 +1131,14 @@ class SegmentationImage(Image):
         -------
         Generator[Tuple[Union[int, shapely.geometry.polygon.Polygon]]]
             label and geometry for each segmented object
+
+        Note
+        ----
+        Contours of all objects are traced in a single pass over the image
+        (see :meth:`_trace_contours <tmlib.image.SegmentationImage._trace_contours>`)
+        rather than separately for each object.
         '''
-        bboxes = mh.labeled.bbox(self.array)
+        bboxes = ndi.find_objects(self.array)
         # We set border pixels to zero to get closed contours for
         # border objects. This may cause problems for very small objects
         # at the border, because they may get lost.
@@ -804,76 +1149,50 @@ class SegmentationImage(Image):
         plane[:, 0] = 0
         plane[:, -1] = 0
 
-        for label in np.unique(plane[plane > 0]):
-            bbox = bboxes[label]
-            obj_im = self._get_bbox_image(plane, bbox)
+        areas = np.bincount(plane.ravel())
+        areas[0] = 0
+        labels = np.nonzero(areas)[0]
+        shells, holes = self._trace_contours(plane, labels, areas)
+
+        for label in labels:
+            bbox = bboxes[label - 1]
             logger.debug('find contour for object #%d', label)
-            # We could do this for all objects at once, but doing it on the
-            # bounding box for each object individually ensures that we get the
-            # correct number of objects and that polygons are in the
-            # correct order, i.e. sorted according to their corresponding label.
-            mask = obj_im == label
-            if np.sum(mask > 0) > 1:
-                # We need to remove single pixel extensions on the border of
-                # objects because they can lead to polygon self-intersections.
-                # However, this should only be done if the object is larger
-                # than 1 pixel.
-                mask = mh.open(mask)
-            # NOTE: OpenCV returns x, y coordinates. This means one would need
-            # to flip the axis for numpy-based indexing (y,x coordinates).
-            _, contours, hierarchy = cv2.findContours(
-                (mask).astype(np.uint8) * 255,
-                cv2.RETR_CCOMP,  # two-level hierarchy (holes)
-                cv2.CHAIN_APPROX_NONE
-            )
-            if len(contours) == 0:
+            if label not in shells:
                 logger.warn('no contours identified for object #%d', label)
                 # This is most likely an object that does not extend
                 # beyond the line of border pixels.
                 # To ensure a correct number of objects we represent
                 # it by the smallest possible valid polygon.
-                coords = np.array(np.where(plane == label)).T
+                coords = np.array(np.where(plane[bbox] == label)).T
                 y, x = np.mean(coords, axis=0).astype(int)
+                y += bbox[0].start
+                x += bbox[1].start
                 shell = np.array([
                     [x-1, x+1, x+1, x-1, x-1],
                     [y-1, y-1, y+1, y+1, y-1]
                 ]).T
-                holes = None
-            elif len(contours) > 1:
-                # It may happens that more than one contour is
-                # identified per object, for example if the object
-                # has holes, i.e. enclosed background pixels.
-                logger.debug(
-                    '%d contours identified for object #%d',
-                    len(contours), label
-                )
-                holes = list()
-                for i in range(len(contours)):
-                    child_idx = hierarchy[0][i][2]
-                    parent_idx = hierarchy[0][i][3]
-                    # There should only be two levels with one
-                    # contour each.
-                    if parent_idx >= 0:
-                        shell = np.squeeze(contours[parent_idx])
-                    elif child_idx >= 0:
-                        holes.append(np.squeeze(contours[child_idx]))
-                    else:
-                        # Same hierarchy level. This shouldn't happen.
-                        # Take only the largest one.
-                        lengths = [len(c) for c in contours]
-                        idx = lengths.index(np.max(lengths))
-                        shell = np.squeeze(contours[idx])
-                        break
+                object_holes = None
             else:
-                shell = np.squeeze(contours[0])
-                holes = None
+                if len(shells[label]) > 1:
+                    # It may happen that more than one outer contour is
+                    # identified per object, for example when the object
+                    # falls apart upon removal of single pixel extensions.
+                    # Take only the largest one.
+                    logger.debug(
+                        '%d contours identified for object #%d',
+                        len(shells[label]), label
+                    )
+                lengths = [len(c) for _, c in shells[label]]
+                key, shell = shells[label][lengths.index(max(lengths))]
+                object_holes = holes.get(key)
 
             if shell.ndim < 2 or shell.shape[0] < 3:
                 logger.warn('polygon doesn\'t have enough coordinates')
                 # In case the contour cannot be represented as a
                 # valid polygon we create a little square to not loose
                 # the object.
-                y, x = np.array(mask.shape) / 2
+                y = bbox[0].start - 1 + (bbox[0].stop - bbox[0].start + 2) // 2
+                x = bbox[1].start - 1 + (bbox[1].stop - bbox[1].start + 2) // 2
                 # Create a closed ring with coordinates sorted
                 # counter-clockwise
                 shell = np.array([
@@ -883,15 +1202,15 @@ class SegmentationImage(Image):
 
             # Add offset required due to alignment and cropping and
             # invert the y-axis as required by Openlayers.
-            add_y = y_offset + bbox[0] - 1
-            add_x = x_offset + bbox[2] - 1
-            shell[:, 0] = shell[:, 0] + add_x
-            shell[:, 1] = -1 * (shell[:, 1] + add_y)
-            if holes is not None:
-                for i in range(len(holes)):
-                    holes[i][:, 0] = holes[i][:, 0] + add_x
-                    holes[i][:, 1] = -1 * (holes[i][:, 1] + add_y)
-            poly = shapely.geometry.Polygon(shell, holes)
+            shell[:, 0] = shell[:, 0] + x_offset
+            shell[:, 1] = -1 * (shell[:, 1] + y_offset)
+            if object_holes is not None:
+                for i in range(len(object_holes)):
+                    object_holes[i][:, 0] = object_holes[i][:, 0] + x_offset
+                    object_holes[i][:, 1] = -1 * (
+                        object_holes[i][:, 1] + y_offset
+                    )
+            poly = shapely.geometry.Polygon(shell, object_holes)
             if not poly.is_valid:
                 logger.warn(
                     'invalid polygon for object #%d - trying to fix it',
@@ -917,21 +1236,339 @@ class SegmentationImage(Image):
             yield (int(label), poly)
 
     @staticmethod
-    def _get_bbox_image(img, bbox):
-        return np.lib.pad(
-            img[bbox[0]:bbox[1], bbox[2]:bbox[3]],
-            (1, 1), 'constant', constant_values=(0)
+    def _group_non_adjacent_objects(plane, labels):
+        '''Assigns objects to groups such that objects of the same group
+        don't touch each other, i.e. are separated by at least one background
+        pixel (8-connectivity).
+
+        Parameters
+        ----------
+        plane: numpy.ndarray[numpy.int32]
+            labeled pixels array
+        labels: numpy.ndarray[int]
+            sorted labels of objects contained in `plane`
+
+        Returns
+        -------
+        numpy.ndarray[numpy.int32]
+            one-based group index for each label (lookup table with
+            ``labels.max() + 1`` elements; background maps to zero)
+        '''
+        n = labels[-1] + 1 if len(labels) > 0 else 1
+        is_object = plane > 0
+        pairs = list()
+        # Pairs of neighbouring pixels: right, below, lower right, lower left
+        neighbourhood = (
+            (np.s_[:, :-1], np.s_[:, 1:]),
+            (np.s_[:-1, :], np.s_[1:, :]),
+            (np.s_[:-1, :-1], np.s_[1:, 1:]),
+            (np.s_[:-1, 1:], np.s_[1:, :-1])
         )
+        for i, j in neighbourhood:
+            a = plane[i]
+            b = plane[j]
+            index = (a != b) & is_object[i] & is_object[j]
+            a = a[index].astype(np.int64)
+            b = b[index].astype(np.int64)
+            pairs.append(a * n + b)
+            pairs.append(b * n + a)
+        pairs = np.unique(np.concatenate(pairs))
+        objects = pairs // n
+        neighbours = (pairs % n).tolist()
+        ends = np.searchsorted(objects, labels, 'right').tolist()
+
+        # Greedy coloring of the adjacency graph: each object is assigned the
+        # smallest group index that is not yet used by any of its neighbours.
+        groups = [0] * n
+        start = 0
+        for label, end in zip(labels.tolist(), ends):
+            used = set([groups[k] for k in neighbours[start:end]])
+            g = 1
+            while g in used:
+                g += 1
+            groups[label] = g
+            start = end
+        return np.array(groups, dtype=np.int32)
+
+    @classmethod
+    def _trace_contours(cls, plane, labels, areas):
+        '''Traces the outer contours and holes of all objects.
+
+        Objects are assigned to a small number of groups of non-touching
+        objects, such that the contours of all objects of a group can be
+        found with a single call to :func:`cv2.findContours` on the whole
+        image.
+
+        Parameters
+        ----------
+        plane: numpy.ndarray[numpy.int32]
+            labeled pixels array with zero valued border pixels
+        labels: numpy.ndarray[int]
+            sorted labels of objects contained in `plane`
+        areas: numpy.ndarray[int]
+            number of pixels of each object in `plane` indexable by label
+
+        Returns
+        -------
+        Tuple[Dict[int, List[Tuple[Union[Tuple[int], numpy.ndarray]]]], Dict[Tuple[int], List[numpy.ndarray]]]
+            outer contours for each label together with a key for each
+            contour and holes for each contour key; coordinates are
+            *x*, *y* pixel positions in `plane`
+        '''
+        shells = collections.defaultdict(list)
+        holes = collections.defaultdict(list)
+        if len(labels) == 0:
+            return (shells, holes)
+        groups = cls._group_non_adjacent_objects(plane, labels)
+        # We need to remove single pixel extensions on the border of
+        # objects because they can lead to polygon self-intersections.
+        # However, this should only be done if the object is larger
+        # than 1 pixel.
+        is_single_pixel = areas == 1
+        is_single_pixel = is_single_pixel[plane]
+        plane_groups = groups[plane]
+        for g in np.unique(groups[labels]):
+            mask = plane_groups == g
+            # Opening the mask of the whole group is equivalent to opening
+            # each object separately, because objects of a group don't touch.
+            opened_mask = mh.open(mask)
+            opened_mask[is_single_pixel & mask] = True
+            # NOTE: OpenCV returns x, y coordinates. This means one would need
+            # to flip the axis for numpy-based indexing (y,x coordinates).
+            _, contours, hierarchy = cv2.findContours(
+                opened_mask.astype(np.uint8) * 255,
+                cv2.RETR_CCOMP,  # two-level hierarchy (holes)
+                cv2.CHAIN_APPROX_NONE
+            )
+            if hierarchy is None:
+                continue
+            for i, c in enumerate(contours):
+                # Points of outer contours as well as holes are foreground
+                # pixels of the object, so the label can be read from them.
+                x, y = c[0, 0]
+                label = plane[y, x]
+                parent_idx = hierarchy[0][i][3]
+                if parent_idx >= 0:
+                    if len(c) >= 3:
+                        holes[(g, parent_idx)].append(np.squeeze(c, axis=1))
+                else:
+                    shells[label].append(((g, i), np.squeeze(c)))
+        return (shells, holes)
+
+
+class TileCodec(object):
+
+    '''Codec for encoding the pixels of pyramid tiles for storage.
+
+    Codecs are identified by a tag of the form ``"<name>"`` or
+    ``"<name>:<parameter>"``, e.g. ``"jpeg:80"``, which is stored per
+    :class:`ChannelLayer <tmlib.models.channel.ChannelLayer>`:
+
+        * ``"jpeg"``: lossy *JPEG* with quality from 0 to 100
+          (default: ``95``)
+        * ``"webp"``: lossy *WebP* with quality from 1 to 100
+          (default: ``95``); a quality greater than 100 selects lossless
+          compression
+        * ``"png"``: lossless *PNG* with compression level from 0 to 9
+          (default: ``3``)
+        * ``"zstd"``: raw pixels compressed losslessly via *Zstandard* with
+          compression level from 1 to 22 (default: ``3``); requires the
+          `zstandard <https://pypi.python.org/pypi/zstandard>`_ package
+
+    *JPEG* and *WebP* don't support 16-bit pixels, 16-bit tiles are
+    therefore encoded in *PNG* format by these codecs. Encoded pixels
+    are self-describing, such that they can be decoded without knowing the
+    codec they were encoded with.
+
+    Examples
+    --------
+    >>> codec = TileCodec.create_from_tag('webp:80')
+    >>> buf = codec.encode(array)
+    >>> np.all(TileCodec.decode(buf) == array)
+    '''
+
+    NAMES = ('jpeg', 'webp', 'png', 'zstd')
+
+    _DEFAULT_PARAMETERS = {'jpeg': 95, 'webp': 95, 'png': 3, 'zstd': 3}
+
+    _PARAMETER_RANGES = {
+        'jpeg': (0, 100), 'webp': (1, 101), 'png': (0, 9), 'zstd': (1, 22)
+    }
+
+    # Raw pixels are preceded by a header with the number of bytes per
+    # pixel, height and width.
+    _RAW_HEADER_FORMAT = '!BHH'
+
+    _ZSTD_MAGIC_NUMBER = b'\x28\xb5\x2f\xfd'
+
+    _WEBP_MAGIC_NUMBER = b'RIFF'
+
+    def __init__(self, name='jpeg', parameter=None):
+        '''
+        Parameters
+        ----------
+        name: str, optional
+            name of the codec (options: ``{"jpeg", "webp", "png", "zstd"}``,
+            default: ``"jpeg"``)
+        parameter: int, optional
+            quality or compression level depending on the codec
+            (defaults to the default of the codec)
+
+        Raises
+        ------
+        ValueError
+            when `name` is not a known codec or `parameter` lies outside
+            the range supported by the codec
+        '''
+        if name not in self.NAMES:
+            raise ValueError(
+                'Argument "name" must be one of the following: "%s"'
+                % '", "'.join(self.NAMES)
+            )
+        if parameter is None:
+            parameter = self._DEFAULT_PARAMETERS[name]
+        lower, upper = self._PARAMETER_RANGES[name]
+        if not(lower <= parameter <= upper):
+            raise ValueError(
+                'Parameter of codec "%s" must lie in range [%d, %d].'
+                % (name, lower, upper)
+            )
+        self.name = name
+        self.parameter = int(parameter)
+
+    @classmethod
+    def create_from_tag(cls, tag):
+        '''Creates a codec from its tag.
+
+        Parameters
+        ----------
+        tag: str
+            codec tag, e.g. ``"jpeg:80"`` (``None`` selects the default codec)
+
+        Returns
+        -------
+        tmlib.image.TileCodec
+        '''
+        if tag is None:
+            return cls()
+        name, _, parameter = tag.partition(':')
+        if parameter:
+            try:
+                parameter = int(parameter)
+            except ValueError:
+                raise ValueError('Invalid codec tag: "%s"' % tag)
+        else:
+            parameter = None
+        return cls(name, parameter)
+
+    @property
+    def tag(self):
+        '''str: tag that identifies the codec'''
+        return '%s:%d' % (self.name, self.parameter)
+
+    def __repr__(self):
+        return '<TileCodec(%s)>' % self.tag
+
+    @staticmethod
+    def _get_zstandard():
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                'Tiles cannot be encoded or decoded with codec "zstd", '
+                'because "zstandard" package is not installed.'
+            )
+        return zstandard
+
+    def encode(self, array):
+        '''Encodes a pixels array.
+
+        Parameters
+        ----------
+        array: numpy.ndarray[Union[numpy.uint8, numpy.uint16]]
+            2D pixels array
+
+        Returns
+        -------
+        numpy.ndarray[numpy.uint8]
+            encoded pixels
+        '''
+        if self.name == 'zstd':
+            zstandard = self._get_zstandard()
+            height, width = array.shape
+            header = struct.pack(
+                self._RAW_HEADER_FORMAT, array.dtype.itemsize, height, width
+            )
+            # Pixels are stored in little-endian byte order.
+            pixels = np.ascontiguousarray(
+                array, dtype=array.dtype.newbyteorder('<')
+            )
+            compressor = zstandard.ZstdCompressor(level=self.parameter)
+            return np.fromstring(
+                header + compressor.compress(pixels.tostring()), np.uint8
+            )
+        if self.name == 'png':
+            return cv2.imencode(
+                '.png', array, [cv2.IMWRITE_PNG_COMPRESSION, self.parameter]
+            )[1]
+        if array.dtype == np.uint16:
+            return cv2.imencode('.png', array)[1]
+        if self.name == 'webp':
+            return cv2.imencode(
+                '.webp', array, [cv2.IMWRITE_WEBP_QUALITY, self.parameter]
+            )[1]
+        return cv2.imencode(
+            '.jpeg', array, [cv2.IMWRITE_JPEG_QUALITY, self.parameter]
+        )[1]
+
+    @classmethod
+    def decode(cls, array):
+        '''Decodes pixels that were encoded by any codec.
+
+        Parameters
+        ----------
+        array: numpy.ndarray[numpy.uint8]
+            encoded pixels
+
+        Returns
+        -------
+        numpy.ndarray[Union[numpy.uint8, numpy.uint16]]
+            2D pixels array
+        '''
+        n = struct.calcsize(cls._RAW_HEADER_FORMAT)
+        magic_number = array[n:n+len(cls._ZSTD_MAGIC_NUMBER)].tostring()
+        if magic_number == cls._ZSTD_MAGIC_NUMBER:
+            zstandard = cls._get_zstandard()
+            itemsize, height, width = struct.unpack(
+                cls._RAW_HEADER_FORMAT, array[:n].tostring()
+            )
+            pixels = zstandard.ZstdDecompressor().decompress(
+                array[n:].tostring()
+            )
+            return np.fromstring(pixels, '<u%d' % itemsize).\
+                astype(np.dtype('u%d' % itemsize)).\
+                reshape(height, width)
+        if array[:4].tostring() == cls._WEBP_MAGIC_NUMBER:
+            # WebP images would otherwise be decoded with color channels.
+            return cv2.imdecode(array, cv2.IMREAD_GRAYSCALE)
+        return cv2.imdecode(array, cv2.IMREAD_UNCHANGED)
 
 
 class PyramidTile(Image):
 
     '''Class for a pyramid tile: an image with a single z-level and
     y, x dimensions of 256 x 256 pixels.
+
+    Pixels of tiles are usually rescaled to 8-bit, but tiles may also hold
+    the original 16-bit pixels, which can then be rendered for display with
+    any intensity range (see :meth:`render <tmlib.image.PyramidTile.render>`).
     '''
 
     TILE_SIZE = 256
 
+    # Constant tiles are encoded as pixel value, height and width.
+    _CONSTANT_FORMATS = {np.dtype(np.uint8): '!BHH', np.dtype(np.uint16): '!HHH'}
+
     @assert_type(
         metadata=['tmlib.metadata.PyramidTileMetadata', 'types.NoneType']
     )
@@ -939,15 +1576,15 @@ class PyramidTile(Image):
         '''
         Parameters
         ----------
-        array: numpy.ndarray[uint8]
+        array: numpy.ndarray[Union[numpy.uint8, numpy.uint16]]
             pixels array
         metadata: tmlib.metadata.PyramidTileMetadata, optional
             image metadata (default: ``None``)
         '''
         super(PyramidTile, self).__init__(array, metadata)
-        if not self.is_uint8:
+        if not(self.is_uint8 or self.is_uint16):
             raise TypeError(
-                'Image must have 8-bit unsigned integer data type.'
+                'Image must have 8-bit or 16-bit unsigned integer data type.'
             )
         if any([d > self.TILE_SIZE or d == 0 for d in self.array.shape]):
             raise ValueError(
@@ -973,7 +1610,7 @@ class PyramidTile(Image):
 
     @property
     def array(self):
-        '''numpy.ndarray[numpy.uint8]: 2D pixels array'''
+        '''numpy.ndarray[Union[numpy.uint8, numpy.uint16]]: 2D pixels array'''
         return self._array
 
     @array.setter
@@ -984,15 +1621,56 @@ class PyramidTile(Image):
             )
         if value.ndim != 2:
             raise ValueError('Argument "array" must be two dimensional.')
-        if not value.dtype == np.uint8:
+        if value.dtype not in (np.uint8, np.uint16):
             raise ValueError(
-                'Argument "array" must have numpy.uint8 data type.'
+                'Argument "array" must have numpy.uint8 or numpy.uint16 '
+                'data type.'
             )
         self._array = value
 
+    @property
+    def is_constant(self):
+        '''bool: whether all pixels have the same value, as is the case for
+        background tiles
+        '''
+        return bool(np.all(self.array == self.array.flat[0]))
+
+    @classmethod
+    def decode(cls, buf):
+        '''Decodes pixels that were encoded via
+        :meth:`encode <tmlib.image.PyramidTile.encode>`.
+
+        Parameters
+        ----------
+        buf: Union[str, buffer, numpy.ndarray[numpy.uint8]]
+            encoded pixels
+
+        Returns
+        -------
+        numpy.ndarray[Union[numpy.uint8, numpy.uint16]]
+            2D pixels array
+
+        Note
+        ----
+        Encoded pixels are not necessarily a valid image file. Constant tiles
+        are encoded in a compact form and other tiles may be encoded in a
+        format other than *JPEG*. Readers of stored tiles must therefore
+        decode pixels via this method rather than serve them as image files.
+        '''
+        if isinstance(buf, np.ndarray):
+            array = buf
+        else:
+            array = np.frombuffer(buf, np.uint8)
+        for dtype, fmt in cls._CONSTANT_FORMATS.iteritems():
+            if array.size == struct.calcsize(fmt):
+                value, height, width = struct.unpack(fmt, array.tostring())
+                return np.full((height, width), value, dtype=dtype)
+        return TileCodec.decode(array)
+
     @classmethod
     def create_from_binary(cls, string, metadata=None):
-        '''Creates an image from a *JPEG* encoded binary string.
+        '''Creates an image from a binary string that was encoded via
+        :meth:`encode <tmlib.image.PyramidTile.encode>`.
 
         Parameters
         ----------
@@ -1005,17 +1683,14 @@ class PyramidTile(Image):
         -------
         tmlib.image.PyramidTile
 
-        Warning
-        -------
-        This assumes pixels are encoded as 8-bit unsigned integers.
         '''
         array = np.fromstring(string, np.uint8)
-        array = cv2.imdecode(array, cv2.IMREAD_UNCHANGED)
-        return cls(array, metadata)
+        return cls(cls.decode(array), metadata)
 
     @classmethod
     def create_from_buffer(cls, buf, metadata=None):
-        '''Creates an image from a *JPEG* encoded buffer object.
+        '''Creates an image from a buffer object that was encoded via
+        :meth:`encode <tmlib.image.PyramidTile.encode>`.
 
         Parameters
         ----------
@@ -1028,12 +1703,42 @@ class PyramidTile(Image):
         -------
         tmlib.image.PyramidTile
 
-        Warning
-        -------
-        This assumes pixels are encoded as 8-bit unsigned integers.
         '''
         array = np.frombuffer(buf, np.uint8)
-        array = cv2.imdecode(array, cv2.IMREAD_UNCHANGED)
+        return cls(cls.decode(array), metadata)
+
+    @classmethod
+    def create_from_mosaic(cls, mosaic, factor, metadata=None):
+        '''Creates a tile by downsampling a mosaic of tiles of the next
+        higher zoom level.
+
+        Parameters
+        ----------
+        mosaic: numpy.ndarray[numpy.uint8]
+            pixels array composed of up to `factor` x `factor` tiles;
+            may be a view of a larger, preallocated buffer
+        factor: int
+            factor by which the mosaic should be reduced along the y and x axis
+        metadata: tmlib.metadata.ImageMetadata, optional
+            image metadata (default: ``None``)
+
+        Returns
+        -------
+        tmlib.image.PyramidTile
+
+        Note
+        ----
+        When the dimensions of `mosaic` are multiples of `factor`, each pixel
+        of the tile is the mean of a block of `factor` x `factor` pixels
+        rounded half up.
+        '''
+        height, width = mosaic.shape
+        # NOTE: Area interpolation reduces non-overlapping blocks for integer
+        # factors, which is considerably faster than numpy.reshape() + mean().
+        array = cv2.resize(
+            mosaic, (width // factor, height // factor),
+            interpolation=cv2.INTER_AREA
+        )
         return cls(array, metadata)
 
     @classmethod
@@ -1093,6 +1798,70 @@ class PyramidTile(Image):
             '.jpeg', self.array, [cv2.IMWRITE_JPEG_QUALITY, quality]
         )[1]
 
+    def encode(self, codec=None):
+        '''Encodes the image for storage. Constant tiles, such as background
+        tiles of spacer regions between wells and plates, are encoded in a
+        compact form that only holds pixel value and dimensions. Other tiles
+        are encoded by `codec`.
+
+        Parameters
+        ----------
+        codec: tmlib.image.TileCodec, optional
+            codec (defaults to *JPEG* with quality 95 for 8-bit tiles and
+            *PNG* for 16-bit tiles)
+
+        Returns
+        -------
+        numpy.ndarray[numpy.uint8]
+            encoded pixels, which are not necessarily a valid image file
+
+        Note
+        ----
+        A constant tile is encoded as 5 bytes (8-bit) or 6 bytes (16-bit),
+        which hold the pixel value followed by height and width in network
+        byte order (struct formats ``"!BHH"`` and ``"!HHH"``).
+
+        See also
+        --------
+        :meth:`tmlib.image.PyramidTile.decode`
+        :meth:`tmlib.image.PyramidTile.create_from_binary`
+        '''
+        if self.is_constant:
+            height, width = self.dimensions
+            return np.fromstring(
+                struct.pack(
+                    self._CONSTANT_FORMATS[self.dtype],
+                    int(self.array.flat[0]), height, width
+                ),
+                np.uint8
+            )
+        if codec is None:
+            codec = TileCodec()
+        return codec.encode(self.array)
+
+    def render(self, lower, upper):
+        '''Renders the tile for display by clipping 16-bit pixel values to
+        the range [`lower`, `upper`] and linearly mapping them to 8-bit.
+        Tiles whose pixels have already been rescaled to 8-bit are returned
+        as is.
+
+        Parameters
+        ----------
+        lower: int
+            value below which pixel values will be set to 0
+        upper: int
+            value above which pixel values will be set to 255
+
+        Returns
+        -------
+        tmlib.image.PyramidTile
+            tile with 8-bit pixels
+        '''
+        if self.is_uint8:
+            return self
+        lut = ChannelImage._create_uint8_lut(lower, upper)
+        return PyramidTile(np.take(lut, self.array), self.metadata)
+
 
 class IllumstatsImage(Image):
 
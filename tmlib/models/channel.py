@@ -26,25 +26,25 @@ from sqlalchemy import Column, Integer, ForeignKey, String, UniqueConstraint
 from sqlalchemy import or_
 from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.ext.declarative import declared_attr
-from sqlalchemy.orm import relationship, backref, Session
+from sqlalchemy.orm import relationship, backref, Session, joinedload
 from sqlalchemy.ext.hybrid import hybrid_property
 
 from tmlib.models.file import ChannelImageFile
 from tmlib.models.site import Site
-from tmlib.models.well import Well
 from tmlib.models.feature import FeatureValues
 from tmlib.models.result import LabelValues
 from tmlib.models.tile import ChannelLayerTile
+from tmlib.models.tile import DatabaseTileStorage, ArchiveTileStorage
 from tmlib.models.mapobject import MapobjectSegmentation
-from tmlib.models.plate import Plate
 from tmlib.models.base import (
     ExperimentModel, DirectoryModel, DateMixIn, IdMixIn
 )
 from tmlib.models.utils import ExperimentConnection, ExperimentSession
 from tmlib.models.utils import remove_location_upon_delete
 from tmlib.errors import RegexError, DataError
-from tmlib.image import PyramidTile
+from tmlib.image import PyramidTile, TileCodec
 from tmlib.utils import autocreate_directory_property, create_directory
+from tmlib import cfg
 
 logger = logging.getLogger(__name__)
 
@@ -188,6 +188,10 @@ class ChannelLayer(ExperimentModel, IdMixIn):
     #: bit depth before rescaling to 8-bit
     min_intensity = Column(Integer)
 
+    #: str: tag of the codec by which pixels of tiles get encoded
+    #: (see :class:`TileCodec <tmlib.image.TileCodec>`)
+    codec = Column(String(20))
+
     #: int: ID of parent channel
     channel_id = Column(
         Integer,
@@ -288,6 +292,42 @@ class ChannelLayer(ExperimentModel, IdMixIn):
             levels.append((n_rows, n_cols))
         return levels
 
+    @property
+    def tiles_location(self):
+        '''str: location where tiles are stored in case they are stored in
+        archives on the file system
+        '''
+        return os.path.join(
+            self.channel.location,
+            CHANNEL_LAYER_LOCATION_FORMAT.format(id=self.id)
+        )
+
+    @property
+    def tile_codec(self):
+        '''tmlib.image.TileCodec: codec by which pixels of tiles get encoded
+        '''
+        return TileCodec.create_from_tag(self.codec)
+
+    def get_tile_storage(self, session):
+        '''Gets the storage of the tiles of the layer according to the
+        configured backend
+        (see :attr:`tile_storage <tmlib.config.LibraryConfig.tile_storage>`).
+
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            experiment-specific database session
+
+        Returns
+        -------
+        tmlib.models.tile.TileStorage
+        '''
+        if cfg.tile_storage == 'archive':
+            return ArchiveTileStorage(
+                self.tiles_location, self.id, self.dimensions
+            )
+        return DatabaseTileStorage(session, self.id)
+
     def calculate_max_image_size(self):
         '''Determines dimensions of the pyramid, i.e. height, width
         of the image at the highest resolution level.
@@ -453,27 +493,9 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         # or plates represent an exception because in these cases there is
         # no neighboring image to create the tile instead, but an empty spacer.
         # The same is true in case of missing neighboring images.
-        session = Session.object_session(self)
-        lower_neighbor_count = session.query(ChannelImageFile.id).\
-            join(Site).\
-            filter(
-                Site.y == site.y + 1, Site.x == site.x,
-                Site.well_id == site.well_id,
-                ChannelImageFile.channel_id == self.channel_id,
-                ChannelImageFile.tpoint == self.tpoint
-            ).\
-            count()
-        right_neighbor_count = session.query(ChannelImageFile.id).\
-            join(Site).\
-            filter(
-                Site.y == site.y, Site.x == site.x + 1,
-                Site.well_id == site.well_id,
-                ChannelImageFile.channel_id == self.channel_id,
-                ChannelImageFile.tpoint == self.tpoint
-            ).\
-            count()
-        has_lower_neighbor = lower_neighbor_count > 0
-        has_right_neighbor = right_neighbor_count > 0
+        grid = self.site_index
+        has_lower_neighbor = (site.well_id, site.y + 1, site.x) in grid
+        has_right_neighbor = (site.well_id, site.y, site.x + 1) in grid
         for i, y in enumerate(row_info['indices']):
             y_offset = row_info['offsets'][i]
             is_overhanging_vertically = (
@@ -519,40 +541,56 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         all_tile_coords = list(itertools.product(rows, cols))
         return set(all_tile_coords) - set(tile_coords)
 
-    def _calc_tile_indices(self, position, length, displacement):
-        '''Calculates row or column index for each tile
-        that maps to either the vertical or horizontal axis of the given image,
-        respectively.
-
-        Parameters
-        ----------
-        position: int
-            pixel position of the top, left corner of the image in the layer
-            on the given axis
-        length: int
-            length of the image in pixels along the given axis
-        displacement: int
-            displacement of the image to its neighboring image in pixels
-            along the given axis
+    @cached_property
+    def site_index(self):
+        '''Dict[Tuple[int], Dict[str, Union[int, bool, Tuple[int], List[int]]]]:
+        ID of the image file, ID of the site, whether the site is omitted,
+        offset and size of the image as well as row and column indices of
+        the intersecting tiles at the maximal zoom level for each site
+        hashable by well ID and *y*, *x* coordinate of the site in the well
 
-        Returns
-        -------
-        List[int]
-            indices of tiles that map to the given axis
+        Note
+        ----
+        The index is built from a single database query.
         '''
-        start_fraction = (
-            np.float(position) /
-            np.float(self.tile_size)
-        )
-        start_index = int(np.floor(start_fraction))
-
-        end_fraction = (
-            np.float(position + length - displacement) /
-            np.float(self.tile_size)
-        )
-        end_index = int(np.ceil(end_fraction))
-
-        return range(start_index, end_index)
+        logger.debug('create index of sites')
+        experiment = self.channel.experiment
+        session = Session.object_session(self)
+        records = session.query(ChannelImageFile.id, Site).\
+            join(Site).\
+            options(joinedload(Site.well)).\
+            filter(
+                ChannelImageFile.channel_id == self.channel_id,
+                ChannelImageFile.tpoint == self.tpoint,
+                ChannelImageFile.zplane == self.zplane
+            ).\
+            all()
+        if not records:
+            return dict()
+        offsets = np.array([site.offset for _, site in records])
+        sizes = np.array([site.image_size for _, site in records])
+        displacements = np.array([
+            experiment.vertical_site_displacement,
+            experiment.horizontal_site_displacement
+        ])
+        # Indices of the first and one after the last tile that intersect
+        # with the image along the vertical and horizontal axis
+        start = np.floor(offsets / np.float(self.tile_size)).astype(int)
+        end = np.ceil(
+            (offsets + sizes - displacements) / np.float(self.tile_size)
+        ).astype(int)
+        grid = dict()
+        for i, (fid, site) in enumerate(records):
+            grid[(site.well_id, site.y, site.x)] = {
+                'file_id': fid,
+                'site_id': site.id,
+                'omitted': site.omitted,
+                'offset': tuple(offsets[i].tolist()),
+                'image_size': tuple(sizes[i].tolist()),
+                'rows': range(start[i, 0], end[i, 0]),
+                'cols': range(start[i, 1], end[i, 1])
+            }
+        return grid
 
     def map_base_tile_to_images(self, site):
         '''Maps tiles at the highest resolution level to all image files of
@@ -570,41 +608,18 @@ class ChannelLayer(ExperimentModel, IdMixIn):
             IDs of images intersecting with a given tile hashable by tile
             y, x coordinates
         '''
-        experiment = self.channel.experiment
-        session = Session.object_session(self)
-        # Only consider sites to the left and/or top of the current site
-        neighbouring_sites = session.query(Site).\
-            join(Well).\
-            filter(
-                Well.id == site.well.id,
-                Site.x.in_([site.x - 1, site.x]),
-                Site.y.in_([site.y - 1, site.y])
-            )
-
+        grid = self.site_index
         mapping = collections.defaultdict(list)
-        for current_site in neighbouring_sites:
-            if current_site.y == site.y and current_site.x == site.x:
+        # Only consider sites to the left and/or top of the current site
+        neighbours = itertools.product([site.y - 1, site.y], [site.x - 1, site.x])
+        for y, x in neighbours:
+            if y == site.y and x == site.x:
                 continue
-            if current_site.omitted:
+            entry = grid.get((site.well_id, y, x))
+            if entry is None or entry['omitted']:
                 continue
-            fid = session.query(ChannelImageFile.id).\
-                filter_by(
-                    site_id=current_site.id, channel_id=self.channel.id,
-                    tpoint=self.tpoint, zplane=self.zplane
-                ).\
-                one()[0]
-            y_offset_site, x_offset_site = current_site.offset
-            row_indices = self._calc_tile_indices(
-                y_offset_site, current_site.image_size[0],
-                experiment.vertical_site_displacement
-            )
-            col_indices = self._calc_tile_indices(
-                x_offset_site, current_site.image_size[1],
-                experiment.horizontal_site_displacement
-            )
-            for y, x in itertools.product(row_indices, col_indices):
-                mapping[(y, x)].append(fid)
-
+            for coordinate in itertools.product(entry['rows'], entry['cols']):
+                mapping[coordinate].append(entry['file_id'])
         return mapping
 
     @cached_property
@@ -614,33 +629,12 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         to the files of intersecting images
         '''
         logger.debug('create mapping of base tile coordinates to image files')
-        experiment = self.channel.experiment
-        session = Session.object_session(self)
-        sites = session.query(Site).\
-            join(Well).\
-            join(Plate).\
-            filter(Plate.experiment_id == experiment.id)
         mapping = collections.defaultdict(list)
-        for site in sites:
-            if site.omitted:
+        for entry in self.site_index.itervalues():
+            if entry['omitted']:
                 continue
-            fid = session.query(ChannelImageFile.id).\
-                filter_by(
-                    site_id=site.id, channel_id=self.channel.id,
-                    tpoint=self.tpoint, zplane=self.zplane
-                ).\
-                one()[0]
-            y_offset_site, x_offset_site = site.offset
-            row_indices = self._calc_tile_indices(
-                y_offset_site, site.image_size[0],
-                experiment.vertical_site_displacement
-            )
-            col_indices = self._calc_tile_indices(
-                x_offset_site, site.image_size[1],
-                experiment.horizontal_site_displacement
-            )
-            for y, x in itertools.product(row_indices, col_indices):
-                mapping[(y, x)].append(fid)
+            for coordinate in itertools.product(entry['rows'], entry['cols']):
+                mapping[coordinate].append(entry['file_id'])
         return mapping
 
     def calc_coordinates_of_next_higher_level(self, z, y, x):
@@ -697,42 +691,35 @@ class ChannelLayer(ExperimentModel, IdMixIn):
 
         Note
         ----
-        The size of the tile is predefined.
+        The size of the tile is predefined. When the tile lies completely
+        within `image`, its pixels array is a view of the pixels array of
+        `image`. Otherwise, pixels get copied into a newly allocated array.
         '''
         # Some tiles may lie on the border of wells and contain spacer
         # background pixels. The pixel offset is negative in these cases and
         # missing pixels are replaced with zeros.
-        y_end = y_offset + self.tile_size
-        x_end = x_offset + self.tile_size
-
-        n_top = None
-        n_bottom = None
-        n_left = None
-        n_right = None
-        if y_offset < 0:
-            n_top = abs(y_offset)
-            y_offset = 0
-        elif (image.dimensions[0] - y_offset) < self.tile_size:
-            n_bottom = self.tile_size - (image.dimensions[0] - y_offset)
-        if x_offset < 0:
-            n_left = abs(x_offset)
-            x_offset = 0
-        elif (image.dimensions[1] - x_offset) < self.tile_size:
-            n_right = self.tile_size - (image.dimensions[1] - x_offset)
-
-        extracted_pixels = image.extract(
-            y_offset, y_end-y_offset, x_offset, x_end-x_offset
-        ).array
-        tile = PyramidTile(extracted_pixels)
-        if n_top is not None:
-            tile = tile.pad_with_background(n_top, 'top')
-        if n_bottom is not None:
-            tile = tile.pad_with_background(n_bottom, 'bottom')
-        if n_left is not None:
-            tile = tile.pad_with_background(n_left, 'left')
-        if n_right is not None:
-            tile = tile.pad_with_background(n_right, 'right')
-
+        height, width = image.dimensions
+        y_start = max(y_offset, 0)
+        y_end = min(y_offset + self.tile_size, height)
+        x_start = max(x_offset, 0)
+        x_end = min(x_offset + self.tile_size, width)
+        is_inside = (
+            y_end - y_start == self.tile_size and
+            x_end - x_start == self.tile_size
+        )
+        if is_inside:
+            # The tile is a view of the image without copying pixels.
+            tile = PyramidTile(image.extract(
+                y_start, self.tile_size, x_start, self.tile_size
+            ).array)
+        else:
+            array = np.zeros((self.tile_size, self.tile_size), dtype=image.dtype)
+            if y_end > y_start and x_end > x_start:
+                array[
+                    y_start - y_offset:y_end - y_offset,
+                    x_start - x_offset:x_end - x_offset
+                ] = image.array[y_start:y_end, x_start:x_end]
+            tile = PyramidTile(array)
         return tile
 
     def __repr__(self):
@@ -25,6 +25,7 @@ from cached_property import cached_property
 
 from tmlib.utils import assert_type
 from tmlib.utils import notimplemented
+from tmlib.utils import LRUCache
 from tmlib.image import ChannelImage
 from tmlib.image import IllumstatsImage
 from tmlib.image import IllumstatsContainer
@@ -41,6 +42,10 @@ from tmlib.models.alignment import SiteShift
 
 logger = logging.getLogger(__name__)
 
+#: tmlib.utils.LRUCache: illumination statistics loaded in the current Python
+#: process hashable by channel ID, location and modification time of the file
+ILLUMSTATS_CACHE = LRUCache(maxsize=10)
+
 
 @remove_location_upon_delete
 class MicroscopeImageFile(FileModel, DateMixIn):
@@ -391,6 +396,13 @@ class IllumstatsFile(FileModel, DateMixIn):
     #: Format string to build filename
     FILENAME_FORMAT = 'illumstats_file_{id}.h5'
 
+    #: int: size of the standard deviation of the Gaussian kernel that is
+    #: used to smooth the statistics images
+    SMOOTHING_SIGMA = 5
+
+    #: Format string to build the path to smoothed datasets within the file
+    SMOOTHED_DATASET_FORMAT = '/smoothed/sigma_{sigma}/{name}'
+
     __tablename__ = 'illumstats_files'
 
     __table_args__ = (UniqueConstraint('channel_id'), )
@@ -423,19 +435,48 @@ class IllumstatsFile(FileModel, DateMixIn):
         Returns
         -------
         Illumstats
-            illumination statistics images
+            smoothed illumination statistics images
+
+        Note
+        ----
+        Loaded statistics are cached and shared within the current Python
+        process. They must therefore not be modified.
         '''
+        key = (
+            self.channel_id, self.location, os.path.getmtime(self.location)
+        )
+        stats = ILLUMSTATS_CACHE.get(key)
+        if stats is not None:
+            logger.debug(
+                'use cached illumination statistics for channel %d',
+                self.channel_id
+            )
+            return stats
         logger.debug(
             'get data from illumination statistics file: %s', self.location
         )
-        metadata = IllumstatsImageMetadata(channel_id=self.channel.id)
+        metadata = IllumstatsImageMetadata(channel_id=self.channel_id)
+        sigma = self.SMOOTHING_SIGMA
+        mean_path = self.SMOOTHED_DATASET_FORMAT.format(sigma=sigma, name='mean')
+        std_path = self.SMOOTHED_DATASET_FORMAT.format(sigma=sigma, name='std')
         with DatasetReader(self.location) as f:
-            mean = IllumstatsImage(f.read('mean'), metadata)
-            std = IllumstatsImage(f.read('std'), metadata)
             keys = f.read('percentiles/keys')
             values = f.read('percentiles/values')
             percentiles = dict(zip(keys, values))
-        return IllumstatsContainer(mean, std, percentiles).smooth()
+            if f.exists(mean_path) and f.exists(std_path):
+                metadata.is_smoothed = True
+                mean = IllumstatsImage(f.read(mean_path), metadata)
+                std = IllumstatsImage(f.read(std_path), metadata)
+                stats = IllumstatsContainer(mean, std, percentiles)
+            else:
+                # Files written by previous versions only contain the
+                # raw statistics.
+                mean = IllumstatsImage(f.read('mean'), metadata)
+                std = IllumstatsImage(f.read('std'), metadata)
+                stats = IllumstatsContainer(mean, std, percentiles).\
+                    smooth(sigma)
+        ILLUMSTATS_CACHE[key] = stats
+        return stats
 
     @assert_type(data='tmlib.image.IllumstatsContainer')
     def put(self, data):
@@ -449,9 +490,21 @@ class IllumstatsFile(FileModel, DateMixIn):
         logger.debug(
             'put data to illumination statistics file: %s', self.location
         )
+        sigma = self.SMOOTHING_SIGMA
+        metadata = IllumstatsImageMetadata(channel_id=self.channel_id)
+        smoothed_mean = IllumstatsImage(data.mean.array, metadata).smooth(sigma)
+        smoothed_std = IllumstatsImage(data.std.array, metadata).smooth(sigma)
         with DatasetWriter(self.location, truncate=True) as f:
             f.write('mean', data.mean.array)
             f.write('std', data.std.array)
+            f.write(
+                self.SMOOTHED_DATASET_FORMAT.format(sigma=sigma, name='mean'),
+                smoothed_mean.array
+            )
+            f.write(
+                self.SMOOTHED_DATASET_FORMAT.format(sigma=sigma, name='std'),
+                smoothed_std.array
+            )
             f.write('/percentiles/keys', data.percentiles.keys())
             f.write('/percentiles/values', data.percentiles.values())
 
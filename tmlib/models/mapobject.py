@@ -662,10 +662,12 @@ class MapobjectSegmentation(DistributedExperimentModel):
         ----------
         partition_key: int
             key that determines on which shard the object will be stored
-        geom_polygon: shapely.geometry.polygon.Polygon
-            polygon geometry of the mapobject contour
-        geom_centroid: shapely.geometry.point.Point
-            point geometry of the mapobject centroid
+        geom_polygon: Union[shapely.geometry.polygon.Polygon, str]
+            polygon geometry of the mapobject contour or its *WKT*
+            representation
+        geom_centroid: Union[shapely.geometry.point.Point, str]
+            point geometry of the mapobject centroid or its *WKT*
+            representation
         mapobject_id: int
             ID of parent :class:`Mapobject <tmlib.models.mapobject.Mapobject>`
         segmentation_layer_id: int
@@ -675,8 +677,8 @@ class MapobjectSegmentation(DistributedExperimentModel):
             label assigned to the segmented object
         '''
         self.partition_key = partition_key
-        self.geom_polygon = getattr(geom_polygon, 'wkt', None)
-        self.geom_centroid = geom_centroid.wkt
+        self.geom_polygon = getattr(geom_polygon, 'wkt', geom_polygon)
+        self.geom_centroid = getattr(geom_centroid, 'wkt', geom_centroid)
         self.mapobject_id = mapobject_id
         self.segmentation_layer_id = segmentation_layer_id
         self.label = label
@@ -14,16 +14,21 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
+import mmap
+import fcntl
 import logging
 import collections
+from abc import ABCMeta
+from abc import abstractmethod
 from io import BytesIO
 from struct import pack
+from multiprocessing.pool import ThreadPool
 import psycopg2
 import numpy as np
 import pandas as pd
 from sqlalchemy import (
     Column, String, Integer, BigInteger, Boolean, ForeignKey, Index,
-    PrimaryKeyConstraint
+    PrimaryKeyConstraint, tuple_
 )
 from sqlalchemy.dialects.postgresql import BYTEA
 from sqlalchemy.orm import relationship, backref
@@ -32,15 +37,54 @@ from sqlalchemy.ext.hybrid import hybrid_property
 from tmlib.image import PyramidTile
 from tmlib.metadata import PyramidTileMetadata
 from tmlib.models.base import DistributedExperimentModel
+from tmlib.models.utils import delete_location
+from tmlib.utils import create_directory, LRUCache
 
 logger = logging.getLogger(__name__)
 
 
+def _decode_tiles(records, channel_layer_id, z, n_threads):
+    # Decodes the pixels of several tiles in parallel threads.
+    # Records are tuples of row index, column index and encoded pixels.
+    def decode(record):
+        y, x, pixels = record
+        metadata = PyramidTileMetadata(
+            z=z, y=y, x=x, channel_layer_id=channel_layer_id
+        )
+        return PyramidTile.create_from_binary(pixels, metadata)
+
+    if not records:
+        return dict()
+    logger.debug('decode pixels of %d tiles', len(records))
+    if len(records) == 1:
+        tiles = [decode(records[0])]
+    else:
+        pool = ThreadPool(n_threads)
+        try:
+            tiles = pool.map(decode, records)
+        finally:
+            pool.terminate()
+            pool.join()
+    return {(r[0], r[1]): t for r, t in zip(records, tiles)}
+
+
 class ChannelLayerTile(DistributedExperimentModel):
 
     '''A *channel layer tile* is a component of an image pyramid. Each tile
-    holds a single 2D 8-bit pixel plane with pre-defined dimensions.
+    holds a single 2D 8-bit or 16-bit pixel plane with pre-defined
+    dimensions.
 
+    Pixels are encoded by the codec of the parent
+    :class:`ChannelLayer <tmlib.models.channel.ChannelLayer>`, by default in
+    *JPEG* format (8-bit) or *PNG* format (16-bit), except for constant tiles
+    (e.g. background), which are stored in a compact form that only holds
+    pixel value and dimensions (see
+    :meth:`PyramidTile.encode <tmlib.image.PyramidTile.encode>`).
+    The stored pixels are therefore not necessarily a valid image file and
+    must be decoded via the :attr:`pixels` property or
+    :meth:`PyramidTile.decode <tmlib.image.PyramidTile.decode>`.
+    16-bit tiles need to be rendered for display (see
+    :class:`TileRenderer <tmlib.models.tile.TileRenderer>`).
     '''
 
     __tablename__ = 'channel_layer_tiles'
@@ -73,7 +117,11 @@ class ChannelLayerTile(DistributedExperimentModel):
     #: int: ID of parent channel layer
     channel_layer_id = Column(Integer, nullable=False)
 
-    def __init__(self, z, y, x, channel_layer_id, pixels=None):
+    #: tmlib.image.TileCodec: codec by which pixels get encoded upon
+    #: assignment (not persisted)
+    codec = None
+
+    def __init__(self, z, y, x, channel_layer_id, pixels=None, codec=None):
         '''
         Parameters
         ----------
@@ -87,16 +135,31 @@ class ChannelLayerTile(DistributedExperimentModel):
             ID of the parent channel pyramid
         pixels: tmlib.image.PyramidTile, optional
             pixels array (default: ``None``)
+        codec: tmlib.image.TileCodec, optional
+            codec by which `pixels` should be encoded
+            (default: ``None``, see
+            :meth:`PyramidTile.encode <tmlib.image.PyramidTile.encode>`)
         '''
         self.y = y
         self.x = x
         self.z = z
         self.channel_layer_id = channel_layer_id
+        self.codec = codec
         self.pixels = pixels
 
     @hybrid_property
     def pixels(self):
-        '''tmlib.image.PyramidTile: pixel data and metadata'''
+        '''tmlib.image.PyramidTile: pixel data and metadata
+
+        Note
+        ----
+        Pixels are stored in the "pixels" column as encoded by
+        :meth:`PyramidTile.encode <tmlib.image.PyramidTile.encode>`,
+        which is not necessarily a valid image file (constant tiles are
+        stored in a compact form of 5 or 6 bytes). The stored bytes must be
+        decoded via
+        :meth:`PyramidTile.decode <tmlib.image.PyramidTile.decode>`.
+        '''
         # TODO: consider creating a custom SQLAlchemy column type
         metadata = PyramidTileMetadata(
             z=self.z, y=self.y, x=self.x,
@@ -117,32 +180,127 @@ class ChannelLayerTile(DistributedExperimentModel):
         # colocate tiles and mapobjects on the same shards to improve
         # performance of combined spatial queries.
         if value is not None:
-            self._pixels = value.jpeg_encode()
+            self._pixels = value.encode(self.codec)
         else:
             self._pixels = None
 
+    @classmethod
+    def get_pixels(cls, session, channel_layer_id, z, coordinates,
+            n_threads=4):
+        '''Gets the pixels of several tiles of the same zoom level at once.
+
+        All tiles are selected in a single query, which the distributed
+        database executes once per shard, and the encoded pixels are
+        decoded in parallel threads.
+
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            experiment-specific database session
+        channel_layer_id: int
+            ID of the parent channel layer
+        z: int
+            zero-based zoom level index
+        coordinates: List[Tuple[int]]
+            zero-based row and column indices of the tiles
+        n_threads: int, optional
+            number of threads that decode pixels (default: ``4``)
+
+        Returns
+        -------
+        Dict[Tuple[int], tmlib.image.PyramidTile]
+            pixels of each tile hashable by row and column indices;
+            tiles that don't exist are not included
+        '''
+        coordinates = list(set([(int(y), int(x)) for y, x in coordinates]))
+        if not coordinates:
+            return dict()
+        logger.debug('select %d tiles at zoom level %d', len(coordinates), z)
+        records = session.query(cls.y, cls.x, cls._pixels.label('pixels')).\
+            filter(
+                cls.channel_layer_id == channel_layer_id, cls.z == z,
+                tuple_(cls.y, cls.x).in_(coordinates)
+            ).\
+            all()
+
+        return _decode_tiles(
+            [(r.y, r.x, r.pixels) for r in records], channel_layer_id, z,
+            n_threads
+        )
+
     @classmethod
     def _add(cls, connection, instance):
-        # This is expensive because the pixels data array gets included twice
-        # in the query
         connection.execute('''
             INSERT INTO channel_layer_tiles AS t (
                 channel_layer_id, z, y, x, pixels
             )
             VALUES (%(channel_layer_id)s, %(z)s, %(y)s, %(x)s, %(pixels)s)
             ON CONFLICT ON CONSTRAINT channel_layer_tiles_pkey
-            DO UPDATE SET pixels = %(pixels)s
+            DO UPDATE SET pixels = EXCLUDED.pixels
         ''', {
             'channel_layer_id': instance.channel_layer_id,
             'z': instance.z, 'y': instance.y, 'x': instance.x,
             'pixels': psycopg2.Binary(instance._pixels.tostring())
         })
 
+    @staticmethod
+    def _encode_copy_binary(instances):
+        # Encodes records in the binary format of the COPY command:
+        # https://www.postgresql.org/docs/current/static/sql-copy.html
+        f = BytesIO()
+        f.write(pack('!11sii', b'PGCOPY\n\377\r\n\0', 0, 0))
+        for obj in instances:
+            pixels = obj._pixels.tostring()
+            f.write(pack(
+                '!hiiiiiiiii', 5,
+                4, obj.channel_layer_id, 4, obj.z, 4, obj.y, 4, obj.x,
+                len(pixels)
+            ))
+            f.write(pixels)
+        f.write(pack('!h', -1))
+        f.seek(0)
+        return f
+
     @classmethod
     def _bulk_ingest(cls, connection, instances):
-        # TODO: figure out how to COPY the binary pixel data
+        # Tiles are copied into a temporary staging table and then upserted
+        # into the distributed table with a single statement.
+        if not instances:
+            return
+        records = collections.OrderedDict()
         for obj in instances:
-            cls._add(connection, obj)
+            if not isinstance(obj, cls):
+                raise TypeError('Object must have type %s' % cls.__name__)
+            if obj._pixels is None:
+                raise ValueError(
+                    'Tile "%d-%d-%d" has no pixels.' % (obj.z, obj.y, obj.x)
+                )
+            # A row must not be affected twice by the upsert statement.
+            records[(obj.channel_layer_id, obj.z, obj.y, obj.x)] = obj
+        logger.debug('copy %d tiles into staging table', len(records))
+        connection.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS channel_layer_tiles_staging (
+                channel_layer_id integer, z integer, y integer, x integer,
+                pixels bytea
+            )
+        ''')
+        connection.execute('TRUNCATE channel_layer_tiles_staging')
+        f = cls._encode_copy_binary(records.values())
+        connection.copy_expert('''
+            COPY channel_layer_tiles_staging (channel_layer_id, z, y, x, pixels)
+            FROM STDIN WITH (FORMAT binary)
+        ''', f)
+        f.close()
+        connection.execute('''
+            INSERT INTO channel_layer_tiles AS t (
+                channel_layer_id, z, y, x, pixels
+            )
+            SELECT channel_layer_id, z, y, x, pixels
+            FROM channel_layer_tiles_staging
+            ON CONFLICT ON CONSTRAINT channel_layer_tiles_pkey
+            DO UPDATE SET pixels = EXCLUDED.pixels
+        ''')
+        connection.execute('TRUNCATE channel_layer_tiles_staging')
 
     def __repr__(self):
         return '<%s(z=%r, y=%r, x=%r, channel_layer_id=%r)>' % (
@@ -151,3 +309,312 @@ class ChannelLayerTile(DistributedExperimentModel):
         )
 
 
+
+
+class TileStorage(object):
+
+    '''Abstract base class for the storage of the tiles of a
+    :class:`ChannelLayer <tmlib.models.channel.ChannelLayer>`.
+
+    The storage backend is selected via the configuration parameter
+    :attr:`tile_storage <tmlib.config.LibraryConfig.tile_storage>` and an
+    instance should be created via
+    :meth:`ChannelLayer.get_tile_storage <tmlib.models.channel.ChannelLayer.get_tile_storage>`.
+    '''
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, channel_layer_id):
+        '''
+        Parameters
+        ----------
+        channel_layer_id: int
+            ID of the parent channel layer
+        '''
+        self.channel_layer_id = channel_layer_id
+
+    @abstractmethod
+    def get(self, z, coordinates, n_threads=4):
+        '''Gets the pixels of several tiles of the same zoom level.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        coordinates: List[Tuple[int]]
+            zero-based row and column indices of the tiles
+        n_threads: int, optional
+            number of threads that decode pixels (default: ``4``)
+
+        Returns
+        -------
+        Dict[Tuple[int], tmlib.image.PyramidTile]
+            pixels of each tile hashable by row and column indices;
+            tiles that don't exist are not included
+        '''
+        pass
+
+    @abstractmethod
+    def put(self, tiles):
+        '''Stores tiles. Tiles that already exist get overwritten.
+
+        Parameters
+        ----------
+        tiles: List[tmlib.models.tile.ChannelLayerTile]
+            tiles of the channel layer
+        '''
+        pass
+
+    @abstractmethod
+    def delete(self):
+        '''Deletes all tiles of the channel layer.'''
+        pass
+
+
+class DatabaseTileStorage(TileStorage):
+
+    '''Storage of tiles in the distributed table of
+    :class:`ChannelLayerTile <tmlib.models.tile.ChannelLayerTile>`.
+    '''
+
+    def __init__(self, session, channel_layer_id):
+        '''
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            experiment-specific database session
+        channel_layer_id: int
+            ID of the parent channel layer
+        '''
+        super(DatabaseTileStorage, self).__init__(channel_layer_id)
+        self._session = session
+
+    def get(self, z, coordinates, n_threads=4):
+        return ChannelLayerTile.get_pixels(
+            self._session, self.channel_layer_id, z, coordinates, n_threads
+        )
+
+    def put(self, tiles):
+        if tiles:
+            self._session.bulk_ingest(tiles)
+
+    def delete(self):
+        self._session.query(ChannelLayerTile).\
+            filter_by(channel_layer_id=self.channel_layer_id).\
+            delete()
+
+
+class ArchiveTileStorage(TileStorage):
+
+    '''Storage of tiles in packed archives on the file system.
+
+    The encoded pixels of all tiles of a zoom level are appended to a single
+    data file. Offset and length of each tile within the data file are
+    recorded in an index file, which holds a fixed-size entry for each tile
+    of the zoom level in row-major order and gets memory-mapped. Reading and
+    writing tiles thus only requires I/O at known offsets.
+
+    Note
+    ----
+    Data files are append-only: overwriting a tile appends its new pixels and
+    updates the index entry, the previous pixels remain in the data file until
+    the archive gets deleted. Concurrent writers are serialized via advisory
+    file locks, which must be supported by the file system.
+    '''
+
+    #: numpy.dtype: data type of entries of the index files
+    INDEX_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u4')])
+
+    def __init__(self, location, channel_layer_id, dimensions):
+        '''
+        Parameters
+        ----------
+        location: str
+            absolute path to the directory where archives are stored
+        channel_layer_id: int
+            ID of the parent channel layer
+        dimensions: List[Tuple[int]]
+            number of tiles along the vertical and horizontal axis of the
+            layer at each zoom level
+        '''
+        super(ArchiveTileStorage, self).__init__(channel_layer_id)
+        self.location = location
+        self.dimensions = dimensions
+
+    def _get_data_filename(self, z):
+        return os.path.join(self.location, 'tiles_%d.dat' % z)
+
+    def _get_index_filename(self, z):
+        return os.path.join(self.location, 'tiles_%d.idx' % z)
+
+    def _get_positions(self, z, coordinates):
+        n_rows, n_cols = self.dimensions[z]
+        coordinates = np.array(coordinates, dtype=np.int64).reshape(-1, 2)
+        is_inside = (
+            (coordinates[:, 0] >= 0) & (coordinates[:, 0] < n_rows) &
+            (coordinates[:, 1] >= 0) & (coordinates[:, 1] < n_cols)
+        )
+        return coordinates[:, 0] * n_cols + coordinates[:, 1], is_inside
+
+    def get(self, z, coordinates, n_threads=4):
+        coordinates = list(set([(int(y), int(x)) for y, x in coordinates]))
+        index_filename = self._get_index_filename(z)
+        if not coordinates or not os.path.exists(index_filename):
+            return dict()
+        logger.debug('read %d tiles at zoom level %d', len(coordinates), z)
+        positions, is_inside = self._get_positions(z, coordinates)
+        index = np.memmap(index_filename, self.INDEX_DTYPE, 'r')
+        entries = np.zeros(positions.shape, dtype=self.INDEX_DTYPE)
+        entries[is_inside] = index[positions[is_inside]]
+        del index
+        exists = np.where(entries['length'] > 0)[0]
+        if len(exists) == 0:
+            return dict()
+        records = list()
+        with open(self._get_data_filename(z), 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for i in exists:
+                    offset = int(entries[i]['offset'])
+                    length = int(entries[i]['length'])
+                    y, x = coordinates[i]
+                    records.append((y, x, data[offset:offset+length]))
+            finally:
+                data.close()
+        return _decode_tiles(records, self.channel_layer_id, z, n_threads)
+
+    def put(self, tiles):
+        levels = collections.defaultdict(list)
+        for t in tiles:
+            if not isinstance(t, ChannelLayerTile):
+                raise TypeError(
+                    'Object must have type %s' % ChannelLayerTile.__name__
+                )
+            if t._pixels is None:
+                raise ValueError(
+                    'Tile "%d-%d-%d" has no pixels.' % (t.z, t.y, t.x)
+                )
+            levels[t.z].append(t)
+        if not levels:
+            return
+        create_directory(self.location)
+        for z, level_tiles in levels.iteritems():
+            logger.debug('write %d tiles at zoom level %d', len(level_tiles), z)
+            positions, is_inside = self._get_positions(
+                z, [(t.y, t.x) for t in level_tiles]
+            )
+            if not np.all(is_inside):
+                t = level_tiles[np.where(~is_inside)[0][0]]
+                raise IndexError(
+                    'Tile "%d-%d-%d" lies outside of the layer.'
+                    % (t.z, t.y, t.x)
+                )
+            with open(self._get_data_filename(z), 'ab') as f:
+                fcntl.lockf(f, fcntl.LOCK_EX)
+                try:
+                    index_filename = self._get_index_filename(z)
+                    if not os.path.exists(index_filename):
+                        n_rows, n_cols = self.dimensions[z]
+                        with open(index_filename, 'wb') as g:
+                            g.truncate(
+                                n_rows * n_cols * self.INDEX_DTYPE.itemsize
+                            )
+                    f.seek(0, os.SEEK_END)
+                    offset = f.tell()
+                    entries = np.zeros(positions.shape, dtype=self.INDEX_DTYPE)
+                    for i, t in enumerate(level_tiles):
+                        pixels = t._pixels.tostring()
+                        f.write(pixels)
+                        entries[i] = (offset, len(pixels))
+                        offset += len(pixels)
+                    # Pixels must have been written before they get indexed.
+                    f.flush()
+                    index = np.memmap(index_filename, self.INDEX_DTYPE, 'r+')
+                    index[positions] = entries
+                    index.flush()
+                    del index
+                finally:
+                    fcntl.lockf(f, fcntl.LOCK_UN)
+
+    def delete(self):
+        delete_location(self.location)
+
+
+class TileRenderer(object):
+
+    '''Class for rendering tiles of a channel layer as 8-bit images for
+    display.
+
+    Tiles that hold 16-bit pixels are clipped and rescaled to 8-bit
+    according to the requested intensity range, such that a change of the
+    display range doesn't require rebuilding the pyramid. Rendered tiles
+    are cached hashable by layer, zoom level, coordinates and intensity range.
+
+    Examples
+    --------
+    >>> storage = layer.get_tile_storage(session)
+    >>> renderer = TileRenderer(storage)
+    >>> tile = renderer.get(z, y, x, layer.min_intensity, layer.max_intensity)
+    '''
+
+    #: int: default maximal number of bytes of cached rendered tiles
+    CACHE_SIZE = 256 * 1024**2
+
+    def __init__(self, storage, cache=None):
+        '''
+        Parameters
+        ----------
+        storage: tmlib.models.tile.TileStorage
+            storage of the tiles of the channel layer
+        cache: tmlib.utils.LRUCache, optional
+            cache for rendered tiles, which may be shared between renderers
+            of different layers (by default, a cache of
+            :attr:`CACHE_SIZE <tmlib.models.tile.TileRenderer.CACHE_SIZE>`
+            bytes is created)
+        '''
+        if not isinstance(storage, TileStorage):
+            raise TypeError(
+                'Argument "storage" must have type '
+                'tmlib.models.tile.TileStorage.'
+            )
+        self.storage = storage
+        if cache is None:
+            cache = LRUCache(
+                self.CACHE_SIZE, getsizeof=lambda tile: tile.array.nbytes
+            )
+        self._cache = cache
+
+    def get(self, z, y, x, lower, upper):
+        '''Gets a rendered tile.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        y: int
+            zero-based row index of the tile
+        x: int
+            zero-based column index of the tile
+        lower: int
+            value below which pixel values will be set to 0
+        upper: int
+            value above which pixel values will be set to 255
+
+        Returns
+        -------
+        tmlib.image.PyramidTile
+            tile with 8-bit pixels or ``None`` in case the tile doesn't exist
+
+        See also
+        --------
+        :meth:`tmlib.image.PyramidTile.render`
+        '''
+        key = (self.storage.channel_layer_id, z, y, x, lower, upper)
+        tile = self._cache.get(key)
+        if tile is None:
+            tiles = self.storage.get(z, [(y, x)])
+            if (y, x) not in tiles:
+                return None
+            tile = tiles[(y, x)].render(lower, upper)
+            self._cache[key] = tile
+        return tile
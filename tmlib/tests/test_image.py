@@ -0,0 +1,231 @@
+import numpy as np
+import pytest
+import shapely.geometry
+from geoalchemy2.shape import from_shape
+
+from tmlib.image import SegmentationImage
+from tmlib.image import ChannelImage
+from tmlib.image import ChannelImageProcessor
+from tmlib.image import IllumstatsImage
+from tmlib.image import IllumstatsContainer
+from tmlib.image import PyramidTile
+from tmlib.image import TileCodec
+from tmlib.metadata import ChannelImageMetadata
+from tmlib.metadata import IllumstatsImageMetadata
+
+
+def _create_touching_objects():
+    array = np.zeros((20, 30), dtype=np.int32)
+    array[2:10, 2:10] = 1
+    array[2:10, 10:18] = 2
+    array[10:18, 4:16] = 3
+    array[4:16, 20:28] = 4
+    array[8:11, 23:25] = 0
+    return array
+
+
+def test_extract_polygons_labels():
+    image = SegmentationImage(_create_touching_objects())
+    labels = [label for label, _ in image.extract_polygons(0, 0)]
+    assert labels == [1, 2, 3, 4]
+
+
+def test_extract_polygons_touching_objects():
+    image = SegmentationImage(_create_touching_objects())
+    polygons = dict(image.extract_polygons(0, 0))
+    assert polygons[1].bounds == (2, -9, 9, -2)
+    assert polygons[2].bounds == (10, -9, 17, -2)
+    assert polygons[3].bounds == (4, -17, 15, -10)
+
+
+def test_extract_polygons_holes():
+    image = SegmentationImage(_create_touching_objects())
+    polygons = dict(image.extract_polygons(0, 0))
+    assert len(polygons[4].interiors) == 1
+    assert len(polygons[1].interiors) == 0
+
+
+def test_extract_polygons_offset():
+    image = SegmentationImage(_create_touching_objects())
+    polygons = dict(image.extract_polygons(100, 50))
+    assert polygons[1].bounds == (52, -109, 59, -102)
+
+
+def _create_channel_image(shift=(0, 0)):
+    rs = np.random.RandomState(0)
+    array = rs.randint(0, 5000, (40, 50)).astype(np.uint16)
+    array[0, 0] = 0
+    metadata = ChannelImageMetadata(1, 1, 1, 0, 0)
+    metadata.y_shift, metadata.x_shift = shift
+    metadata.top_residue = 3
+    metadata.left_residue = 4
+    return ChannelImage(array, metadata)
+
+
+def _create_illumstats():
+    rs = np.random.RandomState(1)
+    mean = IllumstatsImage(
+        2.5 + rs.uniform(0, 0.2, (40, 50)), IllumstatsImageMetadata(1)
+    )
+    std = IllumstatsImage(
+        0.3 + rs.uniform(0, 0.05, (40, 50)), IllumstatsImageMetadata(1)
+    )
+    return IllumstatsContainer(mean, std, {0.001: 10, 100: 5000})
+
+
+def test_channel_image_processor_matches_chain():
+    stats = _create_illumstats()
+    processor = ChannelImageProcessor(
+        stats, clip_min=100, clip_max=3000, align=True, crop=False
+    )
+    for shift in [(0, 0), (2, -1)]:
+        expected = _create_channel_image(shift).correct(stats).\
+            align(crop=False).clip(100, 3000).scale(100, 3000)
+        processed = processor.process(_create_channel_image(shift))
+        assert processed.array.dtype == np.uint8
+        diff = processed.array.astype(int) - expected.array.astype(int)
+        assert np.all(np.abs(diff) <= 1)
+        assert processed.metadata.is_corrected
+        assert processed.metadata.is_rescaled
+
+
+def test_channel_image_processor_out():
+    stats = _create_illumstats()
+    expected = _create_channel_image((2, -1)).correct(stats).align().array
+    out = np.zeros(expected.shape + (2, ), dtype=np.uint16)
+    processor = ChannelImageProcessor(stats, align=True)
+    processor.process(_create_channel_image((2, -1)), out=out[:, :, 1])
+    assert np.all(np.abs(out[:, :, 1].astype(int) - expected) <= 1)
+    assert np.all(out[:, :, 0] == 0)
+
+
+def _create_square(y, x, size):
+    return from_shape(shapely.geometry.Polygon([
+        (x, -y), (x + size, -y), (x + size, -(y + size)), (x, -(y + size))
+    ]))
+
+
+def test_create_from_polygons():
+    polygons = [(1, _create_square(2, 2, 3)), (2, _create_square(6, 1, 2))]
+    image = SegmentationImage.create_from_polygons(polygons, 0, 0, (10, 10))
+    expected = np.zeros((10, 10), dtype=np.int32)
+    expected[2:5, 2:5] = 1
+    expected[6:8, 1:3] = 2
+    np.testing.assert_array_equal(image.array, expected)
+
+
+def test_create_from_polygons_overlap_and_offset():
+    polygons = [(1, _create_square(12, 21, 4)), (2, _create_square(14, 23, 4))]
+    image = SegmentationImage.create_from_polygons(polygons, 10, 20, (5, 6))
+    expected = np.zeros((5, 6), dtype=np.int32)
+    expected[2:5, 1:5] = 1
+    expected[4:5, 3:6] = 2
+    np.testing.assert_array_equal(image.array, expected)
+
+
+def test_extract_returns_view():
+    image = _create_channel_image()
+    extracted = image.extract(5, 10, 20, 15)
+    assert extracted.dimensions == (10, 15)
+    assert np.may_share_memory(extracted.array, image.array)
+
+
+def test_pad_with_background():
+    image = ChannelImage(np.ones((3, 4), dtype=np.uint16))
+    padded = image.pad_with_background(2, 'top')
+    assert padded.dimensions == (5, 4)
+    assert np.all(padded.array[:2, :] == 0) and np.all(padded.array[2:, :] == 1)
+    padded = image.pad_with_background(1, 'right')
+    assert padded.dimensions == (3, 5)
+    assert np.all(padded.array[:, 4] == 0) and np.all(padded.array[:, :4] == 1)
+
+
+def test_pyramid_tile_encode_constant():
+    tile = PyramidTile(np.full((256, 100), 7, dtype=np.uint8))
+    assert tile.is_constant
+    buf = tile.encode()
+    assert buf.size == 5
+    decoded = PyramidTile.create_from_binary(buf.tostring())
+    np.testing.assert_array_equal(decoded.array, tile.array)
+    for encoded in (buf, buf.tostring()):
+        np.testing.assert_array_equal(PyramidTile.decode(encoded), tile.array)
+
+
+def test_pyramid_tile_encode_jpeg():
+    array = np.zeros((256, 256), dtype=np.uint8)
+    array[100:150, 50:200] = 200
+    tile = PyramidTile(array)
+    assert not tile.is_constant
+    decoded = PyramidTile.create_from_buffer(tile.encode())
+    assert decoded.dimensions == (256, 256)
+    assert np.all(np.abs(decoded.array.astype(int) - array) <= 10)
+
+
+def test_pyramid_tile_encode_uint16():
+    rs = np.random.RandomState(0)
+    array = rs.randint(0, 2**16, (256, 200)).astype(np.uint16)
+    decoded = PyramidTile.create_from_buffer(PyramidTile(array).encode())
+    np.testing.assert_array_equal(decoded.array, array)
+    constant = PyramidTile(np.full((10, 20), 1000, dtype=np.uint16))
+    decoded = PyramidTile.create_from_buffer(constant.encode())
+    np.testing.assert_array_equal(decoded.array, constant.array)
+
+
+def test_pyramid_tile_render():
+    array = np.array([[0, 100, 1000], [2000, 3000, 60000]], dtype=np.uint16)
+    rendered = PyramidTile(array).render(100, 3000)
+    assert rendered.array.dtype == np.uint8
+    np.testing.assert_array_equal(
+        rendered.array, [[0, 0, 79], [167, 255, 255]]
+    )
+    tile = PyramidTile(rendered.array)
+    assert tile.render(100, 3000) is tile
+
+
+def _create_tile_array(dtype=np.uint8):
+    rs = np.random.RandomState(0)
+    array = np.zeros((256, 256), dtype=dtype)
+    array[100:150, 50:200] = np.iinfo(dtype).max // 2
+    return array + rs.randint(0, 10, array.shape).astype(dtype)
+
+
+def test_tile_codec_tag():
+    assert TileCodec.create_from_tag('webp:80').tag == 'webp:80'
+    assert TileCodec.create_from_tag('png').tag == 'png:3'
+    assert TileCodec.create_from_tag(None).tag == 'jpeg:95'
+    with pytest.raises(ValueError):
+        TileCodec.create_from_tag('gif')
+    with pytest.raises(ValueError):
+        TileCodec.create_from_tag('jpeg:200')
+
+
+def test_tile_codec_lossy():
+    array = _create_tile_array()
+    for tag in ['jpeg:80', 'webp:80']:
+        codec = TileCodec.create_from_tag(tag)
+        tile = PyramidTile.create_from_buffer(PyramidTile(array).encode(codec))
+        assert tile.dimensions == (256, 256)
+        assert np.mean(np.abs(tile.array.astype(int) - array)) < 5
+
+
+def test_tile_codec_lossless():
+    for dtype in [np.uint8, np.uint16]:
+        array = _create_tile_array(dtype)
+        codec = TileCodec('png', 1)
+        tile = PyramidTile.create_from_buffer(PyramidTile(array).encode(codec))
+        np.testing.assert_array_equal(tile.array, array)
+    # Lossy codecs encode 16-bit tiles losslessly in PNG format.
+    array = _create_tile_array(np.uint16)
+    codec = TileCodec('webp')
+    tile = PyramidTile.create_from_buffer(PyramidTile(array).encode(codec))
+    np.testing.assert_array_equal(tile.array, array)
+
+
+def test_tile_codec_zstd():
+    pytest.importorskip('zstandard')
+    codec = TileCodec.create_from_tag('zstd:5')
+    for dtype in [np.uint8, np.uint16]:
+        array = _create_tile_array(dtype)[:200, :100]
+        tile = PyramidTile.create_from_buffer(PyramidTile(array).encode(codec))
+        assert tile.array.dtype == dtype
+        np.testing.assert_array_equal(tile.array, array)
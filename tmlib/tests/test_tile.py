@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pytest
+
+from tmlib.image import PyramidTile
+from tmlib.models.tile import ChannelLayerTile
+from tmlib.models.tile import ArchiveTileStorage
+
+
+def _create_tile(z, y, x, value):
+    pixels = PyramidTile(np.full((256, 256), value, dtype=np.uint8))
+    return ChannelLayerTile(z, y, x, 1, pixels)
+
+
+def _assert_value(tile, value):
+    assert tile.dimensions == (256, 256)
+    assert np.all(np.abs(tile.array.astype(int) - value) <= 1)
+
+
+@pytest.fixture
+def storage(tmpdir):
+    location = str(tmpdir.join('layer_1'))
+    return ArchiveTileStorage(location, 1, [(1, 1), (2, 3)])
+
+
+def test_archive_tile_storage_round_trip(storage):
+    storage.put([_create_tile(1, 0, 0, 10), _create_tile(1, 1, 2, 20)])
+    storage.put([_create_tile(1, 0, 1, 30), _create_tile(0, 0, 0, 40)])
+    tiles = storage.get(1, [(0, 0), (0, 1), (1, 2)])
+    assert set(tiles) == {(0, 0), (0, 1), (1, 2)}
+    _assert_value(tiles[(0, 0)], 10)
+    _assert_value(tiles[(0, 1)], 30)
+    _assert_value(tiles[(1, 2)], 20)
+    tiles = storage.get(0, [(0, 0)])
+    _assert_value(tiles[(0, 0)], 40)
+
+
+def test_archive_tile_storage_overwrite(storage):
+    storage.put([_create_tile(1, 1, 1, 10)])
+    size = os.path.getsize(storage._get_data_filename(1))
+    storage.put([_create_tile(1, 1, 1, 50)])
+    # Data files are append-only and the index points to the new pixels.
+    assert os.path.getsize(storage._get_data_filename(1)) > size
+    _assert_value(storage.get(1, [(1, 1)])[(1, 1)], 50)
+
+
+def test_archive_tile_storage_missing_tiles(storage):
+    assert storage.get(1, [(0, 0)]) == {}
+    storage.put([_create_tile(1, 0, 0, 10)])
+    tiles = storage.get(1, [(0, 0), (1, 1), (5, 5), (-1, 0)])
+    assert set(tiles) == {(0, 0)}
+    assert storage.get(0, [(0, 0)]) == {}
+    assert storage.get(1, []) == {}
+
+
+def test_archive_tile_storage_out_of_range(storage):
+    with pytest.raises(IndexError):
+        storage.put([_create_tile(1, 2, 0, 10)])
+    with pytest.raises(IndexError):
+        storage.put([_create_tile(0, 0, 1, 10)])
+
+
+def test_archive_tile_storage_delete(storage):
+    storage.put([_create_tile(1, 0, 0, 10)])
+    storage.delete()
+    assert not os.path.exists(storage.location)
+    assert storage.get(1, [(0, 0)]) == {}
@@ -0,0 +1,69 @@
+import pytest
+
+from tmlib.utils import LRUCache
+from tmlib.utils import calc_hilbert_index
+from tmlib.utils import imap_threaded
+
+
+def test_lru_cache_discards_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert 'b' not in cache
+    assert cache['a'] == 1
+    assert cache['c'] == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache_get_default():
+    cache = LRUCache(maxsize=1)
+    assert cache.get('a') is None
+    assert cache.get('a', 0) == 0
+    with pytest.raises(KeyError):
+        cache['a']
+
+
+def test_lru_cache_getsizeof():
+    cache = LRUCache(maxsize=10, getsizeof=len)
+    cache['a'] = 'xxxx'
+    cache['b'] = 'xxxx'
+    cache['c'] = 'xxxx'
+    assert 'a' not in cache
+    assert cache.currsize == 8
+    cache['d'] = 'x' * 20
+    assert 'd' in cache
+    assert len(cache) == 1
+    assert cache.currsize == 20
+
+
+def test_calc_hilbert_index():
+    n = 8
+    coordinates = sorted(
+        [(y, x) for y in range(n) for x in range(n)],
+        key=lambda c: calc_hilbert_index(n, *c)
+    )
+    assert coordinates[0] == (0, 0)
+    for (y1, x1), (y2, x2) in zip(coordinates[:-1], coordinates[1:]):
+        assert abs(y1 - y2) + abs(x1 - x2) == 1
+
+
+def test_imap_threaded():
+    assert list(imap_threaded(lambda x: x**2, range(10), 1)) == \
+        [x**2 for x in range(10)]
+    results = imap_threaded(lambda x: x**2, iter(range(100)), 4, 3)
+    assert list(results) == [x**2 for x in range(100)]
+
+
+def test_imap_threaded_bounded():
+    consumed = list()
+
+    def items():
+        for i in range(20):
+            consumed.append(i)
+            yield i
+
+    results = imap_threaded(lambda x: x, items(), 2, 4)
+    assert next(results) == 0
+    assert len(consumed) <= 5
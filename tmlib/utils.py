@@ -21,6 +21,9 @@ import datetime
 import re
 import os
 import inspect
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
 from decorator import decorator
 from types import *
 import logging
@@ -522,6 +525,198 @@ class autocreate_directory_property(object):
         return value
 
 
+class LRUCache(object):
+
+    '''Mapping that holds at most `maxsize` items and discards the least
+    recently used item when a new item is added to a full cache.
+    Access is synchronized, such that a cache can be shared between threads.
+
+    When a function `getsizeof` is provided, `maxsize` limits the total size
+    of the items as determined by the function rather than their number.
+
+    Examples
+    --------
+    .. code:: python
+
+        from tmlib.utils import LRUCache
+
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache.get('a')
+        cache['c'] = 3  # discards "b"
+
+        # Cache at most 100 MB of numpy arrays
+        cache = LRUCache(maxsize=100 * 1024**2, getsizeof=lambda a: a.nbytes)
+    '''
+
+    def __init__(self, maxsize, getsizeof=None):
+        '''
+        Parameters
+        ----------
+        maxsize: int
+            maximal number or total size of cached items
+        getsizeof: function, optional
+            function that returns the size of an item (default: ``None``,
+            i.e. each item has size one)
+
+        Note
+        ----
+        The most recently added item is always retained, even if its size
+        exceeds `maxsize`.
+        '''
+        if not maxsize > 0:
+            raise ValueError('Argument "maxsize" must be positive.')
+        self.maxsize = maxsize
+        if getsizeof is None:
+            getsizeof = lambda value: 1
+        self.getsizeof = getsizeof
+        self.currsize = 0
+        self._items = collections.OrderedDict()
+        self._sizes = dict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._items.pop(key)
+            self._items[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._discard(key)
+            size = self.getsizeof(value)
+            self._items[key] = value
+            self._sizes[key] = size
+            self.currsize += size
+            while self.currsize > self.maxsize and len(self._items) > 1:
+                self._discard(next(iter(self._items)))
+
+    def _discard(self, key):
+        if key in self._items:
+            del self._items[key]
+            self.currsize -= self._sizes.pop(key)
+
+    def get(self, key, default=None):
+        '''Gets a cached item and marks it as most recently used.
+
+        Parameters
+        ----------
+        key: hashable
+            key of the item
+        default: optional
+            value that should be returned in case `key` is not cached
+
+        Returns
+        -------
+        cached item or `default`
+        '''
+        with self._lock:
+            try:
+                return self[key]
+            except KeyError:
+                return default
+
+    def clear(self):
+        '''Removes all items from the cache.'''
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self.currsize = 0
+
+
+def calc_hilbert_index(n, y, x):
+    '''Calculates the position of a point along the Hilbert curve that fills
+    a square grid. Sorting points by their position along the curve orders
+    them such that neighbouring points are mostly close to each other.
+
+    Parameters
+    ----------
+    n: int
+        number of points along each axis of the grid (must be a power of two)
+    y: int
+        zero-based coordinate of the point along the vertical axis
+    x: int
+        zero-based coordinate of the point along the horizontal axis
+
+    Returns
+    -------
+    int
+        zero-based position along the curve
+    '''
+    if n < 1 or n & (n - 1) != 0:
+        raise ValueError('Argument "n" must be a power of two.')
+    index = 0
+    s = n // 2
+    while s > 0:
+        rx = int((x & s) > 0)
+        ry = int((y & s) > 0)
+        index += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant such that the curve continues there
+        if ry == 0:
+            if rx == 1:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+        s //= 2
+    return index
+
+
+def imap_threaded(func, iterable, n_threads, max_pending=None):
+    '''Applies a function to each item of an iterable in a pool of threads
+    and yields the results in the order of the items.
+
+    The iterable is consumed by the calling thread and at most `max_pending`
+    items are processed or waiting to be processed at any time, such that
+    memory consumption stays bounded. This is only beneficial for functions
+    that release the global interpreter lock, such as most *OpenCV* and
+    many *NumPy* functions.
+
+    Parameters
+    ----------
+    func: function
+        function that should be applied to each item
+    iterable: iterable
+        items
+    n_threads: int
+        number of threads; items are processed by the calling thread in case
+        of a single thread
+    max_pending: int, optional
+        maximal number of pending items (default: twice `n_threads`)
+
+    Returns
+    -------
+    generator
+        results
+    '''
+    if n_threads < 1:
+        raise ValueError('Argument "n_threads" must be positive.')
+    if max_pending is None:
+        max_pending = 2 * n_threads
+    if n_threads == 1:
+        for item in iterable:
+            yield func(item)
+        return
+    pool = ThreadPool(n_threads)
+    try:
+        pending = collections.deque()
+        for item in iterable:
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+            pending.append(pool.apply_async(func, (item, )))
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 def same_docstring_as(ref_func):
     '''Decorator function that sets the docstring of the decorate function
     to the one of `ref_func`.
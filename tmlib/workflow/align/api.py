@@ -24,6 +24,7 @@ from sqlalchemy.orm.exc import NoResultFound
 from tmlib.errors import JobDescriptionError
 from tmlib.workflow.align import registration as reg
 from tmlib.workflow.api import WorkflowStepAPI
+from tmlib.workflow.loader import ChannelImageLoader
 from tmlib.workflow import register_step_api
 
 logger = logging.getLogger(__name__)
@@ -215,11 +216,20 @@ class ImageRegistrator(WorkflowStepAPI):
                         )
                     target_stats[cycle_id] = illumstats_file.get()
 
+            # Images are loaded in the order in which they are registered:
+            # the reference image of a site followed by its target images.
+            file_ids = list()
+            for i, rid in enumerate(reference_file_ids):
+                file_ids.append(rid)
+                for cycle_id, tids in target_file_ids.iteritems():
+                    file_ids.append(tids[i])
+            images = iter(ChannelImageLoader(self.experiment_id, file_ids))
+
             for i, rid in enumerate(reference_file_ids):
-                reference_file = session.query(tm.ChannelImageFile).get(rid)
-                logger.info('register images at site %d', reference_file.site_id)
                 logger.debug('load reference image %d', rid)
-                reference_img = reference_file.get()
+                reference_img = next(images)
+                site_id = reference_img.metadata.site_id
+                logger.info('register images at site %d', site_id)
                 if batch['illumcorr']:
                     logger.debug('correct reference image')
                     reference_img = reference_img.correct(reference_stats)
@@ -228,8 +238,7 @@ class ImageRegistrator(WorkflowStepAPI):
                 for cycle_id, tids in target_file_ids.iteritems():
                     logger.info('calculate shifts for cycle %s', cycle_id)
                     logger.debug('load target image %d', tids[i])
-                    target_file = session.query(tm.ChannelImageFile).get(tids[i])
-                    target_img = target_file.get()
+                    target_img = next(images)
                     if batch['illumcorr']:
                         logger.debug('correct target image')
                         target_img = target_img.correct(target_stats[cycle_id])
@@ -241,8 +250,8 @@ class ImageRegistrator(WorkflowStepAPI):
                     session.get_or_create(
                         tm.SiteShift,
                         x=x, y=y,
-                        site_id=target_file.site_id,
-                        cycle_id=target_file.cycle_id
+                        site_id=target_img.metadata.site_id,
+                        cycle_id=target_img.metadata.cycle_id
                     )
 
                     y_shifts.append(y)
@@ -253,7 +262,7 @@ class ImageRegistrator(WorkflowStepAPI):
                     y_shifts, x_shifts
                 )
 
-                site = session.query(tm.Site).get(reference_file.site_id)
+                site = session.query(tm.Site).get(site_id)
                 site.bottom_residue = bottom
                 site.top_residue = top
                 site.left_residue = left
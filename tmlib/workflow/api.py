@@ -366,12 +366,14 @@ class WorkflowStepAPI(BasicWorkflowStepAPI):
                     command.extend(['--%s' % arg.flag, str(value)])
         return command
 
-    def _build_run_command(self, job_id, verbosity):
+    def _build_run_command(self, job_id, verbosity, cores=1):
         logger.debug('build "run" command')
         command = [self.step_name]
         command.extend(['-v' for x in range(verbosity)])
         command.append(self.experiment_id)
         command.extend(['run', '--job', str(job_id), '--assume-clean-state'])
+        if cores > 1:
+            command.extend(['--cores', str(cores)])
         return command
 
     def _build_collect_command(self, verbosity):
@@ -640,7 +642,7 @@ class WorkflowStepAPI(BasicWorkflowStepAPI):
         for j in job_ids:
             job = RunJob(
                 step_name=self.step_name,
-                arguments=self._build_run_command(j, verbosity),
+                arguments=self._build_run_command(j, verbosity, cores),
                 output_dir=self.log_location,
                 job_id=j,
                 submission_id=job_collection.submission_id,
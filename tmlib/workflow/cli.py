@@ -369,8 +369,12 @@ class WorkflowStepCLI(WorkflowSubmissionManager):
         logger.debug('remove batches of previous submission')
         shutil.rmtree(api.batches_location)
         os.mkdir(api.batches_location)
-        logger.info('delete previous job output')
-        api.delete_previous_job_output()
+        # Steps may support updating the output of previous submissions.
+        if getattr(self._batch_args, 'incremental', False):
+            logger.info('keep previous job output')
+        else:
+            logger.info('delete previous job output')
+            api.delete_previous_job_output()
         logger.info('create batches for run jobs')
         batches = api.create_run_batches(self._batch_args)
         for index, batch in enumerate(batches):
@@ -390,12 +394,18 @@ class WorkflowStepCLI(WorkflowSubmissionManager):
             type=bool,
             help='assume that previous outputs have been cleaned up',
             flag='assume-clean-state', default=False
+        ),
+        cores=Argument(
+            type=int, help='number of CPU cores available to the job',
+            default=1
         )
     )
-    def run(self, job_id, assume_clean_state):
+    def run(self, job_id, assume_clean_state, cores):
         self._print_logo()
         api = self.api_instance
         batch = api.get_run_batch(job_id)
+        # Steps may process the batch with all cores allocated to the job.
+        batch['cores'] = cores
         logger.info('run job #%d' % job_id)
         api.run_job(batch, assume_clean_state)
 
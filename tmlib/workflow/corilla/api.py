@@ -14,14 +14,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
+import shutil
 import logging
+import itertools
+import collections
 from sqlalchemy import func
 
 import tmlib.models as tm
-from tmlib.utils import notimplemented
+from tmlib.utils import autocreate_directory_property
 from tmlib.image import IllumstatsContainer
 from tmlib.models.utils import delete_location
 from tmlib.workflow.api import WorkflowStepAPI
+from tmlib.workflow.loader import ChannelImageLoader
 from tmlib.workflow.corilla.stats import OnlineStatistics
 from tmlib.workflow import register_step_api
 
@@ -42,6 +46,18 @@ class IllumstatsCalculator(WorkflowStepAPI):
         '''
         super(IllumstatsCalculator, self).__init__(experiment_id)
 
+    @autocreate_directory_property
+    def partial_stats_location(self):
+        '''str: location where statistics calculated by individual run jobs
+        are stored until they get merged in the *collect* phase
+        '''
+        return os.path.join(self.step_location, 'partial_stats')
+
+    def _build_partial_stats_filename(self, job_id):
+        return os.path.join(
+            self.partial_stats_location, 'partial_stats_%.7d.h5' % job_id
+        )
+
     def create_run_batches(self, args):
         '''Creates job descriptions for parallel computing.
 
@@ -54,6 +70,11 @@ class IllumstatsCalculator(WorkflowStepAPI):
         -------
         generator
             job descriptions
+
+        Note
+        ----
+        Images of each channel are distributed across several jobs, whose
+        results get merged in the *collect* phase.
         '''
         count = 0
 
@@ -97,12 +118,14 @@ class IllumstatsCalculator(WorkflowStepAPI):
                     )
                     continue
 
-                count += 1
-                yield {
-                    'id': count,
-                    'channel_image_files_ids': file_ids,
-                    'channel_id': ch.id,
-                }
+                file_ids = [f.id for f in file_ids]
+                for batch in self._create_batches(file_ids, args.batch_size):
+                    count += 1
+                    yield {
+                        'id': count,
+                        'channel_image_files_ids': batch,
+                        'channel_id': ch.id,
+                    }
 
     def delete_previous_job_output(self):
         '''Deletes all :class:`tmlib.models.file.IllumstatsFile` instances
@@ -111,9 +134,12 @@ class IllumstatsCalculator(WorkflowStepAPI):
         logger.info('delete existing illumination statistics files')
         with tm.utils.ExperimentSession(self.experiment_id) as session:
             session.query(tm.IllumstatsFile).delete()
+        shutil.rmtree(self.partial_stats_location)
+        os.mkdir(self.partial_stats_location)
 
     def run_job(self, batch, assume_clean_state=False):
-        '''Calculates illumination statistics.
+        '''Calculates illumination statistics for a subset of the images
+        of a channel.
 
         Parameters
         ----------
@@ -124,28 +150,49 @@ class IllumstatsCalculator(WorkflowStepAPI):
         '''
         file_ids = batch['channel_image_files_ids']
         logger.info('calculate illumination statistics')
-        with tm.utils.ExperimentSession(self.experiment_id) as session:
-            img_file = session.query(tm.ChannelImageFile).get(file_ids[0])
-            img = img_file.get()
-        stats = OnlineStatistics(image_dimensions=img.dimensions[0:2])
-        for fid in file_ids:
-            with tm.utils.ExperimentSession(self.experiment_id) as session:
-                img_file = session.query(tm.ChannelImageFile).get(fid)
-                logger.info('update statistics for image: %d', img_file.id)
-                img = img_file.get()
-                stats.update(img)
+        loader = ChannelImageLoader(self.experiment_id, file_ids)
+        stats = None
+        for fid, img in itertools.izip(file_ids, loader):
+            if stats is None:
+                stats = OnlineStatistics(image_dimensions=img.dimensions[0:2])
+            logger.info('update statistics for image: %d', fid)
+            stats.update(img)
+
+        logger.info('write partial statistics to file')
+        stats.write(self._build_partial_stats_filename(batch['id']))
 
-        with tm.utils.ExperimentSession(self.experiment_id) as session:
-            stats_file = session.get_or_create(
-                tm.IllumstatsFile, channel_id=batch['channel_id']
-            )
-            logger.info('write calculated statistics to file')
-            illumstats = IllumstatsContainer(
-                stats.mean, stats.std, stats.percentiles
-            )
-            stats_file.put(illumstats)
-
-    @notimplemented
     def collect_job_output(self, batch):
-        pass
+        '''Merges the statistics calculated by individual run jobs and
+        writes the result for each channel to an
+        :class:`IllumstatsFile <tmlib.models.file.IllumstatsFile>`.
 
+        Parameters
+        ----------
+        batch: dict
+            job description
+        '''
+        job_ids = collections.defaultdict(list)
+        for j in sorted(self.get_run_job_ids()):
+            run_batch = self.get_run_batch(j)
+            job_ids[run_batch['channel_id']].append(j)
+
+        for channel_id, ids in job_ids.iteritems():
+            logger.info('merge statistics for channel %d', channel_id)
+            filenames = [self._build_partial_stats_filename(j) for j in ids]
+            stats = OnlineStatistics.read(filenames[0])
+            for f in filenames[1:]:
+                logger.debug('merge statistics from file: %s', f)
+                stats.merge(OnlineStatistics.read(f))
+
+            with tm.utils.ExperimentSession(self.experiment_id) as session:
+                stats_file = session.get_or_create(
+                    tm.IllumstatsFile, channel_id=channel_id
+                )
+                logger.info('write calculated statistics to file')
+                illumstats = IllumstatsContainer(
+                    stats.mean, stats.std, stats.percentiles
+                )
+                stats_file.put(illumstats)
+
+            for f in filenames:
+                os.remove(f)
@@ -13,6 +13,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from tmlib.workflow.args import Argument
 from tmlib.workflow.args import BatchArguments
 from tmlib.workflow.args import SubmissionArguments
 from tmlib.workflow import register_step_batch_args
@@ -22,7 +23,12 @@ from tmlib.workflow import register_step_submission_args
 @register_step_batch_args('corilla')
 class CorillaBatchArguments(BatchArguments):
 
-    pass
+    batch_size = Argument(
+        type=int, default=500, flag='batch-size', short_flag='b',
+        help='''number of image files that should be processed per job;
+            statistics of individual jobs get merged per channel
+        '''
+    )
 
 
 @register_step_submission_args('corilla')
@@ -15,7 +15,6 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 
-from tmlib.utils import notimplemented
 from tmlib.utils import assert_type
 from tmlib.workflow.cli import WorkflowStepCLI
 
@@ -35,7 +34,3 @@ class Corilla(WorkflowStepCLI):
             logging level
         '''
         super(Corilla, self).__init__(api_instance, verbosity)
-
-    @notimplemented
-    def collect(self, args):
-        pass
@@ -20,6 +20,7 @@ References
 ----------
 .. [1] Stoeger T, Battich N, Herrmann MD, Yakimovich Y, Pelkmans L. 2015. "Computer vision for image-based transcriptomics". Methods.
 .. [2] Welford BP. 1962. "Note on a method for calculating corrected sums of squares and products". Technometrics 4(3):419-420.
+.. [3] Chan TF, Golub GH, LeVeque RJ. 1979. "Updating formulae and a pairwise algorithm for computing sample variances". Technical Report STAN-CS-79-773, Stanford University.
 
 '''
 
@@ -28,6 +29,8 @@ import logging
 
 from tmlib.utils import assert_type
 from tmlib.image import IllumstatsImage
+from tmlib.readers import DatasetReader
+from tmlib.writers import DatasetWriter
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +41,13 @@ class OnlineStatistics(object):
     element-by-element on a series of numpy arrays based on
     Welford's method [2] . For more information see Wikipedia article
     `"Algorithms for calculating variance" <https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Online_algorithm>`_.
+
+    Percentiles are calculated exactly from a histogram of pixel intensities
+    that is accumulated over all images.
+
+    Statistics calculated independently on different series of images
+    can be combined via :meth:`merge <tmlib.workflow.corilla.stats.OnlineStatistics.merge>`
+    using the parallel algorithm of Chan et al. [3] .
     '''
 
     def __init__(self, image_dimensions, decimals=3):
@@ -56,9 +66,10 @@ class OnlineStatistics(object):
         self._M2 = np.zeros(image_dimensions, dtype=float)
         if not(0 <= decimals <= 3):
             raise ValueError('Argument "decimals" must lie in range [0, 3].')
+        self.decimals = decimals
         precision = 10**(decimals+2)
         self._q = np.linspace(0, 100, precision)
-        self._percentiles = np.zeros((precision, ), dtype=np.float)
+        self._histogram = np.zeros((2**16, ), dtype=np.int64)
         self._keys = [round(x, decimals) for x in self._q]
 
     @assert_type(image='tmlib.image.ChannelImage')
@@ -72,8 +83,10 @@ class OnlineStatistics(object):
         log_transform: bool, optional
             log10 transform image (default: ``True``)
         '''
-        # Calculate percentiles with unsigned integer data type
-        self._percentiles += np.percentile(image.array, self._q)
+        # Count pixel intensities with unsigned integer data type
+        self._histogram += np.bincount(
+            image.array.ravel(), minlength=self._histogram.shape[0]
+        )
         # The other statistics require float data type
         array = image.array.astype(float)
         if log_transform:
@@ -113,9 +126,98 @@ class OnlineStatistics(object):
 
     @property
     def percentiles(self):
-        '''Dict[float, int]: calculated percentiles (rounded to integer values)
+        '''Dict[float, int]: percentiles of pixel intensities over all images
+        (rounded to integer values)
+
+        Note
+        ----
+        Percentiles are linearly interpolated between the two closest pixel
+        intensities in the same way as by :func:`numpy.percentile`.
+        '''
+        counts = np.cumsum(self._histogram)
+        # Zero-based positions of percentiles in the sorted pixel intensities
+        ranks = self._q / 100.0 * (counts[-1] - 1)
+        lower_ranks = np.floor(ranks)
+        upper_ranks = np.minimum(lower_ranks + 1, counts[-1] - 1)
+        lower = np.searchsorted(counts, lower_ranks, side='right')
+        upper = np.searchsorted(counts, upper_ranks, side='right')
+        values = lower + (upper - lower) * (ranks - lower_ranks)
+        return {self._keys[i]: int(x) for i, x in enumerate(values)}
+
+    def merge(self, other):
+        '''Merges statistics that were calculated on another series of images
+        into the statistics of this object.
+
+        Parameters
+        ----------
+        other: tmlib.workflow.corilla.stats.OnlineStatistics
+            statistics of another series of images
+
+        Raises
+        ------
+        ValueError
+            when image dimensions don't match
+        '''
+        if not isinstance(other, OnlineStatistics):
+            raise TypeError(
+                'Argument "other" must have type '
+                'tmlib.workflow.corilla.stats.OnlineStatistics.'
+            )
+        if tuple(other.image_dimensions) != tuple(self.image_dimensions):
+            raise ValueError('Image dimensions don\'t match.')
+        self._histogram += other._histogram
+        n = self.n + other.n
+        if other.n == 0:
+            return
+        delta_mean = other._mean - self._mean
+        self._mean = self._mean + delta_mean * (float(other.n) / n)
+        self._M2 = (
+            self._M2 + other._M2 +
+            delta_mean**2 * (float(self.n) * other.n / n)
+        )
+        self.n = n
+
+    def write(self, filename):
+        '''Writes the current state of the statistics to a HDF5 file, such
+        that it can be merged with statistics calculated in other processes.
+
+        Parameters
+        ----------
+        filename: str
+            absolute path to the file
+        '''
+        logger.debug('write statistics to file: %s', filename)
+        with DatasetWriter(filename, truncate=True) as f:
+            f.write('n', self.n)
+            f.write('decimals', self.decimals)
+            f.write('mean', self._mean)
+            f.write('M2', self._M2)
+            f.write('histogram', self._histogram)
+
+    @classmethod
+    def read(cls, filename):
+        '''Reads the state of statistics from a HDF5 file.
+
+        Parameters
+        ----------
+        filename: str
+            absolute path to the file
+
+        Returns
+        -------
+        tmlib.workflow.corilla.stats.OnlineStatistics
+            statistics
+
+        See also
+        --------
+        :meth:`tmlib.workflow.corilla.stats.OnlineStatistics.write`
         '''
-        return {
-            self._keys[i]: int(x/self.n)
-            for i, x in enumerate(self._percentiles)
-        }
+        logger.debug('read statistics from file: %s', filename)
+        with DatasetReader(filename) as f:
+            mean = f.read('mean')
+            stats = cls(mean.shape, int(f.read('decimals')))
+            stats.n = int(f.read('n'))
+            stats._mean = mean
+            stats._M2 = f.read('M2')
+            stats._histogram = f.read('histogram')
+        return stats
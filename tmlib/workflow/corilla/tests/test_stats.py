@@ -0,0 +1,50 @@
+import numpy as np
+
+from tmlib.image import ChannelImage
+from tmlib.workflow.corilla.stats import OnlineStatistics
+
+
+def _create_images(n):
+    rs = np.random.RandomState(0)
+    return [
+        ChannelImage(rs.randint(1, 1000, (10, 12)).astype(np.uint16))
+        for i in range(n)
+    ]
+
+
+def test_merge_equals_sequential_update():
+    images = _create_images(9)
+    expected = OnlineStatistics((10, 12), decimals=1)
+    for img in images:
+        expected.update(img)
+    stats = OnlineStatistics((10, 12), decimals=1)
+    for i in range(0, len(images), 4):
+        partial = OnlineStatistics((10, 12), decimals=1)
+        for img in images[i:i+4]:
+            partial.update(img)
+        stats.merge(partial)
+    assert stats.n == expected.n
+    np.testing.assert_allclose(stats.mean.array, expected.mean.array)
+    np.testing.assert_allclose(stats.std.array, expected.std.array)
+    assert stats.percentiles == expected.percentiles
+
+
+def test_merge_empty():
+    stats = OnlineStatistics((10, 12), decimals=1)
+    for img in _create_images(3):
+        stats.update(img)
+    mean = stats.mean.array.copy()
+    stats.merge(OnlineStatistics((10, 12), decimals=1))
+    assert stats.n == 3
+    np.testing.assert_allclose(stats.mean.array, mean)
+
+
+def test_percentiles_are_exact():
+    images = _create_images(5)
+    stats = OnlineStatistics((10, 12), decimals=1)
+    for img in images:
+        stats.update(img)
+    pixels = np.concatenate([img.array.ravel() for img in images])
+    percentiles = stats.percentiles
+    for q, key in zip(stats._q, stats._keys):
+        assert percentiles[key] == int(np.percentile(pixels, q))
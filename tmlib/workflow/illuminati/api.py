@@ -15,10 +15,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import logging
+import threading
 import numpy as np
 import collections
 import itertools
-import shapely.geometry
 import psycopg2
 import sqlalchemy.orm
 from sqlalchemy import func
@@ -28,12 +28,19 @@ from gc3libs.quantity import Memory
 
 import tmlib.models as tm
 from tmlib.utils import flatten, notimplemented, create_partitions
+from tmlib.utils import LRUCache, calc_hilbert_index, imap_threaded
+from tmlib.utils import autocreate_directory_property
+from tmlib.readers import JsonReader
+from tmlib.writers import JsonWriter
 from tmlib.image import PyramidTile
-from tmlib.image import Image
+from tmlib.image import TileCodec
+from tmlib.image import ChannelImage
+from tmlib.image import ChannelImageProcessor
 from tmlib.errors import DataIntegrityError
 from tmlib.errors import WorkflowError
 from tmlib.models.utils import delete_location
 from tmlib.workflow.api import WorkflowStepAPI
+from tmlib.workflow.loader import ChannelImageLoader
 from tmlib.workflow.jobs import RunJob
 from tmlib.workflow.jobs import SingleRunPhase
 from tmlib.workflow.jobs import MultiRunPhase
@@ -46,6 +53,17 @@ logger = logging.getLogger(__name__)
 @register_step_api('illuminati')
 class PyramidBuilder(WorkflowStepAPI):
 
+    # Maximal number of tiles of the next higher zoom level that are
+    # selected from the database and held in memory at once
+    _PRE_TILES_PER_QUERY = 1024
+
+    # Number of created tiles that are buffered in memory and then
+    # ingested into the database at once
+    _TILES_PER_INGEST = 500
+
+    # Maximal number of bytes of processed images that are cached per job
+    _IMAGE_CACHE_SIZE = 512 * 1024**2
+
     def __init__(self, experiment_id):
         '''
         Parameters
@@ -55,6 +73,142 @@ class PyramidBuilder(WorkflowStepAPI):
         '''
         super(PyramidBuilder, self).__init__(experiment_id)
 
+    @autocreate_directory_property
+    def manifests_location(self):
+        '''str: location where the manifests of built layers are stored'''
+        return os.path.join(self.step_location, 'manifests')
+
+    def _get_manifest_filename(self, layer_id, pending=False):
+        filename = os.path.join(
+            self.manifests_location, 'layer_%d.manifest.json' % layer_id
+        )
+        if pending:
+            filename += '.pending'
+        return filename
+
+    def _create_manifest(self, session, layer, image_files, args):
+        '''Creates the manifest of a layer, which describes the state of its
+        inputs: the settings that affect all tiles, including the clip values
+        in case tiles are rescaled to 8-bit and the modification time of the
+        illumination statistics file in case images get corrected, and the
+        state of each channel image file, i.e. its modification time and, in
+        case images get aligned, the shift and residues of its site.
+
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            experiment-specific database session
+        layer: tmlib.models.channel.ChannelLayer
+            channel layer
+        image_files: List[tmlib.models.file.ChannelImageFile]
+            image files of the layer
+        args: tmlib.workflow.illuminati.args.IlluminatiBatchArguments
+            step-specific arguments
+
+        Returns
+        -------
+        dict
+        '''
+        def get_mtime(location):
+            if os.path.exists(location):
+                return os.path.getmtime(location)
+            return None
+
+        settings = {
+            'align': args.align,
+            'illumcorr': args.illumcorr,
+            'bit_depth': args.bit_depth,
+            'codec': layer.codec,
+            'dimensions': [list(d) for d in layer.dimensions]
+        }
+        if args.bit_depth != 16:
+            # 16-bit tiles hold the unclipped pixels, which are only rescaled
+            # when tiles get rendered.
+            settings['min_intensity'] = int(layer.min_intensity)
+            settings['max_intensity'] = int(layer.max_intensity)
+        if args.illumcorr:
+            # Statistics get replaced when they are calculated anew and
+            # affect the pixels of all tiles.
+            stats_file = session.query(tm.IllumstatsFile).\
+                filter_by(channel_id=layer.channel_id).\
+                one_or_none()
+            if stats_file is not None:
+                settings['illumstats'] = get_mtime(stats_file.location)
+            else:
+                settings['illumstats'] = None
+        if args.align:
+            # Shifts get replaced when images are aligned anew without
+            # modifying the image files.
+            cycle_ids = list(set([f.cycle_id for f in image_files]))
+            shifts = session.query(
+                    tm.SiteShift.site_id, tm.SiteShift.cycle_id,
+                    tm.SiteShift.y, tm.SiteShift.x
+                ).\
+                filter(tm.SiteShift.cycle_id.in_(cycle_ids)).\
+                all()
+            shift_lut = {(s.site_id, s.cycle_id): [s.y, s.x] for s in shifts}
+        files = dict()
+        for f in image_files:
+            state = [get_mtime(f.location)]
+            if args.align:
+                state.extend(
+                    shift_lut.get((f.site_id, f.cycle_id), [None, None])
+                )
+                state.extend([
+                    f.site.top_residue, f.site.bottom_residue,
+                    f.site.left_residue, f.site.right_residue
+                ])
+            files[str(f.id)] = state
+        return {'settings': settings, 'files': files}
+
+    def _get_dirty_base_tiles(self, layer, manifest):
+        '''Determines the tiles at the maximal zoom level that intersect with
+        channel image files, which changed since the layer was last built.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            channel layer
+        manifest: dict
+            current manifest of the layer
+
+        Returns
+        -------
+        Set[Tuple[int]]
+            row and column indices of tiles that need to be rebuilt or
+            ``None`` in case the whole layer needs to be rebuilt
+
+        See also
+        --------
+        :meth:`tmlib.workflow.illuminati.api.PyramidBuilder._create_manifest`
+        '''
+        filename = self._get_manifest_filename(layer.id)
+        if not os.path.exists(filename):
+            logger.info('layer %d has not been built before', layer.id)
+            return None
+        with JsonReader(filename) as f:
+            previous = f.read()
+        if previous['settings'] != manifest['settings']:
+            logger.info('settings of layer %d changed', layer.id)
+            return None
+        if set(previous['files']) - set(manifest['files']):
+            # Tiles of removed images cannot be located anymore.
+            logger.info('image files of layer %d were removed', layer.id)
+            return None
+        changed_file_ids = set([
+            int(fid) for fid, state in manifest['files'].iteritems()
+            if previous['files'].get(fid) != state
+        ])
+        logger.info(
+            '%d image files of layer %d changed',
+            len(changed_file_ids), layer.id
+        )
+        return set([
+            coordinate for coordinate, file_ids
+            in layer.base_tile_coordinate_to_image_file_map.iteritems()
+            if changed_file_ids.intersection(file_ids)
+        ])
+
     def create_run_batches(self, args):
         '''Creates job descriptions for parallel computing.
 
@@ -89,6 +243,12 @@ class PyramidBuilder(WorkflowStepAPI):
                     'Number of wells must be the same for each plate!'
                 )
 
+        try:
+            codec = TileCodec.create_from_tag(args.codec)
+        except ValueError as error:
+            raise WorkflowError('Invalid tile codec: %s' % str(error))
+        logger.info('encode tiles with codec "%s"', codec.tag)
+
         logger.info('create job descriptions')
         logger.debug('create descriptions for "run" jobs')
         job_count = 0
@@ -107,11 +267,13 @@ class PyramidBuilder(WorkflowStepAPI):
                 tpoints = [r.tpoint for r in results]
                 for t, z in itertools.product(tpoints, zplanes):
                     logger.info('create layer for tpoint %d, zplane %d', t, z)
-                    image_files = session.query(tm.ChannelImageFile.id).\
+                    image_files = session.query(tm.ChannelImageFile).\
+                        options(
+                            sqlalchemy.orm.joinedload(tm.ChannelImageFile.site)
+                        ).\
                         filter_by(channel_id=channel.id, tpoint=t, zplane=z).\
-                        order_by(tm.ChannelImageFile.site_id).\
                         all()
-                    image_file_ids = [f.id for f in image_files]
+                    image_file_ids = self._sort_image_files(image_files)
                     layer = session.get_or_create(
                         tm.ChannelLayer, channel_id=channel.id,
                         tpoint=t, zplane=z
@@ -165,6 +327,7 @@ class PyramidBuilder(WorkflowStepAPI):
 
                     layer.max_intensity = clip_max
                     layer.min_intensity = clip_min
+                    layer.codec = codec.tag
 
                     if count == 0:
                         logger.info('calculate size of pyramid base level')
@@ -176,39 +339,110 @@ class PyramidBuilder(WorkflowStepAPI):
                     count += 1
                     n_levels = experiment.pyramid_depth
                     max_zoomlevel_index = n_levels - 1
-                    for index, level in enumerate(reversed(range(n_levels))):
+
+                    # The manifest only replaces the one of the previous
+                    # build once all jobs completed.
+                    manifest = self._create_manifest(
+                        session, layer, image_files, args
+                    )
+                    with JsonWriter(
+                            self._get_manifest_filename(layer.id, True)
+                        ) as f:
+                        f.write(manifest)
+                    dirty_tiles = None
+                    if args.incremental:
+                        dirty_tiles = self._get_dirty_base_tiles(
+                            layer, manifest
+                        )
+                        if dirty_tiles is None:
+                            logger.info('rebuild entire layer')
+                            self._delete_layer_tiles(layer.id)
+                        elif not dirty_tiles:
+                            logger.info('layer is up to date')
+                            continue
+                        else:
+                            logger.info(
+                                'rebuild %d tiles at maxzoom level and their '
+                                'ancestors', len(dirty_tiles)
+                            )
+                    # In block mode, the first jobs create all levels of
+                    # the pyramid that lie within their block and only the
+                    # remaining levels are created one after another.
+                    if args.block_depth is None:
+                        block_depth = 0
+                    else:
+                        block_depth = min(
+                            args.block_depth, max_zoomlevel_index
+                        )
+                    levels = reversed(range(n_levels - block_depth))
+                    for index, level in enumerate(levels):
                         logger.info('create batches for pyramid level %d', level)
                         # The layer "level" increases from top to bottom.
                         # We build the layer bottom-up, therefore, the "index"
                         # decreases from top to bottom.
+                        if index == 0 and args.block_depth is not None:
+                            batch_size = args.batch_size
+                            block_batches = self._create_block_batches(
+                                layer, block_depth, image_file_ids,
+                                dirty_tiles
+                            )
+                            for batch in block_batches:
+                                job_count += 1
+                                batch.update({
+                                    'id': job_count,
+                                    'layer_id': layer.id,
+                                    'level': level,
+                                    'index': index,
+                                    'align': args.align,
+                                    'illumcorr': args.illumcorr,
+                                    'bit_depth': args.bit_depth
+                                })
+                                yield batch
+                            continue
                         if level == max_zoomlevel_index:
                             # For the base level, batches are composed of
                             # image files, which will get chopped into tiles.
                             batch_size = args.batch_size
-                            batches = self._create_batches(
-                                image_file_ids, batch_size
-                            )
+                            if dirty_tiles is None:
+                                batches = self._create_batches(
+                                    image_file_ids, batch_size
+                                )
+                                tile_batches = None
+                            else:
+                                batches, tile_batches = \
+                                    self._create_dirty_tile_batches(
+                                        layer, image_file_ids, dirty_tiles,
+                                        batch_size
+                                    )
                         else:
                             # For the subsequent levels, batches are composed of
                             # tiles of the previous, next higher level.
                             # Therefore, the batch size needs to be adjusted.
                             if index == 1:
                                 batch_size *= 25
+                                batch_size /= 4**block_depth
                             else:
                                 batch_size /= 4
+                            if dirty_tiles is None:
+                                coordinates = list(itertools.product(
+                                    range(layer.dimensions[level][0]),
+                                    range(layer.dimensions[level][1])
+                                ))
+                            else:
+                                coordinates = self._get_dirty_ancestor_tiles(
+                                    layer, dirty_tiles, level
+                                )
                             batches = self._create_batches(
-                                np.arange(np.prod(layer.dimensions[level])),
-                                batch_size
+                                coordinates, batch_size
                             )
-
-                        for batch in batches:
+                        for i, batch in enumerate(batches):
                             job_count += 1
                             # For the highest resolution level, the inputs
                             # are channel image files. For all other levels,
                             # the inputs are the tiles of the next higher
                             # resolution level.
                             if level == max_zoomlevel_index:
-                                yield {
+                                batch = {
                                     'id': job_count,
                                     'outputs': {},
                                     'layer_id': layer.id,
@@ -216,22 +450,178 @@ class PyramidBuilder(WorkflowStepAPI):
                                     'index': index,
                                     'image_file_ids': batch,
                                     'align': args.align,
-                                    'illumcorr': args.illumcorr
+                                    'illumcorr': args.illumcorr,
+                                    'bit_depth': args.bit_depth
                                 }
+                                if tile_batches is not None:
+                                    batch['coordinates'] = tile_batches[i]
+                                yield batch
                             else:
-                                rows = np.arange(layer.dimensions[level][0])
-                                cols = np.arange(layer.dimensions[level][1])
-                                coordinates = np.array(
-                                    list(itertools.product(rows, cols))
-                                )[batch].tolist()
                                 yield {
                                     'id': job_count,
                                     'layer_id': layer.id,
                                     'level': level,
                                     'index': index,
-                                    'coordinates': coordinates
+                                    'coordinates': batch,
+                                    'bit_depth': args.bit_depth
                                 }
 
+    @staticmethod
+    def _sort_image_files(image_files):
+        '''Sorts image files along a Hilbert curve through the grid of
+        sites, such that images of neighbouring sites mostly get processed
+        by the same job one shortly after the other.
+
+        Parameters
+        ----------
+        image_files: List[tmlib.models.file.ChannelImageFile]
+            image files
+
+        Returns
+        -------
+        List[int]
+            sorted IDs of the image files
+        '''
+        if not image_files:
+            return list()
+        coordinates = dict()
+        for f in image_files:
+            # The offset of a site is at least one image size larger than
+            # the offset of the site above or left of it.
+            y_offset, x_offset = f.site.offset
+            height, width = f.site.image_size
+            coordinates[f.id] = (y_offset // height, x_offset // width)
+        n = max(max(c) for c in coordinates.values()) + 1
+        n = 2**int(np.ceil(np.log2(n)))
+        return sorted(
+            coordinates.keys(),
+            key=lambda fid: calc_hilbert_index(n, *coordinates[fid])
+        )
+
+    def _create_block_batches(self, layer, block_depth, image_file_ids,
+            dirty_tiles=None):
+        '''Creates batches for square blocks of tiles at the maximal zoom level,
+        which are aligned to the tiles of the lower zoom levels such that all
+        levels of the pyramid within a block can be created by a single job.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            channel layer
+        block_depth: int
+            number of zoom levels that should be created per block; the block
+            comprises `zoom_factor` to the power of `block_depth` tiles along
+            each axis
+        image_file_ids: List[int]
+            IDs of the channel image files of the layer in the order in which
+            they should be processed
+        dirty_tiles: Set[Tuple[int]], optional
+            row and column indices of tiles at the maximal zoom level that
+            need to be rebuilt; only blocks that contain any of these tiles
+            are created (default: ``None``)
+
+        Returns
+        -------
+        List[dict]
+            *y*, *x* coordinate of the upper left tile and IDs of the
+            intersecting channel image files for each block
+        '''
+        block_size = layer.zoom_factor**block_depth
+        n_rows, n_cols = layer.dimensions[layer.maxzoom_level_index]
+        file_map = layer.base_tile_coordinate_to_image_file_map
+        order = {fid: i for i, fid in enumerate(image_file_ids)}
+        if dirty_tiles is not None:
+            dirty_blocks = set([
+                (r // block_size, c // block_size) for r, c in dirty_tiles
+            ])
+        batches = list()
+        for y in range(0, n_rows, block_size):
+            for x in range(0, n_cols, block_size):
+                if dirty_tiles is not None:
+                    # Blocks are always rebuilt entirely, because all tiles
+                    # of the block are required for the lower levels.
+                    if (y // block_size, x // block_size) not in dirty_blocks:
+                        continue
+                rows = range(y, min(y + block_size, n_rows))
+                cols = range(x, min(x + block_size, n_cols))
+                file_ids = set()
+                for coordinate in itertools.product(rows, cols):
+                    file_ids.update(file_map.get(coordinate, []))
+                batches.append({
+                    'block': (y, x),
+                    'block_depth': block_depth,
+                    'image_file_ids': sorted(file_ids, key=order.get)
+                })
+        return batches
+
+    def _delete_layer_tiles(self, layer_id):
+        # Distributed tables should not be modified within a transaction.
+        exp_id = self.experiment_id
+        with tm.utils.ExperimentSession(exp_id, transaction=False) as session:
+            layer = session.query(tm.ChannelLayer).get(layer_id)
+            layer.get_tile_storage(session).delete()
+
+    def _get_dirty_ancestor_tiles(self, layer, dirty_tiles, level):
+        '''Determines the tiles at a lower zoom level that need to be rebuilt,
+        because they are ancestors of dirty tiles at the maximal zoom level.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            channel layer
+        dirty_tiles: Set[Tuple[int]]
+            row and column indices of tiles at the maximal zoom level that
+            need to be rebuilt
+        level: int
+            zero-based index of the zoom level
+
+        Returns
+        -------
+        List[Tuple[int]]
+            sorted row and column indices of tiles at `level`
+        '''
+        factor = layer.zoom_factor**(layer.maxzoom_level_index - level)
+        return sorted(set([(r // factor, c // factor) for r, c in dirty_tiles]))
+
+    def _create_dirty_tile_batches(self, layer, image_file_ids, dirty_tiles,
+            batch_size):
+        '''Creates batches of the channel image files that intersect with
+        tiles at the maximal zoom level that need to be rebuilt.
+
+        Parameters
+        ----------
+        layer: tmlib.models.channel.ChannelLayer
+            channel layer
+        image_file_ids: List[int]
+            IDs of the channel image files of the layer in the order in which
+            they should be processed
+        dirty_tiles: Set[Tuple[int]]
+            row and column indices of tiles at the maximal zoom level that
+            need to be rebuilt
+        batch_size: int
+            number of image files per batch
+
+        Returns
+        -------
+        Tuple[List[List[int]], List[List[Tuple[int]]]]
+            IDs of image files and coordinates of dirty tiles that intersect
+            with these files for each batch
+        '''
+        file_map = layer.base_tile_coordinate_to_image_file_map
+        file_ids = set(flatten([file_map[c] for c in dirty_tiles]))
+        batches = self._create_batches(
+            [fid for fid in image_file_ids if fid in file_ids], batch_size
+        )
+        batch_index = dict()
+        for i, batch in enumerate(batches):
+            for fid in batch:
+                batch_index[fid] = i
+        tile_batches = [set() for _ in batches]
+        for c in dirty_tiles:
+            for fid in file_map[c]:
+                tile_batches[batch_index[fid]].add(c)
+        return batches, [sorted(t) for t in tile_batches]
+
     def delete_previous_job_output(self):
         '''Deletes all instances of
         :class:`ChannelLayer <tmlib.models.layer.ChannelLayer>` and
@@ -247,7 +637,12 @@ class PyramidBuilder(WorkflowStepAPI):
         with tm.utils.ExperimentSession(self.experiment_id, False) as session:
             logger.info('delete existing channel layers')
             session.query(tm.ChannelLayerTile).delete()
+            for layer in session.query(tm.ChannelLayer):
+                # Tiles may have been stored on disk in archives instead.
+                delete_location(layer.tiles_location)
             session.query(tm.ChannelLayer).delete()
+            for filename in os.listdir(self.manifests_location):
+                delete_location(os.path.join(self.manifests_location, filename))
             logger.info('delete existing static mapobject types')
             session.query(tm.Mapobject).delete()
             session.query(tm.MapobjectType).delete()
@@ -326,7 +721,7 @@ class PyramidBuilder(WorkflowStepAPI):
             for j in job_ids:
                 job = RunJob(
                     step_name=self.step_name,
-                    arguments=self._build_run_command(j, verbosity),
+                    arguments=self._build_run_command(j, verbosity, cores or 1),
                     output_dir=self.log_location,
                     job_id=j,
                     index=index,
@@ -353,227 +748,456 @@ class PyramidBuilder(WorkflowStepAPI):
 
         return job_collection
 
+    def _get_channel_image_processor(self, session, layer, batch):
+        if batch['illumcorr']:
+            logger.info('correct images for illumination artifacts')
+            try:
+                logger.debug('load illumination statistics')
+                stats_file = session.query(tm.IllumstatsFile).\
+                    filter_by(channel_id=layer.channel_id).\
+                    one()
+            except NoResultFound:
+                raise WorkflowError(
+                    'No illumination statistics file found for channel %d'
+                    % layer.channel_id
+                )
+            stats = stats_file.get()
+        else:
+            stats = None
+
+        if batch['align']:
+            logger.info('align images between cycles')
+
+        if batch.get('bit_depth', 8) == 16:
+            # Tiles keep the original intensities and get clipped and
+            # rescaled only upon rendering.
+            clip_min = None
+            clip_max = None
+        else:
+            clip_min = layer.min_intensity
+            clip_max = layer.max_intensity
+        # The processor reuses its buffers and lookup tables for all images.
+        return ChannelImageProcessor(
+            stats, clip_min, clip_max, align=batch['align'], crop=False
+        )
+
+    @staticmethod
+    def _get_tile_dtype(batch):
+        if batch.get('bit_depth', 8) == 16:
+            return np.uint16
+        return np.uint8
+
+    def _iter_maxzoom_level_tiles(self, session, layer, batch,
+            coordinates=None):
+        # Creates the tiles of the images of the batch at the maximal
+        # zoom level, optionally restricted to the given tile coordinates.
+        processor = self._get_channel_image_processor(session, layer, batch)
+        dtype = self._get_tile_dtype(batch)
+
+        def process(image):
+            image = processor.process(image)
+            if image.array.dtype != dtype:
+                # Images of 8-bit channels are stored with 16-bit as well.
+                image = ChannelImage(image.array.astype(dtype), image.metadata)
+            return image
+
+        level = layer.maxzoom_level_index
+        files = list()
+        for fid in batch['image_file_ids']:
+            file = session.query(tm.ChannelImageFile).get(fid)
+            tiles = layer.map_image_to_base_tiles(file)
+            if coordinates is not None:
+                tiles = [t for t in tiles if (t['y'], t['x']) in coordinates]
+            if tiles:
+                files.append((file, tiles))
+            else:
+                logger.debug('skip image %d', file.id)
+
+        # Processed images are cached for the whole job, since neighbouring
+        # images are required for tiles that overlap several images.
+        image_store = LRUCache(
+            maxsize=self._IMAGE_CACHE_SIZE,
+            getsizeof=lambda image: image.array.nbytes
+        )
+        loader = ChannelImageLoader(
+            self.experiment_id, [file.id for file, _ in files]
+        )
+        for (file, tiles), image in itertools.izip(files, loader):
+            logger.info('process image %d', file.id)
+            if file.id not in image_store:
+                image_store[file.id] = process(image)
+            # Keep a reference, in case the image gets discarded from the cache.
+            file_image = image_store[file.id]
+
+            extra_file_map = layer.map_base_tile_to_images(file.site)
+            for t in tiles:
+                row = t['y']
+                column = t['x']
+                logger.debug(
+                    'create tile: z=%d, y=%d, x=%d', level, row, column
+                )
+                tile = layer.extract_tile_from_image(
+                    file_image, t['y_offset'], t['x_offset']
+                )
+                # Determine files that contain overlapping pixels,
+                # i.e. pixels falling into the currently processed tile
+                # that are not contained by the file.
+                file_coordinate = np.array((file.site.y, file.site.x))
+                extra_file_ids = extra_file_map[row, column]
+                if len(extra_file_ids) > 0:
+                    logger.debug('tile overlaps multiple images')
+                for efid in extra_file_ids:
+                    extra_file = session.query(tm.ChannelImageFile).\
+                        get(efid)
+                    pixels = image_store.get(extra_file.id)
+                    if pixels is None:
+                        pixels = process(extra_file.get())
+                        image_store[extra_file.id] = pixels
+
+                    extra_file_coordinate = np.array((
+                        extra_file.site.y, extra_file.site.x
+                    ))
+
+                    condition = file_coordinate > extra_file_coordinate
+                    if all(condition):
+                        logger.debug('insert pixels from top left image')
+                        y = file.site.image_size[0] - abs(t['y_offset'])
+                        x = file.site.image_size[1] - abs(t['x_offset'])
+                        height = abs(t['y_offset'])
+                        width = abs(t['x_offset'])
+                        subtile = PyramidTile(
+                            pixels.extract(y, height, x, width).array
+                        )
+                        tile.insert(subtile, 0, 0)
+                    elif condition[0] and not condition[1]:
+                        logger.debug('insert pixels from top image')
+                        y = file.site.image_size[0] - abs(t['y_offset'])
+                        height = abs(t['y_offset'])
+                        if t['x_offset'] < 0:
+                            x = 0
+                            width = tile.dimensions[1] - abs(t['x_offset'])
+                            x_offset = abs(t['x_offset'])
+                        else:
+                            x = t['x_offset']
+                            width = tile.dimensions[1]
+                            x_offset = 0
+                        subtile = PyramidTile(
+                            pixels.extract(y, height, x, width).array
+                        )
+                        tile.insert(subtile, 0, x_offset)
+                    elif not condition[0] and condition[1]:
+                        logger.debug('insert pixels from left image')
+                        x = file.site.image_size[1] - abs(t['x_offset'])
+                        width = abs(t['x_offset'])
+                        if t['y_offset'] < 0:
+                            y = 0
+                            height = tile.dimensions[0] - abs(t['y_offset'])
+                            y_offset = abs(t['y_offset'])
+                        else:
+                            y = t['y_offset']
+                            height = tile.dimensions[0]
+                            y_offset = 0
+                        subtile = PyramidTile(
+                            pixels.extract(y, height, x, width).array
+                        )
+                        tile.insert(subtile, y_offset, 0)
+                    else:
+                        raise IndexError(
+                            'Tile shouldn\'t be in this batch!'
+                        )
+                yield (row, column, tile)
+
     def _create_maxzoom_level_tiles(self, batch, assume_clean_state):
         exp_id = self.experiment_id
         with tm.utils.ExperimentSession(exp_id, transaction=False) as session:
             layer = session.query(tm.ChannelLayer).get(batch['layer_id'])
+            storage = layer.get_tile_storage(session)
             logger.info(
                 'process layer: channel=%s, zplane=%d, tpoint=%d',
                 layer.channel.name, layer.zplane, layer.tpoint
             )
             logger.info('create tiles at zoom level %d', batch['level'])
 
-            if batch['illumcorr']:
-                logger.info('correct images for illumination artifacts')
-                try:
-                    logger.debug('load illumination statistics')
-                    image_file = session.query(tm.ChannelImageFile).get(
-                        batch['image_file_ids'][0]
-                    )
-                    stats_file = session.query(tm.IllumstatsFile).\
-                        filter_by(channel_id=layer.channel_id).\
-                        one()
-                except NoResultFound:
-                    raise WorkflowError(
-                        'No illumination statistics file found for channel %d'
-                        % layer.channel_id
-                    )
-                stats = stats_file.get()
-            else:
-                stats = None
+            layer_id = layer.id
+            codec = layer.tile_codec
+            level = batch['level']
+            layer_tiles = list()
+            # In incremental mode, only dirty tiles get rebuilt.
+            coordinates = batch.get('coordinates')
+            if coordinates is not None:
+                coordinates = set([tuple(c) for c in coordinates])
+            iterator = self._iter_maxzoom_level_tiles(
+                session, layer, batch, coordinates
+            )
+            create_layer_tile = self._create_layer_tile_factory(
+                layer_id, level, codec
+            )
 
-            if batch['align']:
-                logger.info('align images between cycles')
+            # Tiles are extracted one after another, because this requires
+            # the database session, but encoded in parallel.
+            layer_tile_iterator = imap_threaded(
+                create_layer_tile, iterator, batch.get('cores', 1)
+            )
+            for layer_tile in layer_tile_iterator:
+                layer_tiles.append(layer_tile)
+                if len(layer_tiles) >= self._TILES_PER_INGEST:
+                    self._ingest_tiles(storage, layer_tiles)
 
-            clip_min = layer.min_intensity
-            clip_max = layer.max_intensity
+            self._ingest_tiles(storage, layer_tiles)
 
-            for fid in batch['image_file_ids']:
-                file = session.query(tm.ChannelImageFile).get(fid)
-                logger.info('process image %d', file.id)
-                tiles = layer.map_image_to_base_tiles(file)
-                image_store = dict()
-                image = file.get()
-                if batch['illumcorr']:
-                    logger.debug('correct image')
-                    image = image.correct(stats)
-                if batch['align']:
-                    logger.debug('align image')
-                    image = image.align(crop=False)
-                if not image.is_uint8:
-                    image = image.clip(clip_min, clip_max)
-                    image = image.scale(clip_min, clip_max)
-                image_store[file.id] = image
-
-                extra_file_map = layer.map_base_tile_to_images(file.site)
-                for t in tiles:
-                    level = batch['level']
-                    row = t['y']
-                    column = t['x']
-                    logger.debug(
-                        'create tile: z=%d, y=%d, x=%d', level, row, column
-                    )
-                    tile = layer.extract_tile_from_image(
-                        image_store[file.id], t['y_offset'], t['x_offset']
-                    )
+    def _create_mosaic_getter(self, layer, batch):
+        # Each thread writes the tiles of the next higher level into its
+        # own buffer, which is allocated once and reused for all tiles.
+        buffers = threading.local()
+        shape = (layer.zoom_factor * layer.tile_size, ) * 2
+        dtype = self._get_tile_dtype(batch)
 
-                    # Determine files that contain overlapping pixels,
-                    # i.e. pixels falling into the currently processed tile
-                    # that are not contained by the file.
-                    file_coordinate = np.array((file.site.y, file.site.x))
-                    extra_file_ids = extra_file_map[row, column]
-                    if len(extra_file_ids) > 0:
-                        logger.debug('tile overlaps multiple images')
-                    for efid in extra_file_ids:
-                        extra_file = session.query(tm.ChannelImageFile).\
-                            get(efid)
-                        if extra_file.id not in image_store:
-                            image = extra_file.get()
-                            if batch['illumcorr']:
-                                logger.debug('correct image')
-                                image = image.correct(stats)
-                            if batch['align']:
-                                logger.debug('align image')
-                                image = image.align(crop=False)
-                            if not image.is_uint8:
-                                image = image.clip(clip_min, clip_max)
-                                image = image.scale(clip_min, clip_max)
-                            image_store[extra_file.id] = image
-
-                        extra_file_coordinate = np.array((
-                            extra_file.site.y, extra_file.site.x
-                        ))
-
-                        condition = file_coordinate > extra_file_coordinate
-                        pixels = image_store[extra_file.id]
-                        if all(condition):
-                            logger.debug('insert pixels from top left image')
-                            y = file.site.image_size[0] - abs(t['y_offset'])
-                            x = file.site.image_size[1] - abs(t['x_offset'])
-                            height = abs(t['y_offset'])
-                            width = abs(t['x_offset'])
-                            subtile = PyramidTile(
-                                pixels.extract(y, height, x, width).array
-                            )
-                            tile.insert(subtile, 0, 0)
-                        elif condition[0] and not condition[1]:
-                            logger.debug('insert pixels from top image')
-                            y = file.site.image_size[0] - abs(t['y_offset'])
-                            height = abs(t['y_offset'])
-                            if t['x_offset'] < 0:
-                                x = 0
-                                width = tile.dimensions[1] - abs(t['x_offset'])
-                                x_offset = abs(t['x_offset'])
-                            else:
-                                x = t['x_offset']
-                                width = tile.dimensions[1]
-                                x_offset = 0
-                            subtile = PyramidTile(
-                                pixels.extract(y, height, x, width).array
-                            )
-                            tile.insert(subtile, 0, x_offset)
-                        elif not condition[0] and condition[1]:
-                            logger.debug('insert pixels from left image')
-                            x = file.site.image_size[1] - abs(t['x_offset'])
-                            width = abs(t['x_offset'])
-                            if t['y_offset'] < 0:
-                                y = 0
-                                height = tile.dimensions[0] - abs(t['y_offset'])
-                                y_offset = abs(t['y_offset'])
-                            else:
-                                y = t['y_offset']
-                                height = tile.dimensions[0]
-                                y_offset = 0
-                            subtile = PyramidTile(
-                                pixels.extract(y, height, x, width).array
-                            )
-                            tile.insert(subtile, y_offset, 0)
-                        else:
-                            raise IndexError(
-                                'Tile shouldn\'t be in this batch!'
-                            )
+        def get_mosaic():
+            if not hasattr(buffers, 'mosaic'):
+                buffers.mosaic = np.zeros(shape, dtype=dtype)
+            return buffers.mosaic
 
-                    channel_layer_tile = tm.ChannelLayerTile(
-                        channel_layer_id=layer.id,
-                        z=level, y=row, x=column, pixels=tile
-                    )
-                    session.add(channel_layer_tile)
+        return get_mosaic
+
+    def _create_layer_tile_factory(self, layer_id, level, codec):
+        # Creates the function that wraps the pixels of a tile at the given
+        # level into a layer tile, which encodes them with the given codec.
+        # It gets called in parallel threads.
+        def create_layer_tile(item):
+            row, column, tile = item
+            return tm.ChannelLayerTile(
+                channel_layer_id=layer_id,
+                z=level, y=row, x=column, pixels=tile, codec=codec
+            )
+
+        return create_layer_tile
 
+    def _ingest_tiles(self, storage, tiles):
+        # Empties the buffer in place, such that it can be reused.
+        if tiles:
+            logger.debug('ingest %d tiles', len(tiles))
+            storage.put(tiles)
+            del tiles[:]
+
+    def _create_tile_from_next_higher_level(self, level, pre_coordinates,
+            pre_tiles, mosaic, allow_missing):
+        # Builds the mosaic by stitching together the tiles of the next
+        # higher level and creates the tile at the current level by
+        # downsampling the mosaic.
+        tile_size = PyramidTile.TILE_SIZE
+        zoom_factor = mosaic.shape[0] // tile_size
+        pre_rows = np.unique([c[0] for c in pre_coordinates])
+        pre_cols = np.unique([c[1] for c in pre_coordinates])
+        background = None
+        grid = list()
+        for r in pre_rows:
+            grid.append(list())
+            for c in pre_cols:
+                pixels = pre_tiles.get((r, c))
+                if pixels is None:
+                    # Tiles at maxzoom level might not exist in
+                    # case they did not fall into a region of
+                    # the map occupied by an image.
+                    # They must exist at the lower zoom levels,
+                    # though, for subsampling.
+                    if not allow_missing:
+                        raise ValueError(
+                            'Tile "%d-%d-%d" was not created.'
+                            % (level+1, r, c)
+                        )
+                    logger.debug('tile "%d-%d-%d" missing', level+1, r, c)
+                    # Missing tiles are filled with background.
+                    if background is None:
+                        background = np.zeros(
+                            (tile_size, tile_size), dtype=mosaic.dtype
+                        )
+                    pixels = background
+                grid[-1].append(pixels)
+        height = sum([row[-1].shape[0] for row in grid])
+        width = sum([pixels.shape[1] for pixels in grid[-1]])
+        # Downsampling tiles that all have the same constant value, which is
+        # the case for background in spacer regions between wells and plates,
+        # results in a constant tile as well.
+        value = grid[0][0].flat[0]
+        if all(np.all(pixels == value) for pixels in flatten(grid)):
+            return PyramidTile(np.full(
+                (height // zoom_factor, width // zoom_factor), value,
+                dtype=mosaic.dtype
+            ))
+        y_offset = 0
+        for row in grid:
+            x_offset = 0
+            for pixels in row:
+                h, w = pixels.shape
+                mosaic[y_offset:y_offset+h, x_offset:x_offset+w] = pixels
+                x_offset += w
+            y_offset += h
+        return PyramidTile.create_from_mosaic(
+            mosaic[:y_offset, :x_offset], zoom_factor
+        )
 
     def _create_lower_zoom_level_tiles(self, batch, assume_clean_state):
         exp_id = self.experiment_id
         with tm.utils.ExperimentSession(exp_id, transaction=False) as session:
             layer = session.query(tm.ChannelLayer).get(batch['layer_id'])
+            storage = layer.get_tile_storage(session)
             logger.info('processing layer for channel %s', layer.channel.name)
             level = batch['level']
             logger.info('creating tiles at zoom level %d', batch['level'])
             layer_id = layer.id
+            codec = layer.tile_codec
             zoom_factor = layer.zoom_factor
+            n_threads = batch.get('cores', 1)
+            allow_missing = batch['index'] <= 1
+            # Tiles of the next higher level are written into the same
+            # buffer for each tile rather than being joined.
+            get_mosaic = self._create_mosaic_getter(layer, batch)
+            create_layer_tile = self._create_layer_tile_factory(
+                layer_id, level, codec
+            )
 
-            for coordinates in batch['coordinates']:
-                row = coordinates[0]
-                column = coordinates[1]
-                pre_coordinates = layer.calc_coordinates_of_next_higher_level(
-                    level, row, column
+            def create_lower_layer_tile(item):
+                (row, column), pre_coordinates = item
+                logger.debug(
+                    'creating tile: z=%d, y=%d, x=%d', level, row, column
                 )
+                tile = self._create_tile_from_next_higher_level(
+                    level, pre_coordinates, pre_tiles, get_mosaic(),
+                    allow_missing
+                )
+                return create_layer_tile((row, column, tile))
+
+            # Tiles of the next higher level are selected from the database
+            # for several tiles at once rather than one by one.
+            n = self._PRE_TILES_PER_QUERY // zoom_factor**2
+            layer_tiles = list()
+            for coordinates in create_partitions(batch['coordinates'], n):
+                pre_coordinates = [
+                    layer.calc_coordinates_of_next_higher_level(level, r, c)
+                    for r, c in coordinates
+                ]
+                pre_tiles = storage.get(
+                    level+1, flatten(pre_coordinates), n_threads=n_threads
+                )
+                pre_tiles = {k: t.array for k, t in pre_tiles.iteritems()}
+                # Tiles are downsampled and encoded in parallel.
+                layer_tile_iterator = imap_threaded(
+                    create_lower_layer_tile, zip(coordinates, pre_coordinates),
+                    n_threads
+                )
+                for layer_tile in layer_tile_iterator:
+                    layer_tiles.append(layer_tile)
+                    if len(layer_tiles) >= self._TILES_PER_INGEST:
+                        self._ingest_tiles(storage, layer_tiles)
+
+            self._ingest_tiles(storage, layer_tiles)
+
+    def _create_block_tiles(self, batch, assume_clean_state):
+        exp_id = self.experiment_id
+        with tm.utils.ExperimentSession(exp_id, transaction=False) as session:
+            layer = session.query(tm.ChannelLayer).get(batch['layer_id'])
+            storage = layer.get_tile_storage(session)
+            logger.info(
+                'process layer: channel=%s, zplane=%d, tpoint=%d',
+                layer.channel.name, layer.zplane, layer.tpoint
+            )
+            layer_id = layer.id
+            codec = layer.tile_codec
+            zoom_factor = layer.zoom_factor
+            n_threads = batch.get('cores', 1)
+            level = layer.maxzoom_level_index
+            block_size = zoom_factor**batch['block_depth']
+            row_start, col_start = batch['block']
+            logger.info(
+                'create tiles for block of %d x %d tiles at row %d, column %d',
+                block_size, block_size, row_start, col_start
+            )
+
+            def get_block_coordinates(level, row_start, col_start, size):
+                n_rows, n_cols = layer.dimensions[level]
+                return list(itertools.product(
+                    range(row_start, min(row_start + size, n_rows)),
+                    range(col_start, min(col_start + size, n_cols))
+                ))
+
+            logger.info('create tiles at zoom level %d', level)
+            # Pixels of the tiles at the current level are kept in memory
+            # to create the tiles at the next lower level from them.
+            tiles = dict()
+            layer_tiles = list()
+            iterator = self._iter_maxzoom_level_tiles(
+                session, layer, batch,
+                set(get_block_coordinates(
+                    level, row_start, col_start, block_size
+                ))
+            )
+            create_layer_tile = self._create_layer_tile_factory(
+                layer_id, level, codec
+            )
+
+            def create_lower_layer_tile(item):
+                (row, column), pre_coordinates = item
                 logger.debug(
                     'creating tile: z=%d, y=%d, x=%d', level, row, column
                 )
-                # Build the mosaic by loading required higher level tiles
-                # (created in a previous run) and stitching them together
-                pre_rows = np.unique([c[0] for c in pre_coordinates])
-                pre_cols = np.unique([c[1] for c in pre_coordinates])
-                for i, r in enumerate(pre_rows):
-                    for j, c in enumerate(pre_cols):
-                        pre_tile = session.query(tm.ChannelLayerTile).\
-                            filter_by(
-                                channel_layer_id=layer_id, z=level+1, y=r, x=c
-                            ).\
-                            one_or_none()
-                        if pre_tile is not None:
-                            pre_tile = pre_tile.pixels
-                        else:
-                            # Tiles at maxzoom level might not exist in
-                            # case they did not fall into a region of
-                            # the map occupied by an image.
-                            # They must exist at the lower zoom levels,
-                            # though, for subsampling.
-                            if batch['index'] > 1:
-                                raise ValueError(
-                                    'Tile "%d-%d-%d" was not created.'
-                                    % (level+1, r, c)
-                                )
-                            logger.debug(
-                                'tile "%d-%d-%d" missing',
-                                 batch['level']+1, r, c
-                            )
-                            pre_tile = PyramidTile.create_as_background()
-                        # We have to temporally treat it as an "image",
-                        # since a tile can per definition not be larger
-                        # than 256x256 pixels.
-                        # FIXME: This can be done more efficiently using
-                        # a predefined array instead of these loops.
-                        img = Image(pre_tile.array)
-                        if j == 0:
-                            row_img = img
-                        else:
-                            row_img = row_img.join(img, 'x')
-                    if i == 0:
-                        mosaic_img = row_img
-                    else:
-                        mosaic_img = mosaic_img.join(row_img, 'y')
-                # Create the tile at the current level by downsampling
-                # the mosaic image, which is composed of the 4 tiles
-                # of the next higher zoom level
-                tile = PyramidTile(mosaic_img.shrink(zoom_factor).array)
-                channel_layer_tile = tm.ChannelLayerTile(
-                    channel_layer_id=layer_id,
-                    z=level, y=row, x=column, pixels=tile
+                tile = self._create_tile_from_next_higher_level(
+                    level, pre_coordinates, pre_tiles, get_mosaic(),
+                    allow_missing
                 )
-                session.add(channel_layer_tile)
+                layer_tile = create_layer_tile((row, column, tile))
+                return (row, column, tile, layer_tile)
+
+            # Tiles are encoded in parallel.
+            for row, column, tile in iterator:
+                # The tile may be a view of a much larger image.
+                tiles[(row, column)] = tile.array.copy()
+            layer_tile_iterator = imap_threaded(
+                create_layer_tile,
+                [(r, c, PyramidTile(a)) for (r, c), a in tiles.iteritems()],
+                n_threads
+            )
+            for layer_tile in layer_tile_iterator:
+                layer_tiles.append(layer_tile)
+                if len(layer_tiles) >= self._TILES_PER_INGEST:
+                    self._ingest_tiles(storage, layer_tiles)
+
+            get_mosaic = self._create_mosaic_getter(layer, batch)
+            allow_missing = True
+            while level > batch['level']:
+                level -= 1
+                row_start //= zoom_factor
+                col_start //= zoom_factor
+                block_size //= zoom_factor
+                logger.info('create tiles at zoom level %d', level)
+                create_layer_tile = self._create_layer_tile_factory(
+                    layer_id, level, codec
+                )
+                pre_tiles = tiles
+                tiles = dict()
+                coordinates = get_block_coordinates(
+                    level, row_start, col_start, block_size
+                )
+                pre_coordinates = [
+                    layer.calc_coordinates_of_next_higher_level(level, r, c)
+                    for r, c in coordinates
+                ]
+                # Tiles are downsampled and encoded in parallel.
+                layer_tile_iterator = imap_threaded(
+                    create_lower_layer_tile,
+                    zip(coordinates, pre_coordinates), n_threads
+                )
+                for row, column, tile, layer_tile in layer_tile_iterator:
+                    tiles[(row, column)] = tile.array
+                    layer_tiles.append(layer_tile)
+                    if len(layer_tiles) >= self._TILES_PER_INGEST:
+                        self._ingest_tiles(storage, layer_tiles)
+                allow_missing = False
+
+            self._ingest_tiles(storage, layer_tiles)
 
     def run_job(self, batch, assume_clean_state=False):
-        '''Creates 8-bit grayscale JPEG layer tiles.
+        '''Creates grayscale layer tiles, either rescaled to 8-bit or with
+        the original 16-bit intensities depending on the batch.
 
         Parameters
         ----------
@@ -583,10 +1207,58 @@ class PyramidBuilder(WorkflowStepAPI):
             assume that output of previous runs has already been cleaned up
         '''
         if batch['index'] == 0:
-            self._create_maxzoom_level_tiles(batch, assume_clean_state)
+            if 'block' in batch:
+                self._create_block_tiles(batch, assume_clean_state)
+            else:
+                self._create_maxzoom_level_tiles(batch, assume_clean_state)
         else:
             self._create_lower_zoom_level_tiles(batch, assume_clean_state)
 
+    @staticmethod
+    def _create_static_mapobject_geometries(offsets, image_sizes):
+        '''Creates the geometries of rectangular objects, such as plates,
+        wells or sites, for all objects at once.
+
+        Parameters
+        ----------
+        offsets: List[Tuple[int]]
+            *y*, *x* coordinate of the top, left corner of each object
+        image_sizes: List[Tuple[int]]
+            height and width of each object
+
+        Returns
+        -------
+        Tuple[List[str]]
+            *WKT* representations of the polygon and the centroid of each
+            object
+        '''
+        if len(offsets) == 0:
+            return ([], [])
+        offsets = np.array(offsets, dtype=np.int64)
+        image_sizes = np.array(image_sizes, dtype=np.int64)
+        # The x axis is the first and the inverted (!) y axis the second
+        # coordinate. We further subtract one pixel such that the polygon
+        # defines the exact boundary of the objects. This is crucial for
+        # testing whether other objects intersect with the border.
+        left = offsets[:, 1] + 1
+        top = -1 * (offsets[:, 0] + 1)
+        right = left + image_sizes[:, 1] - 3
+        bottom = top - (image_sizes[:, 0] - 3)
+        # Closed circle with coordinates sorted counter-clockwise:
+        # upper right, upper left, lower left, lower right, upper right
+        contours = np.column_stack([
+            right, top, left, top, left, bottom, right, bottom, right, top
+        ])
+        polygons = [
+            'POLYGON((%d %d, %d %d, %d %d, %d %d, %d %d))' % tuple(c)
+            for c in contours.tolist()
+        ]
+        centroids = np.column_stack([
+            (left + right) / 2.0, (top + bottom) / 2.0
+        ])
+        centroids = ['POINT(%.1f %.1f)' % tuple(c) for c in centroids.tolist()]
+        return (polygons, centroids)
+
     def collect_job_output(self, batch):
         '''Creates :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
         instances for :class:`Site <tmlib.models.site.Site>`,
@@ -620,54 +1292,56 @@ class PyramidBuilder(WorkflowStepAPI):
                 segmentation_layer = session.get_or_create(
                     tm.SegmentationLayer, mapobject_type_id=mapobject_type_id
                 )
+                segmentation_layer_id = segmentation_layer.id
 
                 logger.info('create individual mapobjects of type "%s"', name)
-                segmentations = dict()
-                for obj in session.query(cls):
-                    logger.debug(
-                        'create mapobject for reference object #%d', obj.id
-                    )
-                    if name == 'Sites':
-                        # We need to account for the "multiplexing" edge case.
-                        offset = obj.aligned_offset
-                        image_size = obj.aligned_image_size
-                    else:
-                        offset = obj.offset
-                        image_size = obj.image_size
-                    # First element: x axis
-                    # Second element: inverted (!) y axis
-                    # We further subtract one pixel such that the polygon
-                    # defines the exact boundary of the objects. This is
-                    # crucial for testing whether other objects intersect with
-                    # the border.
-                    ul = (offset[1] + 1, -1 * (offset[0] + 1))
-                    ll = (ul[0], ul[1] - (image_size[0] - 3))
-                    ur = (ul[0] + image_size[1] - 3, ul[1])
-                    lr = (ll[0] + image_size[1] - 3, ll[1])
-                    # Closed circle with coordinates sorted counter-clockwise
-                    contour = np.array([ur, ul, ll, lr, ur])
-                    polygon = shapely.geometry.Polygon(contour)
-                    segmentations[obj.id] = {
-                        'segmentation_layer_id': segmentation_layer.id,
-                        'polygon': polygon
-                    }
+                query = session.query(cls)
+                if name == 'Sites':
+                    query = query.options(sqlalchemy.orm.joinedload(cls.well))
+                objs = query.all()
+                if name == 'Sites':
+                    # We need to account for the "multiplexing" edge case.
+                    offsets = [obj.aligned_offset for obj in objs]
+                    image_sizes = [obj.aligned_image_size for obj in objs]
+                else:
+                    offsets = [obj.offset for obj in objs]
+                    image_sizes = [obj.image_size for obj in objs]
+                polygons, centroids = self._create_static_mapobject_geometries(
+                    offsets, image_sizes
+                )
 
                 logger.debug('delete existing mapobjects of type "%s"', name)
                 session.query(tm.Mapobject).\
                     filter_by(mapobject_type_id=mapobject_type_id).\
                     delete()
-                logger.debug('add new mapobjects of type "%s"', name)
-                for key, value in segmentations.iteritems():
-                    mapobject = tm.Mapobject(
-                        partition_key=key, mapobject_type_id=mapobject_type_id
+                logger.debug(
+                    'add %d new mapobjects of type "%s"', len(objs), name
+                )
+                # IDs of all mapobjects are obtained at once upon ingestion.
+                mapobjects = [
+                    tm.Mapobject(
+                        partition_key=obj.id,
+                        mapobject_type_id=mapobject_type_id
                     )
-                    session.add(mapobject)
-                    session.flush()
-                    logger.debug('add mapobject #%d', mapobject.id)
-                    mapobject_segmentation = tm.MapobjectSegmentation(
-                        partition_key=key, mapobject_id=mapobject.id,
-                        geom_polygon=value['polygon'],
-                        geom_centroid=value['polygon'].centroid,
-                        segmentation_layer_id=value['segmentation_layer_id'],
+                    for obj in objs
+                ]
+                session.bulk_ingest(mapobjects)
+                mapobject_segmentations = [
+                    tm.MapobjectSegmentation(
+                        partition_key=mapobject.partition_key,
+                        mapobject_id=mapobject.id,
+                        geom_polygon=polygons[i],
+                        geom_centroid=centroids[i],
+                        segmentation_layer_id=segmentation_layer_id
                     )
-                    session.add(mapobject_segmentation)
+                    for i, mapobject in enumerate(mapobjects)
+                ]
+                session.bulk_ingest(mapobject_segmentations)
+
+        # All run jobs completed, such that the layers are in the state
+        # described by the manifests that were created upon initialization.
+        for filename in os.listdir(self.manifests_location):
+            if filename.endswith('.pending'):
+                logger.debug('update manifest: %s', filename[:-8])
+                filename = os.path.join(self.manifests_location, filename)
+                os.rename(filename, filename[:-8])
@@ -28,6 +28,43 @@ class IlluminatiBatchArguments(BatchArguments):
         help='number of image files that should be processed per job'
     )
 
+    block_depth = Argument(
+        type=int, flag='block-depth',
+        help='''number of zoom levels that should be created in memory per job
+            for square blocks of tiles at the highest resolution level, where
+            blocks comprise 2^k x 2^k tiles for a zoom factor of 2
+            (by default, each zoom level is created by a separate phase)
+        '''
+    )
+
+    incremental = Argument(
+        type=bool, default=False,
+        help='''whether only those tiles should be rebuilt that intersect
+            with channel image files, which changed or got aligned differently
+            since the layers were last built, together with their ancestors at
+            lower zoom levels (layers are rebuilt entirely when settings or
+            illumination statistics changed)
+        '''
+    )
+
+    bit_depth = Argument(
+        type=int, default=8, choices={8, 16}, flag='bit-depth',
+        help='''bit depth of the tiles; 8-bit tiles are clipped and rescaled
+            upon creation, 16-bit tiles are stored losslessly and clipped and
+            rescaled upon rendering, which allows changing the displayed
+            intensity range without rebuilding the pyramid
+        '''
+    )
+
+    codec = Argument(
+        type=str, default='jpeg',
+        help='''codec by which pixels of tiles should be encoded in the form
+            "<name>" or "<name>:<parameter>", where name is one of "jpeg",
+            "webp", "png" or "zstd" and parameter the quality ("jpeg",
+            "webp") or compression level ("png", "zstd"), e.g. "jpeg:80"
+        '''
+    )
+
     align = Argument(
         type=bool, default=False, short_flag='a',
         help='whether images should be aligned between multiplexing cycles'
@@ -0,0 +1,139 @@
+import os
+
+import pytest
+
+from tmlib.writers import JsonWriter
+from tmlib.workflow.illuminati.api import PyramidBuilder
+
+
+class _Layer(object):
+
+    '''Layer with 2 x 4 tiles at the maximal zoom level, which are covered
+    by two images side by side that both intersect the tiles of the third
+    column. These tiles are created from the right image.
+    '''
+
+    id = 1
+    min_intensity = 10
+    max_intensity = 200
+    codec = 'jpeg:95'
+    zoom_factor = 2
+    maxzoom_level_index = 2
+    dimensions = [(1, 1), (1, 2), (2, 4)]
+    base_tile_coordinate_to_image_file_map = {
+        (0, 0): [1], (0, 1): [1], (0, 2): [1, 2], (0, 3): [2],
+        (1, 0): [1], (1, 1): [1], (1, 2): [1, 2], (1, 3): [2]
+    }
+
+
+def _create_manifest(files, min_intensity=0):
+    return {
+        'settings': {
+            'min_intensity': min_intensity, 'max_intensity': 255,
+            'align': False, 'illumcorr': False, 'bit_depth': 8,
+            'codec': 'jpeg:95',
+            'dimensions': [list(d) for d in _Layer.dimensions]
+        },
+        'files': files
+    }
+
+
+@pytest.fixture
+def builder(tmpdir, monkeypatch):
+    monkeypatch.setattr(PyramidBuilder, 'manifests_location', str(tmpdir))
+    builder = PyramidBuilder.__new__(PyramidBuilder)
+    previous = _create_manifest({'1': [100.0], '2': [200.0]})
+    with JsonWriter(builder._get_manifest_filename(_Layer.id)) as f:
+        f.write(previous)
+    return builder
+
+
+class _Arguments(object):
+
+    align = False
+    illumcorr = False
+
+    def __init__(self, bit_depth):
+        self.bit_depth = bit_depth
+
+
+class _File(object):
+
+    def __init__(self, id, location):
+        self.id = id
+        self.location = location
+
+
+def test_create_manifest(builder, tmpdir):
+    tmpdir.join('image_1.png').write('')
+    files = [
+        _File(1, str(tmpdir.join('image_1.png'))),
+        _File(2, str(tmpdir.join('image_2.png')))
+    ]
+    manifest = builder._create_manifest(None, _Layer(), files, _Arguments(8))
+    assert manifest['settings']['min_intensity'] == 10
+    assert manifest['settings']['max_intensity'] == 200
+    assert manifest['settings']['bit_depth'] == 8
+    assert manifest['files']['1'] == [os.path.getmtime(files[0].location)]
+    assert manifest['files']['2'] == [None]
+
+
+def test_create_manifest_without_clip_values_for_16_bit(builder):
+    manifest = builder._create_manifest(None, _Layer(), [], _Arguments(16))
+    # The clip values don't affect 16-bit tiles, which get rendered on request.
+    assert 'min_intensity' not in manifest['settings']
+    assert 'max_intensity' not in manifest['settings']
+    assert manifest['settings']['bit_depth'] == 16
+
+
+def test_get_dirty_base_tiles_without_previous_manifest(builder):
+    layer = _Layer()
+    layer.id = 2
+    manifest = _create_manifest({'1': [100.0], '2': [200.0]})
+    assert builder._get_dirty_base_tiles(layer, manifest) is None
+
+
+def test_get_dirty_base_tiles_unchanged(builder):
+    manifest = _create_manifest({'1': [100.0], '2': [200.0]})
+    assert builder._get_dirty_base_tiles(_Layer(), manifest) == set()
+
+
+def test_get_dirty_base_tiles_changed_settings(builder):
+    manifest = _create_manifest({'1': [100.0], '2': [200.0]}, 10)
+    assert builder._get_dirty_base_tiles(_Layer(), manifest) is None
+
+
+def test_get_dirty_base_tiles_removed_file(builder):
+    manifest = _create_manifest({'1': [100.0]})
+    assert builder._get_dirty_base_tiles(_Layer(), manifest) is None
+
+
+def test_get_dirty_base_tiles_changed_file(builder):
+    manifest = _create_manifest({'1': [100.0], '2': [300.0], '3': [10.0]})
+    dirty_tiles = builder._get_dirty_base_tiles(_Layer(), manifest)
+    assert dirty_tiles == {(0, 2), (0, 3), (1, 2), (1, 3)}
+
+
+def test_create_dirty_tile_batches(builder):
+    layer = _Layer()
+    dirty_tiles = builder._get_dirty_base_tiles(
+        layer, _create_manifest({'1': [300.0], '2': [200.0]})
+    )
+    batches, tile_batches = builder._create_dirty_tile_batches(
+        layer, [2, 1], dirty_tiles, 1
+    )
+    assert batches == [[2], [1]]
+    # Tiles of the third column are created from the unchanged right image,
+    # which therefore needs to be processed as well. The job of the left
+    # image skips them, because it doesn't create them.
+    assert tile_batches[0] == [(0, 2), (1, 2)]
+    assert tile_batches[1] == sorted(dirty_tiles)
+
+
+def test_get_dirty_ancestor_tiles(builder):
+    layer = _Layer()
+    dirty_tiles = {(0, 1), (1, 2), (1, 3)}
+    ancestors = [[(0, 0)], [(0, 0), (0, 1)], [(0, 1), (1, 2), (1, 3)]]
+    for level, expected in enumerate(ancestors):
+        tiles = builder._get_dirty_ancestor_tiles(layer, dirty_tiles, level)
+        assert tiles == expected
@@ -16,12 +16,16 @@
 import os
 import re
 import sys
+import time
+import Queue
 import shutil
 import logging
+import threading
 import subprocess
 import numpy as np
 import pandas as pd
 import collections
+from multiprocessing import Pool
 import shapely.geometry
 import shapely.ops
 from cached_property import cached_property
@@ -35,6 +39,7 @@ from gc3libs.quantity import Duration, Memory
 import tmlib.models as tm
 from tmlib.utils import autocreate_directory_property
 from tmlib.utils import flatten
+from tmlib.image import ChannelImageProcessor
 from tmlib.readers import TextReader
 from tmlib.readers import ImageReader
 from tmlib.writers import TextWriter
@@ -52,12 +57,61 @@ from tmlib import cfg
 
 logger = logging.getLogger(__name__)
 
+#: tmlib.workflow.jterator.api.ImageAnalysisPipelineEngine: engine of a
+#: worker process, which is created only once per process such that each
+#: module is loaded only once per process
+_worker_engine = None
+
+
+def _init_worker(experiment_id):
+    global _worker_engine
+    # Database connections must not be shared with the parent process.
+    tm.utils.DATABASE_ENGINES.clear()
+    _worker_engine = ImageAnalysisPipelineEngine(experiment_id)
+    _worker_engine.start_engines()
+
+
+def _process_site(args):
+    site_id, plot = args
+    logger.info('process site %d', site_id)
+    store = _worker_engine._load_pipeline_input(site_id)
+    store = _worker_engine._run_pipeline(store, site_id, plot)
+    # Only the objects are required for saving the outputs. Images don't
+    # need to be transferred to the parent process.
+    return {'site_id': store['site_id'], 'objects': store['objects']}
+
+
+def _put(queue, item, stop):
+    # Puts an item into a bounded queue unless processing has been stopped.
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Queue.Full:
+            continue
+    return False
+
+
+def _get(queue, stop):
+    # Gets the next item from a queue. Returns None once processing has been
+    # stopped and the queue is empty.
+    while True:
+        try:
+            return queue.get(timeout=0.1)
+        except Queue.Empty:
+            if stop.is_set():
+                return None
+
 
 @register_step_api('jterator')
 class ImageAnalysisPipelineEngine(WorkflowStepAPI):
 
     '''Class for running image analysis pipelines.'''
 
+    #: int: maximal number of sites that are buffered between loading of
+    #: inputs, running of the pipeline and saving of outputs
+    _QUEUE_SIZE = 2
+
     def __init__(self, experiment_id, pipeline_description=None,
             handles_descriptions=None):
         '''
@@ -305,15 +359,16 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                 image_files = session.query(tm.ChannelImageFile).\
                     filter_by(site_id=site.id, channel_id=channel.id).\
                     all()
+                # Images are corrected and aligned (shifted and cropped!)
+                # directly into the pipeline input array.
+                processor = ChannelImageProcessor(stats, align=True)
                 for f in image_files:
                     logger.info('load image %d', f.id)
                     img = f.get()
-                    if ch.correct:
-                        logger.info('correct image %d', f.id)
-                        img = img.correct(stats)
-                    logger.debug('align image %d', f.id)
-                    img = img.align()  # shifted and cropped!
-                    image_array[:, :, f.zplane, f.tpoint] = img.array
+                    logger.debug('process image %d', f.id)
+                    processor.process(
+                        img, out=image_array[:, :, f.zplane, f.tpoint]
+                    )
                 store['pipe'][ch.name] = image_array
 
             for obj in objects_input:
@@ -660,18 +715,140 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
             job description
         assume_clean_state: bool, optional
             assume that output of previous runs has already been cleaned up
+
+        Note
+        ----
+        Inputs of upcoming sites are loaded and outputs of completed sites
+        are saved in background threads while the pipeline runs.
+        In case several cores are allocated to the job, sites are instead
+        processed in parallel by a pool of worker processes and outputs are
+        saved by the calling process as soon as the pipeline completed for a
+        site. Worker processes load the pipeline from the persisted
+        descriptor files.
         '''
         logger.info('handle pipeline input')
 
+        n_processes = min(batch.get('cores', 1), len(batch['site_ids']))
+        if n_processes > 1:
+            self._run_sites_in_parallel(
+                batch['site_ids'], batch['plot'], assume_clean_state,
+                n_processes
+            )
+            return
+
         self.start_engines()
+        self._run_sites_pipelined(
+            batch['site_ids'], batch['plot'], assume_clean_state
+        )
+
+    def _run_sites_pipelined(self, site_ids, plot, assume_clean_state):
+        # Sites are processed in three concurrent stages: a thread loads the
+        # inputs of upcoming sites, the calling thread runs the pipeline,
+        # and another thread saves the outputs of completed sites.
+        # Modules are executed in the calling thread, because engines of
+        # other languages may not support being called from other threads.
+        inputs = Queue.Queue(self._QUEUE_SIZE)
+        outputs = Queue.Queue(self._QUEUE_SIZE)
+        stop = threading.Event()
+        errors = list()
+        timings = {'load': 0.0, 'run': 0.0, 'save': 0.0}
+
+        def load():
+            try:
+                for site_id in site_ids:
+                    if stop.is_set():
+                        return
+                    start = time.time()
+                    store = self._load_pipeline_input(site_id)
+                    duration = time.time() - start
+                    logger.debug(
+                        'loaded inputs of site %d in %.2f s', site_id, duration
+                    )
+                    timings['load'] += duration
+                    if not _put(inputs, store, stop):
+                        return
+            except Exception as error:
+                # Sites that have already been loaded still get processed.
+                logger.error('loading of pipeline inputs failed')
+                errors.append(error)
+            finally:
+                _put(inputs, None, stop)
+
+        def save():
+            while True:
+                store = _get(outputs, stop)
+                if store is None:
+                    return
+                start = time.time()
+                try:
+                    self._save_pipeline_outputs(store, assume_clean_state)
+                except Exception as error:
+                    logger.error('saving of pipeline outputs failed')
+                    errors.append(error)
+                    stop.set()
+                    return
+                duration = time.time() - start
+                logger.debug(
+                    'saved outputs of site %d in %.2f s',
+                    store['site_id'], duration
+                )
+                timings['save'] += duration
+
+        loader = threading.Thread(target=load, name='loader')
+        writer = threading.Thread(target=save, name='writer')
+        loader.daemon = writer.daemon = True
+        start_time = time.time()
+        loader.start()
+        writer.start()
+        try:
+            while True:
+                store = _get(inputs, stop)
+                if store is None:
+                    break
+                site_id = store['site_id']
+                logger.info('process site %d', site_id)
+                start = time.time()
+                store = self._run_pipeline(store, site_id, plot)
+                duration = time.time() - start
+                logger.debug(
+                    'ran pipeline for site %d in %.2f s', site_id, duration
+                )
+                timings['run'] += duration
+                if not _put(outputs, store, stop):
+                    break
+            _put(outputs, None, stop)
+            writer.join()
+        finally:
+            stop.set()
+            loader.join()
+            writer.join()
+        if errors:
+            raise errors[0]
+        # Stages overlap in case the total time is less than their sum.
+        logger.info(
+            'time spent loading inputs: %.1f s, running pipeline: %.1f s, '
+            'saving outputs: %.1f s, total: %.1f s',
+            timings['load'], timings['run'], timings['save'],
+            time.time() - start_time
+        )
 
-        # Enable debugging of pipelines by providing the full path to images.
-        # This requires a work around for "plot" and "job_id" arguments.
-        for site_id in batch['site_ids']:
-            logger.info('process site %d', site_id)
-            store = self._load_pipeline_input(site_id)
-            store = self._run_pipeline(store, site_id, batch['plot'])
-            self._save_pipeline_outputs(store, assume_clean_state)
+    def _run_sites_in_parallel(self, site_ids, plot, assume_clean_state,
+            n_processes):
+        logger.info('process sites in %d parallel processes', n_processes)
+        # Pooled connections are closed, such that worker processes don't
+        # inherit connections of this process.
+        for engine in tm.utils.DATABASE_ENGINES.values():
+            engine.dispose()
+        pool = Pool(n_processes, _init_worker, (self.experiment_id, ))
+        try:
+            args = [(site_id, plot) for site_id in site_ids]
+            for store in pool.imap_unordered(_process_site, args):
+                logger.info('save outputs of site %d', store['site_id'])
+                self._save_pipeline_outputs(store, assume_clean_state)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
 
     def collect_job_output(self, batch):
         '''Computes the optimal representation of each
@@ -28,11 +28,12 @@ import sys
 import json
 import numpy as np
 import pandas as pd
-import mahotas as mh
 import cv2
 import skimage
 import logging
+import itertools
 import collections
+import scipy.ndimage as ndi
 import skimage.draw
 import shapely.geometry
 from geoalchemy2.shape import to_shape
@@ -396,6 +397,73 @@ class BinaryImage(MaskImage):
         return '<BinaryImage(name=%r, key=%r)>' % (self.name, self.key)
 
 
+class LabelIndex(object):
+
+    '''Class for an index of the objects in a 2D label image, which provides
+    per-object statistics as arrays.
+
+    All statistics are calculated in a single pass over the pixels upon
+    instantiation and are ordered by object label.
+
+    Attributes
+    ----------
+    labels: numpy.ndarray[numpy.int64]
+        unique object labels in ascending order (background is excluded)
+    areas: numpy.ndarray[numpy.int64]
+        number of pixels of each object
+    centroids: numpy.ndarray[numpy.float64]
+        *y*, *x* coordinates of the centroid of each object
+    bboxes: numpy.ndarray[numpy.int64]
+        *y*, *x* coordinates of the upper left corner and *y*, *x*
+        coordinates of the lower right corner (exclusive) of the bounding box
+        of each object
+    is_border: numpy.ndarray[numpy.bool]
+        whether each object touches the border of the image
+    '''
+
+    def __init__(self, array):
+        '''
+        Parameters
+        ----------
+        array: numpy.ndarray[numpy.int32]
+            2D label image
+        '''
+        if array.ndim != 2:
+            raise ValueError('Argument "array" must be two-dimensional.')
+        height, width = array.shape
+        pixels = array.ravel()
+        counts = np.bincount(pixels, minlength=1)
+        self.labels = np.flatnonzero(counts[1:]) + 1
+        self.areas = counts[self.labels]
+        n = counts.shape[0]
+        y_sums = np.bincount(
+            pixels, weights=np.repeat(np.arange(height, dtype=float), width),
+            minlength=n
+        )
+        x_sums = np.bincount(
+            pixels, weights=np.tile(np.arange(width, dtype=float), height),
+            minlength=n
+        )
+        self.centroids = np.column_stack([
+            y_sums[self.labels] / self.areas, x_sums[self.labels] / self.areas
+        ])
+        slices = ndi.find_objects(array)
+        self.bboxes = np.array(
+            [
+                (s[0].start, s[1].start, s[0].stop, s[1].stop)
+                for s in (slices[label - 1] for label in self.labels)
+            ],
+            dtype=np.int64
+        ).reshape(-1, 4)
+        self.is_border = (
+            (self.bboxes[:, 0] == 0) | (self.bboxes[:, 1] == 0) |
+            (self.bboxes[:, 2] == height) | (self.bboxes[:, 3] == width)
+        )
+
+    def __len__(self):
+        return self.labels.shape[0]
+
+
 class SegmentedObjects(LabelImage):
 
     '''Class for a segmented objects handle, which represents a special type of
@@ -415,13 +483,47 @@ class SegmentedObjects(LabelImage):
         '''
         super(SegmentedObjects, self).__init__(name, key, help)
         self._features = collections.defaultdict(list)
+        self._label_index = None
         self.save = False
         self.represent_as_polygons = True
 
+    @property
+    def value(self):
+        '''numpy.ndarray[numpy.int32]: pixels/voxels array'''
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        LabelImage.value.fset(self, value)
+        self._label_index = None
+
+    @property
+    def label_index(self):
+        '''collections.OrderedDict[Tuple[int], tmlib.workflow.jterator.handles.LabelIndex]:
+        index of segmented objects for each time point and z-plane
+
+        Note
+        ----
+        The index is calculated only once and cached until a new
+        :attr:`value <tmlib.workflow.jterator.handles.SegmentedObjects.value>`
+        gets assigned. The pixels array must therefore not be modified in place.
+        '''
+        if self._label_index is None:
+            logger.debug('index objects of type "%s"', self.key)
+            self._label_index = collections.OrderedDict()
+            for (t, z), plane in self.iter_planes():
+                self._label_index[(t, z)] = LabelIndex(plane)
+        return self._label_index
+
     @property
     def labels(self):
         '''List[int]: unique object identifier labels'''
-        return np.unique(self.value[self.value > 0]).astype(int).tolist()
+        indices = self.label_index.values()
+        if len(indices) == 1:
+            labels = indices[0].labels
+        else:
+            labels = np.unique(np.concatenate([i.labels for i in indices]))
+        return labels.astype(int).tolist()
 
     def iter_points(self, y_offset, x_offset):
         '''Iterates over point representations of segmented objects.
@@ -442,16 +544,14 @@ class SegmentedObjects(LabelImage):
             time point, z-plane, label and point geometry
         '''
         logger.debug('calculate centroids for objects of type "%s"', self.key)
-        points = dict()
-        for (t, z), plane in self.iter_planes():
-            centroids = mh.center_of_mass(plane, labels=plane)
-            centroids[:, 1] += x_offset
-            centroids[:, 0] += y_offset
-            centroids[:, 0] *= -1
-            for label in self.labels:
-                y = int(centroids[label, 0])
-                x = int(centroids[label, 1])
-                point = shapely.geometry.Point(x, y)
+        for (t, z), index in self.label_index.iteritems():
+            y_coordinates = -(index.centroids[:, 0] + y_offset)
+            x_coordinates = index.centroids[:, 1] + x_offset
+            iterator = itertools.izip(
+                index.labels.tolist(), y_coordinates, x_coordinates
+            )
+            for label, y, x in iterator:
+                point = shapely.geometry.Point(int(x), int(y))
                 yield (t, z, label, point)
 
     def iter_polygons(self, y_offset, x_offset):
@@ -520,9 +620,12 @@ class SegmentedObjects(LabelImage):
         at the border of the image and ``False`` otherwise
         '''
         mapping = dict()
-        for (t, z), plane in self.iter_planes():
-            for label, is_border in self._find_border_objects(plane).iteritems():
-                mapping[(t, z, label)] = bool(is_border)
+        for (t, z), index in self.label_index.iteritems():
+            iterator = itertools.izip(
+                index.labels.tolist(), index.is_border.tolist()
+            )
+            for label, is_border in iterator:
+                mapping[(t, z, label)] = is_border
         return mapping
 
     @staticmethod
@@ -540,15 +643,8 @@ class SegmentedObjects(LabelImage):
             ``True`` if an object lies at the border of the `img` and
             ``False`` otherwise
         '''
-        edges = [np.unique(img[0, :]),   # first row
-                 np.unique(img[-1, :]),  # last row
-                 np.unique(img[:, 0]),   # first col
-                 np.unique(img[:, -1])]  # last col
-
-        # Count only unique ids and remove 0 since it signals 'empty space'
-        border_ids = list(reduce(set.union, map(set, edges)).difference({0}))
-        object_ids = np.unique(img[img != 0])
-        return {o: True if o in border_ids else False for o in object_ids}
+        index = LabelIndex(img)
+        return dict(zip(index.labels.tolist(), index.is_border.tolist()))
 
     @property
     def save(self):
@@ -615,20 +711,20 @@ class SegmentedObjects(LabelImage):
                 'Argument "measurement" must have type '
                 'tmlib.workflow.jterator.handles.Measurement.'
             )
+        labels = np.array(self.labels)
         for t, val in enumerate(measurement.value):
-            if len(val.index) < len(self.labels):
+            if len(val.index) < len(labels):
                 logger.warn(
                     'missing values for object type "%s" at time point %d',
                     self.key, t
                 )
-                for label in self.labels:
-                    if label not in val.index:
-                        logger.warn(
-                            'add NaN values for missing object #%d', label
-                        )
-                        val.loc[label, :] = np.NaN
-                val.sort_index(inplace=True)
-            elif len(val.index) > len(self.labels):
+                is_missing = ~np.in1d(labels, val.index.values)
+                for label in labels[is_missing]:
+                    logger.warn(
+                        'add NaN values for missing object #%d', label
+                    )
+                val = val.reindex(labels)
+            elif len(val.index) > len(labels):
                 if len(np.unique(val.index)) < len(val.index):
                     logger.warn(
                         'duplicate values for "%s" at time point %d',
@@ -641,11 +737,11 @@ class SegmentedObjects(LabelImage):
                         'too many values for object type "%s" at time point %d',
                         self.key, t
                     )
-                    for i in val.index:
-                        if i not in self.labels:
-                            logger.warn('remove values for object #%d', i)
-                            val.drop(i, inplace=True)
-            if np.any(val.index.values != np.array(self.labels)):
+                    is_known = np.in1d(val.index.values, labels)
+                    for i in val.index.values[~is_known]:
+                        logger.warn('remove values for object #%d', i)
+                    val = val[is_known]
+            if np.any(val.index.values != labels):
                 raise ValueError(
                     'Labels of objects for "%s" at time point %d do not match!'
                     % (measurement.name, t)
@@ -20,6 +20,7 @@ import logging
 import imp
 import collections
 import importlib
+import threading
 import traceback
 import numpy as np
 from cStringIO import StringIO
@@ -60,6 +61,75 @@ class CaptureOutput(dict):
         self.update({'stdout': output, 'stderr': error})
 
 
+class ModuleRegistry(object):
+
+    '''Class for a registry of loaded module source files.
+
+    Source files get loaded and the version and the `main` function of the
+    module get resolved only once per process rather than once per module
+    run. Entries are hashable by language, source file and its modification
+    time, such that source files that have been modified in the meantime
+    get loaded again.
+    '''
+
+    def __init__(self):
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _get_modification_time(source_file):
+        if os.path.exists(source_file):
+            return os.path.getmtime(source_file)
+        # Modules of the "jtmodules" package are loaded from the installed
+        # package.
+        return None
+
+    def get(self, language, source_file, load):
+        '''Gets a loaded module.
+
+        Parameters
+        ----------
+        language: str
+            language of the module
+        source_file: str
+            name or path to program file of the module
+        load: function
+            function without arguments that loads the module in case it
+            hasn't been loaded yet and returns its version and `main` function
+
+        Returns
+        -------
+        Tuple[str, function]
+            version and `main` function of the module
+        '''
+        key = (
+            language, source_file, self._get_modification_time(source_file)
+        )
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                for k in self._entries.keys():
+                    if k[:2] == key[:2]:
+                        del self._entries[k]
+                logger.debug('load module source file: %s', source_file)
+                entry = load()
+                self._entries[key] = entry
+        return entry
+
+    def clear(self):
+        '''Removes all loaded modules from the registry.'''
+        with self._lock:
+            self._entries.clear()
+
+
+#: tmlib.workflow.jterator.module.ModuleRegistry: registry of modules that
+#: have been loaded by the current process
+registry = ModuleRegistry()
+
+
 class ImageAnalysisModule(object):
 
     '''Class for a Jterator module, the building block of an image analysis
@@ -171,7 +241,7 @@ class ImageAnalysisModule(object):
 
         return self.handles.output
 
-    def _exec_py_module(self):
+    def _load_py_module(self):
         module_name = os.path.splitext(os.path.basename(self.source_file))[0]
         if os.path.exists(self.source_file):
             logger.debug(
@@ -193,16 +263,24 @@ class ImageAnalysisModule(object):
                         module_name, str(err)
                     )
                 )
-        if module.VERSION != self.handles.version:
-            raise PipelineRunError(
-                'Version of source and handles is not the same.'
-            )
         func = getattr(module, 'main', None)
         if func is None:
             raise PipelineRunError(
                 'Module source file "%s" must contain a "main" function.'
                 % module_name
             )
+        return (module.VERSION, func)
+
+    def _get_main_function(self, load):
+        version, func = registry.get(self.language, self.source_file, load)
+        if version != self.handles.version:
+            raise PipelineRunError(
+                'Version of source and handles is not the same.'
+            )
+        return func
+
+    def _exec_py_module(self):
+        func = self._get_main_function(self._load_py_module)
         kwargs = self.keyword_arguments
         logger.debug(
             'evaluate main() function with INPUTS: "%s"',
@@ -226,17 +304,11 @@ class ImageAnalysisModule(object):
 
         return self.handles.output
 
-    def _exec_r_module(self):
-        try:
-            import rpy2.robjects
-            from rpy2.robjects import numpy2ri
-            from rpy2.robjects import pandas2ri
-            from rpy2.robjects.packages import importr
-        except ImportError:
-            raise ImportError(
-                'R module cannot be run, because '
-                '"rpy2" package is not installed.'
-            )
+    def _load_r_module(self):
+        import rpy2.robjects
+        from rpy2.robjects import numpy2ri
+        from rpy2.robjects import pandas2ri
+        from rpy2.robjects.packages import importr
         module_name = os.path.splitext(os.path.basename(self.source_file))[0]
         if os.path.exists(self.source_file):
             logger.debug(
@@ -249,14 +321,28 @@ class ImageAnalysisModule(object):
             logger.debug('import module "%s" from "jtmodules" package')
             rpackage = importr('jtmodules')
             module = getattr(rpackage, module_name)
-        version = module.get('VERSION')[0]
-        if version != self.handles.version:
-            raise PipelineRunError(
-                'Version of source and handles is not the same.'
-            )
-        func = module.get('main')
+        # Conversion only needs to be activated once per process.
         numpy2ri.activate()   # enables use of numpy arrays
         pandas2ri.activate()  # enable use of pandas data frames
+        base = importr('base')
+        func = module.get('main')
+
+        def call(args):
+            return base.do_call(func, args)
+
+        return (module.get('VERSION')[0], call)
+
+    def _exec_r_module(self):
+        try:
+            import rpy2.robjects
+            from rpy2.robjects import numpy2ri
+            from rpy2.robjects import pandas2ri
+        except ImportError:
+            raise ImportError(
+                'R module cannot be run, because '
+                '"rpy2" package is not installed.'
+            )
+        func = self._get_main_function(self._load_r_module)
         kwargs = self.keyword_arguments
         logger.debug(
             'evaluate main() function with INPUTS: "%s"',
@@ -278,8 +364,7 @@ class ImageAnalysisModule(object):
                 # pandas2ri.py2ri(v)
                 kwargs[k] = v
         args = rpy2.robjects.ListVector({k: v for k, v in kwargs.iteritems()})
-        base = importr('base')
-        r_out = base.do_call(func, args)
+        r_out = func(args)
 
         for handle in self.handles.output:
             # NOTE: R functions are supposed to return a list. Therefore
@@ -445,10 +530,17 @@ class ImageAnalysisModule(object):
                 store['current_figure'] = handle.value
             elif isinstance(handle, hdls.SegmentedObjects):
                 logger.debug('add value of SegmentedObjects handle to store')
-                # Measurements need to be reset.
-                handle.measurements = []
-                store['objects'][handle.key] = handle
-                store['pipe'][handle.key] = handle.value
+                # The output handles are reused for every site. Each store
+                # needs its own instance, since stores may still be
+                # saved while the pipeline already runs for the next site.
+                objects = hdls.SegmentedObjects(
+                    handle.name, handle.key, handle.help
+                )
+                objects.value = handle.value
+                objects.save = handle.save
+                objects.represent_as_polygons = handle.represent_as_polygons
+                store['objects'][handle.key] = objects
+                store['pipe'][handle.key] = objects.value
             elif isinstance(handle, hdls.Measurement):
                 logger.debug('add value of Measurement handle to store')
                 ref_objects_name = self._get_reference_objects_name(handle)
@@ -0,0 +1,205 @@
+import os
+import time
+import Queue
+import threading
+import collections
+
+import numpy as np
+import pytest
+
+from tmlib.workflow.jterator import api
+from tmlib.workflow.jterator.api import ImageAnalysisPipelineEngine
+from tmlib.workflow.jterator.api import _put
+from tmlib.workflow.jterator.api import _get
+from tmlib.workflow.jterator.module import ImageAnalysisModule
+from tmlib.workflow.jterator.handles import SegmentedObjects
+
+Handles = collections.namedtuple('Handles', ['input', 'output'])
+
+
+class _StubEngine(ImageAnalysisPipelineEngine):
+
+    '''Engine, whose stages are replaced by stubs, which fail for the site
+    given by `fail` and record the processed sites.
+    '''
+
+    def __init__(self, fail=None, save_delay=0):
+        self.experiment_id = 1
+        self.fail = fail
+        self.save_delay = save_delay
+        self.ran = list()
+        self.saved = list()
+        self.saving_threads = set()
+        self.saving_processes = set()
+        handle = SegmentedObjects('labels', 'cells')
+        self.module = ImageAnalysisModule(
+            'segment', 'segment.py', Handles(input=[], output=[handle])
+        )
+
+    def _check(self, stage, site_id):
+        if self.fail == (stage, site_id):
+            raise ValueError('%s failed for site %d' % (stage, site_id))
+
+    def _load_pipeline_input(self, site_id):
+        self._check('load', site_id)
+        return {'site_id': site_id, 'pipe': dict(), 'objects': dict()}
+
+    def _run_pipeline(self, store, site_id, plot):
+        self._check('run', site_id)
+        # Like a module, which returns different objects for each site.
+        self.module.handles.output[0].value = np.full(
+            (4, 4), site_id, dtype=np.int32
+        )
+        self.ran.append(site_id)
+        return self.module.update_store(store)
+
+    def _save_pipeline_outputs(self, store, assume_clean_state):
+        time.sleep(self.save_delay)
+        self._check('save', store['site_id'])
+        self.saving_threads.add(threading.current_thread().name)
+        self.saving_processes.add(os.getpid())
+        labels = store['objects']['cells'].value
+        self.saved.append((store['site_id'], int(labels.max())))
+
+
+class _WorkerEngine(object):
+
+    '''Engine of worker processes, whose stages are replaced by stubs.'''
+
+    parent_pid = None
+    failing_site = None
+    slow_site = None
+
+    def __init__(self, experiment_id):
+        self.experiment_id = experiment_id
+        self.started = False
+
+    def start_engines(self):
+        self.started = True
+
+    def _load_pipeline_input(self, site_id):
+        return {'site_id': site_id, 'pipe': dict(), 'objects': dict()}
+
+    def _run_pipeline(self, store, site_id, plot):
+        if not self.started or os.getpid() == self.parent_pid:
+            raise AssertionError('site not processed by a worker process')
+        if site_id == self.failing_site:
+            raise ValueError('run failed for site %d' % site_id)
+        if site_id == self.slow_site:
+            time.sleep(0.5)
+        objects = SegmentedObjects('labels', 'cells')
+        objects.value = np.full((4, 4), site_id, dtype=np.int32)
+        store['objects']['cells'] = objects
+        return store
+
+
+@pytest.fixture
+def worker_engine(monkeypatch):
+    # Worker processes are forked and create the patched engine class.
+    monkeypatch.setattr(api, 'ImageAnalysisPipelineEngine', _WorkerEngine)
+    monkeypatch.setattr(_WorkerEngine, 'parent_pid', os.getpid())
+    return _WorkerEngine
+
+
+def test_put_returns_false_when_stopped():
+    queue = Queue.Queue(1)
+    stop = threading.Event()
+    assert _put(queue, 1, stop)
+    stop.set()
+    assert not _put(queue, 2, stop)
+    assert queue.qsize() == 1
+
+
+def test_get_drains_queue_when_stopped():
+    queue = Queue.Queue(2)
+    stop = threading.Event()
+    queue.put(1)
+    stop.set()
+    assert _get(queue, stop) == 1
+    assert _get(queue, stop) is None
+
+
+def test_run_sites_pipelined():
+    engine = _StubEngine()
+    engine._run_sites_pipelined([1, 2, 3, 4], False, True)
+    assert engine.ran == [1, 2, 3, 4]
+    assert engine.saved == [(1, 1), (2, 2), (3, 3), (4, 4)]
+    assert engine.saving_threads == {'writer'}
+
+
+def test_run_sites_pipelined_saves_objects_of_each_site():
+    # Stores are still being saved while the pipeline runs for the next
+    # sites and must not share the objects of the module output handles.
+    engine = _StubEngine(save_delay=0.1)
+    engine._run_sites_pipelined([1, 2], False, True)
+    assert engine.saved == [(1, 1), (2, 2)]
+
+
+def test_run_sites_pipelined_load_failure():
+    engine = _StubEngine(fail=('load', 3))
+    with pytest.raises(ValueError):
+        engine._run_sites_pipelined([1, 2, 3, 4], False, True)
+    # Sites that have been loaded before the failure are still saved.
+    assert engine.ran == [1, 2]
+    assert engine.saved == [(1, 1), (2, 2)]
+
+
+def test_run_sites_pipelined_run_failure():
+    engine = _StubEngine(fail=('run', 2))
+    with pytest.raises(ValueError):
+        engine._run_sites_pipelined([1, 2, 3, 4], False, True)
+    assert engine.ran == [1]
+    assert engine.saved == [(1, 1)]
+
+
+def test_run_sites_pipelined_save_failure():
+    engine = _StubEngine(fail=('save', 2))
+    with pytest.raises(ValueError):
+        engine._run_sites_pipelined([1, 2, 3, 4], False, True)
+    assert engine.saved == [(1, 1)]
+    assert engine.ran[:2] == [1, 2]
+
+
+def test_run_job_selects_processing_of_sites():
+    calls = list()
+    engine = _StubEngine()
+    engine.start_engines = lambda: calls.append('start_engines')
+    engine._run_sites_pipelined = lambda *args: calls.append('pipelined')
+    engine._run_sites_in_parallel = lambda *args: calls.append(args[-1])
+    batch = {'site_ids': [1, 2, 3], 'plot': False}
+    engine.run_job(batch, True)
+    engine.run_job(dict(batch, cores=1), True)
+    assert calls == ['start_engines', 'pipelined'] * 2
+    del calls[:]
+    engine.run_job(dict(batch, cores=2), True)
+    # No more processes than sites are started.
+    engine.run_job(dict(batch, cores=8), True)
+    assert calls == [2, 3]
+
+
+def test_run_sites_in_parallel(worker_engine, monkeypatch):
+    monkeypatch.setattr(worker_engine, 'slow_site', 1)
+    engine = _StubEngine()
+    save_times = dict()
+    save = engine._save_pipeline_outputs
+
+    def timed_save(store, assume_clean_state):
+        save(store, assume_clean_state)
+        save_times[store['site_id']] = time.time()
+
+    engine._save_pipeline_outputs = timed_save
+    engine._run_sites_in_parallel([1, 2, 3, 4], False, True, 2)
+    assert sorted(engine.saved) == [(1, 1), (2, 2), (3, 3), (4, 4)]
+    # Outputs are saved by the calling thread as soon as they arrive.
+    assert engine.saving_processes == {os.getpid()}
+    assert engine.saving_threads == {threading.current_thread().name}
+    assert engine.saved[-1] == (1, 1)
+    assert save_times[1] - max(save_times[s] for s in (2, 3, 4)) > 0.2
+
+
+def test_run_sites_in_parallel_worker_failure(worker_engine, monkeypatch):
+    monkeypatch.setattr(worker_engine, 'failing_site', 3)
+    engine = _StubEngine()
+    with pytest.raises(ValueError):
+        engine._run_sites_in_parallel([1, 2, 3, 4], False, True, 2)
+    assert (3, 3) not in engine.saved
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from tmlib.workflow.jterator.handles import LabelIndex
+from tmlib.workflow.jterator.handles import SegmentedObjects
+from tmlib.workflow.jterator.handles import Measurement
+
+
+def _create_objects():
+    array = np.zeros((20, 30), dtype=np.int32)
+    array[0:5, 3:8] = 1
+    array[8:12, 10:20] = 3
+    array[12:20, 25:30] = 4
+    array[15, 2] = 6
+    return array
+
+
+def test_label_index():
+    index = LabelIndex(_create_objects())
+    np.testing.assert_array_equal(index.labels, [1, 3, 4, 6])
+    np.testing.assert_array_equal(index.areas, [25, 40, 40, 1])
+    np.testing.assert_array_almost_equal(
+        index.centroids, [[2, 5], [9.5, 14.5], [15.5, 27], [15, 2]]
+    )
+    np.testing.assert_array_equal(
+        index.bboxes,
+        [[0, 3, 5, 8], [8, 10, 12, 20], [12, 25, 20, 30], [15, 2, 16, 3]]
+    )
+    np.testing.assert_array_equal(
+        index.is_border, [True, False, True, False]
+    )
+
+
+def test_label_index_empty():
+    index = LabelIndex(np.zeros((5, 5), dtype=np.int32))
+    assert len(index) == 0
+    assert index.bboxes.shape == (0, 4)
+
+
+def test_segmented_objects_labels_and_border():
+    objects = SegmentedObjects('objects', 'objects')
+    array = np.stack([_create_objects(), _create_objects()], axis=-1)
+    array[..., 1][array[..., 1] == 6] = 7
+    objects.value = array
+    assert objects.labels == [1, 3, 4, 6, 7]
+    assert objects.is_border[(0, 1, 1)]
+    assert not objects.is_border[(0, 1, 7)]
+    assert (0, 0, 7) not in objects.is_border
+    objects.value = _create_objects()[..., np.newaxis]
+    assert objects.labels == [1, 3, 4, 6]
+
+
+def test_segmented_objects_iter_points():
+    objects = SegmentedObjects('objects', 'objects')
+    objects.value = _create_objects()
+    points = {
+        label: (p.x, p.y) for _, _, label, p in objects.iter_points(100, 50)
+    }
+    assert points == {1: (55, -102), 3: (64, -109), 4: (77, -115), 6: (52, -115)}
+
+
+def test_segmented_objects_add_measurement():
+    objects = SegmentedObjects('objects', 'objects')
+    objects.value = _create_objects()
+    measurement = Measurement('features', 'objects', 'objects')
+    measurement.value = [
+        pd.DataFrame({'area': [25, 40, 1]}, index=[1, 3, 6]),
+        pd.DataFrame({'area': [25, 40, 40, 1, 99]}, index=[1, 3, 4, 6, 8])
+    ]
+    objects.add_measurement(measurement)
+    data = objects.measurements
+    np.testing.assert_array_equal(data[0].index.values, [1, 3, 4, 6])
+    assert np.isnan(data[0].loc[4, 'area'])
+    assert data[0].loc[6, 'area'] == 1
+    np.testing.assert_array_equal(data[1].index.values, [1, 3, 4, 6])
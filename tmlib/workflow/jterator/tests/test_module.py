@@ -0,0 +1,37 @@
+import os
+
+from tmlib.workflow.jterator.module import ModuleRegistry
+
+
+def _create_source_file(tmpdir):
+    source_file = tmpdir.join('my_module.py')
+    source_file.write('VERSION = "0.1.0"\n')
+    return str(source_file)
+
+
+def test_module_registry_loads_once(tmpdir):
+    source_file = _create_source_file(tmpdir)
+    registry = ModuleRegistry()
+    calls = list()
+
+    def load():
+        calls.append(source_file)
+        return ('0.1.0', len)
+
+    for _ in range(3):
+        assert registry.get('Python', source_file, load) == ('0.1.0', len)
+    assert len(calls) == 1
+    assert len(registry) == 1
+
+
+def test_module_registry_reloads_modified_source(tmpdir):
+    source_file = _create_source_file(tmpdir)
+    registry = ModuleRegistry()
+    registry.get('Python', source_file, lambda: ('0.1.0', len))
+    mtime = os.path.getmtime(source_file)
+    os.utime(source_file, (mtime + 10, mtime + 10))
+    entry = registry.get('Python', source_file, lambda: ('0.2.0', sum))
+    assert entry == ('0.2.0', sum)
+    assert len(registry) == 1
+    registry.clear()
+    assert len(registry) == 0
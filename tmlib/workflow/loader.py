@@ -0,0 +1,148 @@
+# TmLibrary - TissueMAPS library for distibuted image analysis routines.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Loading of images for workflow steps.'''
+import copy
+import logging
+import itertools
+import collections
+from multiprocessing.pool import ThreadPool
+from sqlalchemy.orm import joinedload
+
+import tmlib.models as tm
+from tmlib.image import ChannelImage
+from tmlib.metadata import ChannelImageMetadata
+from tmlib.readers import DatasetReader
+
+logger = logging.getLogger(__name__)
+
+
+def _read_channel_image(location, metadata):
+    logger.debug('read image file: %s', location)
+    with DatasetReader(location) as f:
+        array = f.read('array')
+    # Files may be loaded more than once, but images must not share metadata.
+    return ChannelImage(array, copy.copy(metadata))
+
+
+class ChannelImageLoader(object):
+
+    '''Class for iterating over the images stored in a series of
+    :class:`ChannelImageFile <tmlib.models.file.ChannelImageFile>` instances.
+
+    Locations, residues and shifts of all files are retrieved from the
+    database upfront in a single session and upcoming images are read from
+    disk in background threads while the current image is processed.
+
+    Examples
+    --------
+    >>> loader = ChannelImageLoader(experiment_id, file_ids)
+    >>> for fid, image in zip(file_ids, loader):
+    ...     image.array
+    '''
+
+    def __init__(self, experiment_id, file_ids, n_threads=2, n_prefetch=4):
+        '''
+        Parameters
+        ----------
+        experiment_id: int
+            ID of the parent experiment
+        file_ids: List[int]
+            IDs of the channel image files in the order in which they should
+            be loaded
+        n_threads: int, optional
+            number of threads that read images in the background
+            (default: ``2``)
+        n_prefetch: int, optional
+            maximal number of images that are read ahead of the currently
+            processed image (default: ``4``)
+        '''
+        if n_threads < 1:
+            raise ValueError('Argument "n_threads" must be positive.')
+        if n_prefetch < 1:
+            raise ValueError('Argument "n_prefetch" must be positive.')
+        self.experiment_id = experiment_id
+        self.file_ids = list(file_ids)
+        self.n_threads = n_threads
+        self.n_prefetch = n_prefetch
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def _get_file_records(self):
+        logger.debug('query locations of %d image files', len(self.file_ids))
+        records = dict()
+        with tm.utils.ExperimentSession(self.experiment_id) as session:
+            files = session.query(tm.ChannelImageFile).\
+                options(joinedload(tm.ChannelImageFile.site)).\
+                filter(tm.ChannelImageFile.id.in_(set(self.file_ids))).\
+                all()
+            site_ids = set([f.site_id for f in files])
+            shifts = dict()
+            if site_ids:
+                site_shifts = session.query(
+                        tm.SiteShift.site_id, tm.SiteShift.cycle_id,
+                        tm.SiteShift.y, tm.SiteShift.x
+                    ).\
+                    filter(tm.SiteShift.site_id.in_(site_ids)).\
+                    all()
+                for s in site_shifts:
+                    shifts[(s.site_id, s.cycle_id)] = (s.y, s.x)
+            for f in files:
+                metadata = ChannelImageMetadata(
+                    channel_id=f.channel_id,
+                    site_id=f.site_id,
+                    tpoint=f.tpoint,
+                    zplane=f.zplane,
+                    cycle_id=f.cycle_id
+                )
+                metadata.bottom_residue = f.site.bottom_residue
+                metadata.top_residue = f.site.top_residue
+                metadata.left_residue = f.site.left_residue
+                metadata.right_residue = f.site.right_residue
+                if (f.site_id, f.cycle_id) in shifts:
+                    y, x = shifts[(f.site_id, f.cycle_id)]
+                    metadata.y_shift = y
+                    metadata.x_shift = x
+                records[f.id] = (f.location, metadata)
+        missing = set(self.file_ids) - set(records.keys())
+        if missing:
+            raise ValueError(
+                'Channel image files do not exist: %s'
+                % ', '.join(map(str, sorted(missing)))
+            )
+        return records
+
+    def __iter__(self):
+        records = self._get_file_records()
+        pool = ThreadPool(self.n_threads)
+        try:
+            pending = collections.deque()
+            ids = iter(self.file_ids)
+            for fid in itertools.islice(ids, self.n_prefetch):
+                pending.append(
+                    pool.apply_async(_read_channel_image, records[fid])
+                )
+            while pending:
+                image = pending.popleft().get()
+                fid = next(ids, None)
+                if fid is not None:
+                    pending.append(
+                        pool.apply_async(_read_channel_image, records[fid])
+                    )
+                yield image
+        finally:
+            pool.terminate()
+            pool.join()